@@ -0,0 +1,394 @@
+"""HTTP API serving chat queries and ingestion for the Streamlit UI and internal tools
+
+Usage (from the repository root, with secrets.toml in place):
+    python api.py --port 8000 --workers 4
+    uvicorn api:app --workers 4
+
+Requests carry either `X-Api-Key` (the [API] KEY secret) plus `X-User-Id`,
+which is how the Streamlit app and internal tools call in, or a Firebase ID
+token as `Authorization: Bearer <token>`.
+
+Each worker process owns its Backend resources and runs the blocking
+Snowflake and Firestore calls on a bounded thread pool. Its retrieval and
+answer caches are dropped when any worker ingests into the user's sources,
+through the per-user counters in the Firestore `source_versions`
+collection. Ingestion jobs run in the process that accepted them and are
+mirrored to the Firestore `ingestion_jobs` collection, so any worker can
+list or cancel them.
+"""
+import os
+import sys
+import hmac
+import time
+import socket
+import asyncio
+import logging
+import argparse
+from functools import partial
+from contextlib import asynccontextmanager, suppress
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+from config import section
+from ingestion import FINISHED
+from lazy import LazyImport
+from metrics import metrics
+
+auth = LazyImport("firebase_admin.auth")
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class QueryRequest(BaseModel):
+    query: str
+
+
+class SourceRequest(BaseModel):
+    url: str
+    priority: Optional[int] = None
+
+
+class JobMirror:
+    """Publishes this worker's ingestion jobs to Firestore and applies cancellations requested elsewhere"""
+    def __init__(self, db, scheduler, worker_id: str):
+        self.db = db
+        self.scheduler = scheduler
+        self.worker_id = worker_id
+        # job id -> last snapshot written, None until the first write
+        self._tracked: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._owners: Dict[str, str] = {}
+
+    def _collection(self):
+        return self.db.collection('ingestion_jobs')
+
+    def track(self, user_id: str, job_id: str) -> None:
+        self._owners[job_id] = user_id
+        self._tracked[job_id] = None
+
+    def sync(self) -> None:
+        """Write changed snapshots in one batch, drop pruned jobs and honour remote cancel requests"""
+        batch = self.db.batch()
+        writes = 0
+        published = {}
+        for job_id, last in list(self._tracked.items()):
+            snapshot = self.scheduler.job(job_id)
+            if snapshot is None:
+                batch.delete(self._collection().document(job_id))
+                del self._tracked[job_id]
+                del self._owners[job_id]
+                writes += 1
+                continue
+            if snapshot == last:
+                continue
+            batch.set(self._collection().document(job_id), dict(
+                snapshot, user_id=self._owners[job_id], worker=self.worker_id,
+            ), merge=True)
+            published[job_id] = snapshot
+            writes += 1
+        if writes:
+            batch.commit()
+            self._tracked.update(published)
+        if any(last is None or last["status"] not in FINISHED for last in self._tracked.values()):
+            requested = self._collection().where('worker', '==', self.worker_id) \
+                .where('cancel_requested', '==', True).stream()
+            for document in requested:
+                if document.id in self._tracked:
+                    self.scheduler.cancel(document.id)
+
+    def jobs(self, user_id: str) -> List[Dict[str, Any]]:
+        """The user's jobs from every worker, newest first; this worker's are read live"""
+        local = {job["job_id"]: job for job in self.scheduler.jobs(user_id)}
+        remote = [document.to_dict() for document in self._collection().where('user_id', '==', user_id).stream()]
+        merged = {job["job_id"]: job for job in remote if job.get("job_id")}
+        merged.update(local)
+        return sorted(merged.values(), key=lambda job: job.get("created_at") or 0, reverse=True)
+
+    def cancel(self, user_id: str, job_id: str) -> bool:
+        if self.scheduler.job(job_id) is not None:
+            return self.scheduler.cancel(job_id, user_id)
+        reference = self._collection().document(job_id)
+        snapshot = reference.get()
+        data = snapshot.to_dict() if snapshot.exists else None
+        if not data or data.get("user_id") != user_id or data.get("status") in FINISHED:
+            return False
+        reference.update({'cancel_requested': True})
+        return True
+
+
+class DevRagService:
+    """Per-process state behind the API: shared Backend resources, bounded pools and admission control"""
+    def __init__(self, settings: Dict[str, Any]):
+        self.settings = settings
+        self.executor = ThreadPoolExecutor(max_workers=settings.get("WORKER_THREADS", 64), thread_name_prefix="api")
+        self.admission = asyncio.Semaphore(settings.get("MAX_INFLIGHT", 256))
+        self.queue_timeout = settings.get("QUEUE_TIMEOUT", 5.0)
+        self.readiness_ttl = settings.get("READINESS_TTL", 10.0)
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.resources = None
+        self.jobs: Optional[JobMirror] = None
+        self._readiness_checked: Dict[str, float] = {}
+        self._sync_task: Optional[asyncio.Task] = None
+
+    async def run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+    async def start(self) -> None:
+        from backend import Resources  # heavy; imported once the worker process starts serving
+        self.resources = Resources.shared()
+        # Firestore (and the Firebase app token checks need) and Snowflake are ready before traffic arrives
+        memory = await self.run(lambda: self.resources.memory)
+        await self.run(self.resources.snowflake.ensure_connected)
+        self.jobs = JobMirror(memory.db, self.resources.ingestion, self.worker_id)
+        self._sync_task = asyncio.get_running_loop().create_task(self._sync_jobs())
+
+    async def stop(self) -> None:
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._sync_task
+        if self.resources is not None:
+            await self.run(self.resources.close)
+        self.executor.shutdown(wait=False)
+
+    async def _sync_jobs(self) -> None:
+        interval = self.settings.get("JOB_SYNC_INTERVAL", 1.0)
+        while True:
+            try:
+                await self.run(self.jobs.sync)
+            except Exception as e:
+                logger.warning(f"Failed to sync ingestion jobs: {e}")
+            await asyncio.sleep(interval)
+
+    async def admit(self) -> Callable[[], None]:
+        """Take one of MAX_INFLIGHT slots, or answer 503 once QUEUE_TIMEOUT passes; returns its release
+
+        The release may be called any number of times; only the first frees the slot.
+        """
+        try:
+            await asyncio.wait_for(self.admission.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("devrag_api_rejected_total")
+            raise HTTPException(status_code=503, detail="Server busy, retry shortly",
+                                headers={"Retry-After": str(int(self.queue_timeout) or 1)})
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self.admission.release()
+        return release
+
+    @asynccontextmanager
+    async def admitted(self) -> AsyncIterator[None]:
+        """Hold a slot for the duration of the block"""
+        release = await self.admit()
+        try:
+            yield
+        finally:
+            release()
+
+    async def backend(self, user_id: str):
+        """The user's Backend, with provisioning readiness refreshed at most every READINESS_TTL seconds"""
+        backend = self.resources.backend(user_id)
+        now = time.monotonic()
+        if now - self._readiness_checked.get(user_id, 0.0) > self.readiness_ttl:
+            self._readiness_checked[user_id] = now
+            try:
+                await self.run(backend.readiness)
+            except Exception as e:
+                logger.warning(f"Error checking provisioning status for {user_id}: {e}")
+        return backend
+
+    async def stream(self, iterator: Iterator[str]) -> AsyncIterator[str]:
+        """Drive a blocking generator on the pool, one item per hop"""
+        loop = asyncio.get_running_loop()
+        pending = None
+        try:
+            while True:
+                pending = loop.run_in_executor(self.executor, next, iterator, _DONE)
+                item = await asyncio.shield(pending)
+                pending = None
+                if item is _DONE:
+                    return
+                yield item
+        finally:
+            # A disconnect cancels the await, not the thread; let it finish before closing the generator
+            if pending is not None:
+                with suppress(Exception):
+                    await pending
+            await loop.run_in_executor(self.executor, iterator.close)
+
+
+def _settings() -> Dict[str, Any]:
+    return section("API")
+
+
+def get_service(request: Request) -> DevRagService:
+    return request.app.state.service
+
+
+async def current_user(request: Request, service: DevRagService = Depends(get_service)) -> str:
+    """User id from the service key headers or a Firebase ID token"""
+    key = service.settings.get("KEY")
+    supplied = request.headers.get("X-Api-Key")
+    if key and supplied and hmac.compare_digest(supplied, key):
+        user_id = request.headers.get("X-User-Id")
+        if not user_id:
+            raise HTTPException(status_code=400, detail="X-User-Id header is required")
+        return user_id
+    authorization = request.headers.get("Authorization", "")
+    if authorization.startswith("Bearer "):
+        try:
+            claims = await service.run(auth.verify_id_token, authorization[len("Bearer "):])
+            return claims["uid"]
+        except Exception:
+            pass
+    raise HTTPException(status_code=401, detail="Invalid credentials")
+
+
+def create_app(settings: Optional[Dict[str, Any]] = None) -> FastAPI:
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        service = DevRagService(settings if settings is not None else _settings())
+        await service.start()
+        app.state.service = service
+        try:
+            yield
+        finally:
+            await service.stop()
+
+    app = FastAPI(title="DevRag API", lifespan=lifespan)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.post("/v1/query")
+    async def query(body: QueryRequest, user_id: str = Depends(current_user),
+                    service: DevRagService = Depends(get_service)):
+        async with service.admitted():
+            backend = await service.backend(user_id)
+            try:
+                with metrics.span("api.query"):
+                    answer = await service.run(backend.query, body.query)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        return {"answer": answer}
+
+    @app.post("/v1/query/stream")
+    async def query_stream(body: QueryRequest, user_id: str = Depends(current_user),
+                           service: DevRagService = Depends(get_service)):
+        release = await service.admit()
+        try:
+            backend = await service.backend(user_id)
+        except BaseException:
+            release()
+            raise
+
+        async def tokens() -> AsyncIterator[str]:
+            # The slot is held until the answer has been streamed and stored
+            try:
+                async for token in service.stream(backend.query_stream(body.query)):
+                    yield token
+            finally:
+                release()
+
+        async def released() -> None:
+            # Runs on the event loop after the response, also when the body never started streaming
+            # (e.g. an early disconnect), where tokens() and its finally never run
+            release()
+
+        return StreamingResponse(tokens(), media_type="text/plain; charset=utf-8", background=BackgroundTask(released))
+
+    async def submitted(service: DevRagService, user_id: str, submit: Callable, *args) -> Dict[str, str]:
+        backend = await service.backend(user_id)
+        job_id = await service.run(submit(backend), *args)
+        service.jobs.track(user_id, job_id)
+        return {"job_id": job_id}
+
+    @app.post("/v1/ingest/github", status_code=202)
+    async def ingest_github(body: SourceRequest, user_id: str = Depends(current_user),
+                            service: DevRagService = Depends(get_service)):
+        return await submitted(service, user_id, lambda backend: backend.submit_github, body.url, body.priority)
+
+    @app.post("/v1/ingest/website", status_code=202)
+    async def ingest_website(body: SourceRequest, user_id: str = Depends(current_user),
+                             service: DevRagService = Depends(get_service)):
+        return await submitted(service, user_id, lambda backend: backend.submit_website, body.url, body.priority)
+
+    @app.post("/v1/ingest/pdf", status_code=202)
+    async def ingest_pdf(request: Request, name: str = "upload.pdf", priority: Optional[int] = None,
+                         user_id: str = Depends(current_user), service: DevRagService = Depends(get_service)):
+        """The PDF is the raw request body"""
+        limit = service.settings.get("MAX_UPLOAD_MB", 50) * 1024 * 1024
+        if int(request.headers.get("Content-Length") or 0) > limit:
+            raise HTTPException(status_code=413, detail="PDF is too large")
+        content = await request.body()
+        if not content:
+            raise HTTPException(status_code=400, detail="Empty upload")
+        if len(content) > limit:
+            raise HTTPException(status_code=413, detail="PDF is too large")
+        return await submitted(service, user_id, lambda backend: backend.submit_pdf_bytes, content, name, priority)
+
+    @app.get("/v1/ingest/jobs")
+    async def ingest_jobs(user_id: str = Depends(current_user), service: DevRagService = Depends(get_service)):
+        return {"jobs": await service.run(service.jobs.jobs, user_id)}
+
+    @app.get("/v1/ingest/jobs/{job_id}")
+    async def ingest_job(job_id: str, user_id: str = Depends(current_user),
+                         service: DevRagService = Depends(get_service)):
+        for job in await service.run(service.jobs.jobs, user_id):
+            if job["job_id"] == job_id:
+                return job
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    @app.delete("/v1/ingest/jobs/{job_id}")
+    async def cancel_job(job_id: str, user_id: str = Depends(current_user),
+                         service: DevRagService = Depends(get_service)):
+        return {"cancelled": await service.run(service.jobs.cancel, user_id, job_id)}
+
+    @app.get("/v1/readiness")
+    async def readiness(user_id: str = Depends(current_user), service: DevRagService = Depends(get_service)):
+        backend = service.resources.backend(user_id)
+        return {"sources": await service.run(backend.readiness)}
+
+    @app.post("/v1/provisioning/retry", status_code=202)
+    async def retry_provisioning(user_id: str = Depends(current_user),
+                                 service: DevRagService = Depends(get_service)):
+        await service.run(service.resources.backend(user_id).retry_provisioning)
+        service._readiness_checked.pop(user_id, None)
+        return {"status": "queued"}
+
+    @app.post("/v1/warmup", status_code=202)
+    async def warmup(user_id: str = Depends(current_user), service: DevRagService = Depends(get_service)):
+        # Runs on the resources' own warmup threads; the caller does not wait for it
+        await service.run(service.resources.warm, user_id)
+        return {"status": "warming"}
+
+    return app
+
+
+app = create_app()
+
+
+def main(argv=None) -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the DevRag HTTP API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, each with its own clients")
+    args = parser.parse_args(argv)
+    uvicorn.run("api:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,65 @@
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+
+class ApiClient:
+    """Backend's surface for the Streamlit app, served by api.py over HTTP
+
+    Lets the UI run as a thin client: Snowflake, Firestore and the ingestion
+    workers live in the API processes, not in each Streamlit server.
+    """
+    def __init__(self, base_url: str, api_key: str, user_id: str, timeout: float = 120.0):
+        self.base_url = base_url.rstrip("/")
+        self.user_id = user_id
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"X-Api-Key": api_key, "X-User-Id": user_id})
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def connect(self) -> None:
+        """Connections are held by the API"""
+
+    def readiness(self) -> Dict[str, str]:
+        return self._request("GET", "/v1/readiness").json()["sources"]
+
+    def retry_provisioning(self) -> None:
+        self._request("POST", "/v1/provisioning/retry")
+
+    def warmup(self) -> None:
+        """Ask the API to warm this user's query path; returns once the warmup is queued"""
+        response = self.session.post(f"{self.base_url}/v1/warmup", timeout=5.0)
+        response.raise_for_status()
+
+    def submit_pdf(self, pdf, priority: Optional[int] = None) -> str:
+        params = {"name": getattr(pdf, "name", "upload.pdf")}
+        if priority is not None:
+            params["priority"] = priority
+        return self._request("POST", "/v1/ingest/pdf", params=params, data=pdf.getvalue(),
+                             headers={"Content-Type": "application/pdf"}).json()["job_id"]
+
+    def submit_github(self, url: str, priority: Optional[int] = None) -> str:
+        return self._request("POST", "/v1/ingest/github", json={"url": url, "priority": priority}).json()["job_id"]
+
+    def submit_website(self, url: str, priority: Optional[int] = None) -> str:
+        return self._request("POST", "/v1/ingest/website", json={"url": url, "priority": priority}).json()["job_id"]
+
+    def ingestion_jobs(self) -> List[Dict[str, Any]]:
+        return self._request("GET", "/v1/ingest/jobs").json()["jobs"]
+
+    def cancel_ingestion(self, job_id: str) -> bool:
+        return self._request("DELETE", f"/v1/ingest/jobs/{job_id}").json()["cancelled"]
+
+    def query(self, query: str) -> str:
+        return self._request("POST", "/v1/query", json={"query": query}).json()["answer"]
+
+    def query_stream(self, query: str) -> Iterator[str]:
+        with self._request("POST", "/v1/query/stream", json={"query": query}, stream=True) as response:
+            response.encoding = "utf-8"
+            for text in response.iter_content(chunk_size=None, decode_unicode=True):
+                if text:
+                    yield text
@@ -1,43 +1,97 @@
 import streamlit as st
-import firebase_admin
-from firebase_admin import credentials, auth, firestore
 import re
 from datetime import datetime
-import snowflake.connector
-import threading
 import requests
 import time
 import json
 import asyncio
 import nest_asyncio
-from backend import Backend
-from concurrent.futures import ThreadPoolExecutor as ThreadpoolExecutor
+from lazy import LazyImport
+from storage import create_layout
+from provisioning import ProvisioningQueue, READY, FAILED
+
+# The landing and login pages only need Streamlit and the Firebase REST API;
+# the Admin SDK, Snowflake and the backend load when a page first uses them
+firebase_admin = LazyImport("firebase_admin")
+credentials = LazyImport("firebase_admin.credentials")
+auth = LazyImport("firebase_admin.auth")
+firestore = LazyImport("firebase_admin.firestore")
+snowflake_connector = LazyImport("snowflake.connector")
+
+
+@st.cache_data(show_spinner=False)
+def read_static(path):
+    """Stylesheets are read from disk once per process, not on every rerun"""
+    with open(path, 'r') as f:
+        return f.read()
+
+
+@st.cache_resource(show_spinner=False)
+def firestore_client():
+    """Firestore client shared by every session, initializing the Admin SDK on first use"""
+    if not firebase_admin._apps:
+        cred = credentials.Certificate({
+            "type": st.secret.FIREBASE.TYPE,
+            "project_id": st.secret.FIREBASE.PROJECT_ID,
+            "private_key_id": st.secret.FIREBASE.PRIVATE_KEY_ID,
+            "private_key": st.secret.FIREBASE.PRIVATE_KEY.replace('\\n', '\n'),
+            "client_email": st.secret.FIREBASE.CLIENT_EMAIL,
+            "client_id": st.secret.FIREBASE.CLIENT_ID,
+            "auth_uri": st.secret.FIREBASE.AUTH_URI,
+            "token_uri": st.secret.FIREBASE.TOKEN_URI,
+            "auth_provider_x509_cert_url": st.secret.FIREBASE.AUTH_PROVIDER_X509_CERT_URL,
+            "client_x509_cert_url": st.secret.FIREBASE.CLIENT_X509_CERT_URL,
+            "universe_domain": st.secret.FIREBASE.UNIVERSE_DOMAIN
+        })
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
+
+@st.cache_resource(show_spinner="Starting DevRag...")
+def backend_resources():
+    """Snowflake, Firestore, Mistral and ingestion clients, created once per process"""
+    from backend import Resources
+    nest_asyncio.apply()
+    return Resources.shared()
+
+
+def start_warmup(user_id: str) -> None:
+    """Warm the user's query path in the background while the app loads after login"""
+    api = st.secret.get("API", {})
+    try:
+        if api.get("URL"):
+            from api_client import ApiClient
+            ApiClient(api.URL, api.KEY, user_id).warmup()
+        else:
+            backend_resources().warm(user_id)
+    except Exception as e:
+        # Only an optimization; the first query does the work instead
+        print(f"Warmup for {user_id} could not start: {e}")
 
 class FirebaseAuth:
     def __init__(self):
         # with open('secrets.toml', 'r') as file:
         #     st.secret = toml.load(file)
-        if not firebase_admin._apps:
-            cred = credentials.Certificate({
-                "type": st.secret.FIREBASE.TYPE,
-                "project_id": st.secret.FIREBASE.PROJECT_ID,
-                "private_key_id": st.secret.FIREBASE.PRIVATE_KEY_ID,
-                "private_key": st.secret.FIREBASE.PRIVATE_KEY.replace('\\n', '\n'),
-                "client_email": st.secret.FIREBASE.CLIENT_EMAIL,
-                "client_id": st.secret.FIREBASE.CLIENT_ID,
-                "auth_uri": st.secret.FIREBASE.AUTH_URI,
-                "token_uri": st.secret.FIREBASE.TOKEN_URI,
-                "auth_provider_x509_cert_url": st.secret.FIREBASE.AUTH_PROVIDER_X509_CERT_URL,
-                "client_x509_cert_url": st.secret.FIREBASE.CLIENT_X509_CERT_URL,
-                "universe_domain": st.secret.FIREBASE.UNIVERSE_DOMAIN
-            })
-            firebase_admin.initialize_app(cred)
-        self.db = firestore.client()
         self.api_key = st.secret.FIREBASE.API_KEY
 
+    @property
+    def db(self):
+        return firestore_client()
+
+    @property
+    def provisioning(self) -> ProvisioningQueue:
+        storage = st.secret.get("STORAGE", {})
+        return ProvisioningQueue.shared(
+            self.db,
+            self._get_snowflake_connection,
+            create_layout(storage),
+            st.secret.SNOWFLAKE.WAREHOUSE,
+            workers=storage.get("PROVISIONING_WORKERS", 4),
+        )
+
     def _get_snowflake_connection(self):
         """Create and return a Snowflake connection"""
-        return snowflake.connector.connect(
+        return snowflake_connector.connect(
             user=st.secret.SNOWFLAKE.USER,
             password=st.secret.SNOWFLAKE.PASSWORD,
             account=st.secret.SNOWFLAKE.ACCOUNT,
@@ -46,40 +100,6 @@ class FirebaseAuth:
             warehouse=st.secret.SNOWFLAKE.WAREHOUSE
         )
 
-    def _setup_snowflake_resources(self, user_id):
-        """Set up Snowflake tables and search services for a user"""
-        try:
-            conn = self._get_snowflake_connection()
-            cursor = conn.cursor()
-
-            # Create tables
-            tables = ['pdf', 'github', 'rag']
-            for table in tables:
-                create_table_query = f"""
-                    CREATE TABLE IF NOT EXISTS {user_id}_{table} (
-                    content STRING
-                    );"""
-                cursor.execute(create_table_query)
-
-            # Create search services
-            for service in tables:
-                create_search_query = f"""
-                    CREATE OR REPLACE CORTEX SEARCH SERVICE {user_id}_{service}search
-                    ON content
-                    WAREHOUSE = '{st.secret.SNOWFLAKE.WAREHOUSE}'
-                    TARGET_LAG = '1 minutes'
-                    EMBEDDING_MODEL = 'snowflake-arctic-embed-l-v2.0'
-                    AS (
-                        SELECT content
-                        FROM {user_id}_{service}
-                    );"""
-                cursor.execute(create_search_query)
-
-            cursor.close()
-            conn.close()
-        except Exception as e:
-            print(f"Error setting up Snowflake resources: {e}")
-
     def validate_email(self, email):
         """Validate email format"""
         email_pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -138,17 +158,11 @@ class FirebaseAuth:
                     'email': email,
                     'created_at': datetime.now(),
                     **additional_data,
-                    "past_conversations": [],
-                    "conversation_summary": []
                 }
                 self.db.collection('user_data').document(user.uid).set(user_data)
 
-            # Start Snowflake setup in background thread
-            threading.Thread(
-                target=self._setup_snowflake_resources,
-                args=(user.uid,),
-                daemon=True
-            ).start()
+            # Queue the Snowflake tables and search services; readiness is tracked per source
+            self.provisioning.enqueue(user.uid)
 
             return user.uid
         except Exception as e:
@@ -196,8 +210,7 @@ class BasePage:
         self.load_styles()
 
     def load_styles(self):
-        with open('static/login.css', 'r') as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_static('static/login.css')}</style>", unsafe_allow_html=True)
 
 class LoginPage(BasePage):
     def __init__(self, auth):
@@ -236,6 +249,7 @@ class LoginPage(BasePage):
                     try:
                         self.user_id = self.auth.login_user(email, password)
                         st.session_state.user_id = self.user_id
+                        start_warmup(self.user_id)
                         st.success("Login successful!")
                         time.sleep(2)
                         st.rerun()
@@ -370,8 +384,7 @@ class Landing:
         )
 
     def load_custom_css(self):
-        with open('static/styles.css', 'r') as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_static('static/styles.css')}</style>", unsafe_allow_html=True)
 
     def create_navbar(self):
         st.markdown("""
@@ -531,34 +544,21 @@ class Chatbot:
     def __init__(self):
         self.load_custom_css()
         self.initialize_session_state()
-        self.backend = Backend(st.session_state.user_id)
-        nest_asyncio.apply()
-
-    async def process_github_async(self, url: str):
-        """Async function to process GitHub URL"""
-        try:
-            await self.backend.github_scraper(url)
-            return True, None
-        except Exception as e:
-            return False, str(e)
-
-    def run_async_in_thread(self, url: str):
-        """Run async code in a separate thread"""
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            success, error = loop.run_until_complete(self.process_github_async(url))
-            return success, error
-        finally:
-            loop.close()
+        api = st.secret.get("API", {})
+        if api.get("URL"):
+            # Thin client: queries and ingestion run in the API service (api.py)
+            from api_client import ApiClient
+            self.backend = ApiClient(api.URL, api.KEY, st.session_state.user_id)
+        else:
+            # A lookup on process-wide clients; nothing is built on a rerun
+            self.backend = backend_resources().backend(st.session_state.user_id)
 
     def connect_to_snowflake(self):
-        self.backend.snowflake_manager.connect() 
+        self.backend.connect()
 
     def load_custom_css(self):
         # Load custom CSS styles
-        with open('static/chatbot.css', 'r') as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{read_static('static/chatbot.css')}</style>", unsafe_allow_html=True)
 
     def initialize_session_state(self):
         # Initialize session states
@@ -568,6 +568,16 @@ class Chatbot:
             st.session_state.show_sidebar = False
         if "sidebar_type" not in st.session_state:
             st.session_state.sidebar_type = None
+        if "submitted_sources" not in st.session_state:
+            st.session_state.submitted_sources = set()
+
+    def submit_once(self, key, submit):
+        """Inputs keep their value across reruns; only queue each source the first time it is seen"""
+        if key in st.session_state.submitted_sources:
+            return
+        st.session_state.submitted_sources.add(key)
+        submit()
+        st.toast("Queued for processing. You can keep chatting meanwhile.")
 
     def handle_sidebar_input(self, input_type):
         with st.sidebar:
@@ -575,29 +585,36 @@ class Chatbot:
             if input_type == "PDF":
                 uploaded_file = st.file_uploader("Upload PDF", type="pdf")
                 if uploaded_file:
-                    self.backend.pdf_scraper(uploaded_file)
-                    st.success("PDF uploaded successfully!")
+                    self.submit_once(("pdf", uploaded_file.file_id), lambda: self.backend.submit_pdf(uploaded_file))
             elif input_type == "GitHub":
                 github_input = st.text_input(f"Enter {input_type} URL")
                 if github_input:
-                    try:
-                        with ThreadpoolExecutor() as executor:
-                            future = executor.submit(self.run_async_in_thread, github_input)
-                            success, error = future.result()
-                        if success:
-                            st.success(f"{input_type} Repository processed successfully!")
-                        else:
-                            st.error(f"Error processing {input_type} Repository: {error}")
-                    except Exception as e:
-                        st.error(f"Error processing {input_type} Repository: {str(e)}")
-                    
+                    self.submit_once(("github", github_input), lambda: self.backend.submit_github(github_input))
             elif input_type == "Website":
                 url_input = st.text_input(f"Enter {input_type} URL")
                 if url_input:
-                    st.success(f"{input_type} URL processed successfully!")
-                    self.backend.web_crawler(url_input)
+                    self.submit_once(("web", url_input), lambda: self.backend.submit_website(url_input))
+            self.display_ingestion_jobs()
         return None
 
+    def display_ingestion_jobs(self):
+        @st.fragment(run_every=2)
+        def jobs_panel():
+            jobs = self.backend.ingestion_jobs()
+            if not jobs:
+                return
+            st.subheader("Processing")
+            for job in jobs:
+                text = f"{job['kind']}: {job['label']} ({job['stage']})"
+                st.progress(job["progress"], text=text)
+                if job["status"] in ("queued", "running"):
+                    if st.button("Cancel", key=f"cancel-{job['job_id']}"):
+                        self.backend.cancel_ingestion(job["job_id"])
+                elif job["status"] == "failed":
+                    st.error(f"Error processing {job['label']}: {job['error']}")
+
+        jobs_panel()
+
     def display_chat_history(self):
         # Display chat history with avatars
         for message in st.session_state.messages:
@@ -650,24 +667,39 @@ class Chatbot:
             with st.chat_message("user", avatar="https://cdn-icons-png.flaticon.com/512/1144/1144760.png"):
                 st.write(prompt)
 
-            # Add assistant message to chat history with avatar
-            response = self.backend.query(prompt)
+            # Stream the assistant reply, then add it to chat history with avatar
+            with st.chat_message("assistant", avatar="https://cdn-icons-png.flaticon.com/512/4711/4711987.png"):
+                response = st.write_stream(self.backend.query_stream(prompt))
             st.session_state.messages.append({
                 "role": "assistant",
                 "content": response,
                 "avatar": "https://cdn-icons-png.flaticon.com/512/4711/4711987.png"
             })
-            with st.chat_message("assistant", avatar="https://cdn-icons-png.flaticon.com/512/4711/4711987.png"):
-                st.write(response)
+
+    def check_readiness(self):
+        """Leave sources whose search services are still being created out of queries"""
+        try:
+            readiness = self.backend.readiness()
+        except Exception as e:
+            print(f"Error checking provisioning status: {e}")
+            return
+        pending = {source for source, status in readiness.items() if status != READY}
+        if not pending:
+            return
+        if any(status == FAILED for status in readiness.values()):
+            st.error("Setting up your workspace failed.")
+            if st.button("Retry setup"):
+                self.backend.retry_provisioning()
+                st.rerun()
+        else:
+            st.info("Your workspace is still being set up. Sources will become searchable in a moment.")
 
     def run(self):
-        if st.session_state.snowflake_manager is None:
-            from backend import SnowflakeManager
-            print("Initializing SnowflakeManager...")
-            st.session_state.snowflake_manager = SnowflakeManager(user_id=st.session_state.user_id)
-            st.session_state.snowflake_manager.connect()
+        # Connects once per process; later reruns and sessions return at once
+        self.backend.connect()
 
         st.title("User", anchor=False)
+        self.check_readiness()
         self.display_chat_history()
         self.handle_chat_input()
 
@@ -692,8 +724,14 @@ class App:
         self.login = LoginPage(self.auth)
         self.signup = SignupPage(self.auth)
         self.forgot_password = ForgotPasswordPage(self.auth)
-        self.chatbot = Chatbot()
-        self.snowflake_manager = None
+        self._chatbot = None
+
+    @property
+    def chatbot(self):
+        """Built on first visit so the backend is never imported for the landing and auth pages"""
+        if self._chatbot is None:
+            self._chatbot = Chatbot()
+        return self._chatbot
 
     def handle_page_config(self):
         if st.session_state.current_page == 'landing':
@@ -714,8 +752,6 @@ class App:
             st.session_state.user_id = None
         if 'authentication_status' not in st.session_state:
             st.session_state.authentication_status = None
-        if 'snowflake_manager' not in st.session_state:
-            st.session_state.snowflake_manager = None
 
     def handle_navigation(self):
         """Handle navigation between pages based on session state"""
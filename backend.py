@@ -1,33 +1,63 @@
+import io
 import os
 import re
 import json
+import time
+import atexit
 import asyncio
 import logging
-from typing import List, Optional, Dict, Any
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import toml
+import threading
+import contextvars
+from typing import List, Optional, Dict, Any, Iterator, Set, Callable, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 import tempfile
 from functools import partial
+from contextlib import contextmanager
 import nest_asyncio
 # Middleware Libraries
 
+from lazy import LazyImport
+
+# Heavy dependencies are imported on first use of the feature that needs them,
+# so pages that never scrape, query or summarize do not pay for them at startup
+
 # Core Libraries
-from dotenv import load_dotenv
-from bs4 import BeautifulSoup
-from playwright.async_api import async_playwright
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import PyPDF2
+BeautifulSoup = LazyImport("bs4", "BeautifulSoup")
+async_playwright = LazyImport("playwright.async_api", "async_playwright")
+RecursiveCharacterTextSplitter = LazyImport("langchain.text_splitter", "RecursiveCharacterTextSplitter")
+PyPDF2 = LazyImport("PyPDF2")
 
 # Database and External Services
-import snowflake.connector
-from snowflake.snowpark import Session
-from snowflake.core import Root
-import firebase_admin
-from firebase_admin import credentials, firestore
+snowflake_connector = LazyImport("snowflake.connector")
+Session = LazyImport("snowflake.snowpark", "Session")
+firebase_admin = LazyImport("firebase_admin")
+credentials = LazyImport("firebase_admin.credentials")
+firestore = LazyImport("firebase_admin.firestore")
 
 # AI Integration
-from mistralai import Mistral
-from crawl4ai import AsyncWebCrawler
+Mistral = LazyImport("mistralai", "Mistral")
+AsyncWebCrawler = LazyImport("crawl4ai", "AsyncWebCrawler")
+
+# Local Modules
+from config import load_config
+from cache import RetrievalCache, AnswerCache, SourceVersions
+from retrieval import RetrievalBackend, CortexSearchBackend
+from lexical import LexicalBackend, HybridBackend
+from fusion import merge_results
+from prompt import PromptBuilder, count_tokens, get_tokenizer
+from completion import StreamingCompleter, CortexRestCompleter, FakeCompleter
+from metrics import TOKEN_BUCKETS, metrics
+from storage import StorageLayout, create_layout
+from ingestion import IngestJob, IngestionScheduler
+from writer import IngestWriter
+from connections import ConnectionPool, PooledConnection
+from history import HistoryStore
+from memory_cache import ConversationCache
+from summarizer import Summarizer
+from browsers import BrowserPool
+from chunk_store import ChunkStore
+from chunks import Chunk, document_id
+from provisioning import READY as PROVISIONED, ProvisioningQueue
 
 # Configure Logging
 logging.basicConfig(
@@ -36,12 +66,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Ingestion kind -> storage source its chunks are inserted into
+STAGED_SOURCES = {"web": "personal", "github": "github", "pdf": "pdf"}
+
 class ScraperBase:
     """Base class for all scrapers with common functionality"""
-    def __init__(self, url: str = ''):
+    def __init__(self, url: str = '', crawler=None):
         self.url = url
         self.visited = set()
-        self.crawler = AsyncWebCrawler()
+        # A crawler passed in is already started and shared, so the scraper must not stop it
+        self.shared_crawler = crawler is not None
+        self.crawler = crawler or AsyncWebCrawler()
 
     def is_valid_url(self, url: str) -> bool:
         """Validate URL format"""
@@ -49,16 +84,22 @@ class ScraperBase:
 
 class WebScraper(ScraperBase):
     """Advanced web scraping with depth-first search"""
-    def __init__(self, url: str, max_depth: int = 3):
-        super().__init__(url)
+    def __init__(self, url: str, max_depth: int = 3, crawler=None):
+        super().__init__(url, crawler)
         self.max_depth = max_depth
         self.scrape_content: List[str] = []
+        self.on_page: Optional[Callable[[int], None]] = None
         self.unwanted = ['signup', 'signin', 'register', 'login', 'billing', 'pricing', 'contact']
         self.social_media = ['youtube', 'twitter', 'facebook', 'linkedin']
 
-    async def scrape(self) -> List[str]:
+    async def scrape(self, on_page: Optional[Callable[[int], None]] = None) -> List[str]:
         """Orchestrate web scraping process"""
-        await self._recursive_scrape(self.url, 0)
+        self.on_page = on_page
+        if self.shared_crawler:
+            await self._recursive_scrape(self.url, 0)
+        else:
+            async with self.crawler:
+                await self._recursive_scrape(self.url, 0)
         return self.scrape_content
 
     async def _recursive_scrape(self, url: str, depth: int) -> None:
@@ -68,7 +109,7 @@ class WebScraper(ScraperBase):
 
         self.visited.add(url)
         try:
-            data = await self.crawler.run(
+            data = await self.crawler.arun(
                 url=url,
                 magic=True,
                 simulate_user=True,
@@ -77,7 +118,9 @@ class WebScraper(ScraperBase):
                 exclude_social_media_links=True,
             )
             if data and data.markdown:
-                self.scrape_content.append(data.markdown)
+                self.scrape_content.append(str(data.markdown))
+                if self.on_page:
+                    self.on_page(len(self.scrape_content))
 
                 links = [
                     link for link in self._extract_links(data.html)
@@ -98,8 +141,9 @@ class WebScraper(ScraperBase):
         ]
 
 class GithubScraper:
-    def __init__(self, url: str):
+    def __init__(self, url: str, browsers: Optional[BrowserPool] = None):
         self.url = self.url_changer(url)
+        self.browsers = browsers
 
     def url_changer(self, url) -> str:
         """Change GitHub URL to alternative domain"""
@@ -108,6 +152,11 @@ class GithubScraper:
     async def scrape_content(self) -> Optional[str]:
         """Scrape webpage content using Playwright"""
         try:
+            if self.browsers is not None:
+                async with self.browsers.page() as page:
+                    await page.goto(self.url, timeout=30000)
+                    await page.wait_for_timeout(5000)
+                    return await page.content()
             async with async_playwright() as p:
                 browser = await p.chromium.launch(headless=True)
                 page = await browser.new_page()
@@ -179,6 +228,12 @@ class PDFScraper:
             extracted_text = self.clean_text(extracted_text)
         return extracted_text
     
+    def extract_bytes(self, data: bytes) -> str:
+        """Extract text from an in-memory PDF (picklable, so it can run in a worker process)"""
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        extracted_text = "".join((page.extract_text() or "") + "\n" for page in reader.pages)
+        return self.clean_text(extracted_text)
+
     def handle_pdf_upload(self,pdf_file):
         if pdf_file is not None:
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
@@ -196,14 +251,31 @@ class TextProcessor:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
 
+    @property
+    def key(self) -> str:
+        """Names this chunking configuration in the chunk store"""
+        return f"recursive:{self.chunk_size}:{self.chunk_overlap}"
+
     def chunk_text(self, text: str) -> List[str]:
+        return [chunk.content for chunk in self.chunk_records(text)]
+
+    def chunk_records(self, text: str, source: str = "", document: str = "") -> List[Chunk]:
+        """Chunks of one document, numbered in order with their offsets in `text`"""
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=self.chunk_size,
             chunk_overlap=self.chunk_overlap,
             separators=["\n\n", "\n", ".", " ", ""]
         )
-        chunks = text_splitter.split_text(text)
-        return [chunk.replace('\n', '') for chunk in chunks]
+        records = []
+        cursor = 0
+        for ordinal, chunk in enumerate(text_splitter.split_text(text)):
+            # Chunks come in order and overlap, so each is found at or after the previous start
+            start = text.find(chunk, cursor)
+            if start >= 0:
+                cursor = start + 1
+            end = start + len(chunk) if start >= 0 else -1
+            records.append(Chunk(chunk.replace('\n', ''), source, document, ordinal, start, end))
+        return records
 
 class SnowflakeManager:
     _instance = None  # Singleton instance
@@ -219,9 +291,8 @@ class SnowflakeManager:
         
         self.user_id = user_id
         print(f"Initializing Snowflake Manager... : userid {user_id}")
-        with open('secrets.toml', 'r') as f:
-            self.secrets = toml.load(f)
-        
+        self.secrets = load_config()
+
         self.connection_params = {
             "account": self.secrets["SNOWFLAKE"]["ACCOUNT"],
             "user": self.secrets["SNOWFLAKE"]["USER"],
@@ -231,178 +302,418 @@ class SnowflakeManager:
             "warehouse": self.secrets["SNOWFLAKE"]["WAREHOUSE"],
             "schema": self.secrets["SNOWFLAKE"]["SCHEMA"],
         }
-        self.session = None
-        self.conn = None
-        self.cursor = None
+        # Searches, completions and writes each check out their own connection
+        self.pool = ConnectionPool(
+            self._open_connection,
+            size=self.secrets["SNOWFLAKE"].get("POOL_SIZE", 8),
+            timeout=self.secrets["SNOWFLAKE"].get("POOL_TIMEOUT", 30.0),
+        )
+        self.storage: StorageLayout = create_layout(self.secrets.get("STORAGE"))
+        self.retrieval_cache = RetrievalCache()
+        caching = self.secrets.get("CACHE", {})
+        self.answer_cache = AnswerCache(
+            threshold=caching.get("ANSWER_THRESHOLD", 0.85),
+            max_entries_per_user=caching.get("ANSWER_ENTRIES", 256),
+            ttl=caching.get("ANSWER_TTL", 3600.0),
+        )
+        # Lets ingestion in another worker process invalidate this one's caches
+        self.source_versions = SourceVersions(
+            lambda: Memory.shared().db, firestore, refresh_interval=caching.get("VERSION_INTERVAL", 1.0),
+        )
+        self.retrieval_backend = self._create_retrieval_backend()
+        self.prompt_builder = PromptBuilder(self.secrets.get("PROMPT_BUDGETS"))
+        self.completer = self._create_completer()
+        # Sources whose search services are still being provisioned, per user
+        self.unavailable_sources: Dict[str, Set[str]] = {}
+        # Set by Resources; deletes are recorded there so a backfill does not bring the documents back
+        self.chunk_store: Optional[ChunkStore] = None
+        # Tables known to have the provenance columns
+        self._upgraded_tables: Set[str] = set()
+        self._upgrade_lock = threading.Lock()
+        # Long-lived pools: one for the per-service search fan-out, one for the
+        # query stages that run side by side (retrieval and memory lookup)
+        self._search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+        self._stage_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query-stage")
+        ingestion = self.secrets.get("INGESTION", {})
+        self.writer = IngestWriter(
+            self.connection,
+            flush_rows=ingestion.get("FLUSH_ROWS", 500),
+            flush_interval=ingestion.get("FLUSH_INTERVAL", 0.25),
+            max_pending_rows=ingestion.get("MAX_PENDING_ROWS", 20000),
+        )
+        self._configure_metrics()
         self._initialized = True
 
-    def connect(self):
-        """Connect to Snowflake (only once)."""
-        if self.conn is None or self.session is None or self.cursor is None:
-            try:
-                print("Connecting to Snowflake...")
-                self.conn = snowflake.connector.connect(**self.connection_params)
-                self.cursor = self.conn.cursor()
-                self.session = Session.builder.configs(self.connection_params).create()
-                print("Snowflake connection established successfully.")
-            except Exception as e:
-                print(f"Failed to connect to Snowflake: {e}")
-                self.conn = None
-                self.cursor = None
-                self.session = None
+    def _configure_metrics(self) -> None:
+        """Enable instrumentation from the optional [METRICS] secrets section"""
+        settings = self.secrets.get("METRICS", {})
+        metrics.configure(
+            enabled=settings.get("ENABLED", False),
+            port=settings.get("PORT"),
+            export_path=settings.get("EXPORT_PATH"),
+            export_interval=settings.get("EXPORT_INTERVAL", 15.0),
+            trace_path=settings.get("TRACE_PATH"),
+        )
+        metrics.register_collector(self._cache_gauges)
+        metrics.register_collector(self._pool_gauges)
+
+    def _cache_gauges(self):
+        for name, cache in (("retrieval", self.retrieval_cache), ("answer", self.answer_cache)):
+            stats = cache.stats()
+            yield "devrag_cache_hits", {"cache": name}, stats["hits"]
+            yield "devrag_cache_misses", {"cache": name}, stats["misses"]
+            yield "devrag_cache_entries", {"cache": name}, stats["size"]
+
+    def _pool_gauges(self):
+        stats = self.pool.stats()
+        yield "devrag_snowflake_connections", {"state": "idle"}, stats["idle"]
+        yield "devrag_snowflake_connections", {"state": "in_use"}, stats["open"] - stats["idle"]
+
+    def _create_completer(self) -> StreamingCompleter:
+        """Streaming completer from the optional [CORTEX] section; "fake" runs without a warehouse"""
+        cortex = self.secrets.get("CORTEX", {})
+        if cortex.get("COMPLETER", "rest") == "fake":
+            return FakeCompleter(answer=cortex.get("FAKE_ANSWER"))
+        return CortexRestCompleter(self.connection, model=cortex.get("MODEL", "mistral-large2"))
+
+    def _open_connection(self) -> PooledConnection:
+        conn = snowflake_connector.connect(**self.connection_params)
+        return PooledConnection(conn, lambda conn: Session.builder.configs({"connection": conn}).create())
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """A connector connection checked out of the pool for one operation"""
+        with self.pool.connection() as pooled:
+            yield pooled.conn
+
+    def _create_retrieval_backend(self) -> RetrievalBackend:
+        """Pick the retrieval backend from the optional [RETRIEVAL] secrets section"""
+        retrieval = self.secrets.get("RETRIEVAL", {})
+        if retrieval.get("BACKEND", "cortex") == "local":
+            from retrieval import LocalVectorBackend
+            backend = LocalVectorBackend(
+                index_dir=retrieval.get("INDEX_DIR", ".devrag/index"),
+                ivf_threshold=retrieval.get("IVF_THRESHOLD", 50000),
+                nprobe=retrieval.get("NPROBE", 8),
+                compact_ratio=retrieval.get("COMPACT_RATIO", 0.25),
+            )
+        else:
+            backend = CortexSearchBackend(
+                self.pool.connection,
+                self.secrets["SNOWFLAKE"]["DATABASE"],
+                self.secrets["SNOWFLAKE"]["SCHEMA"],
+            )
+        if retrieval.get("HYBRID", True):
+            lexical = LexicalBackend(index_dir=retrieval.get("LEXICAL_DIR", ".devrag/lexical"))
+            backend = HybridBackend(backend, lexical)
+        return backend
+
+    def connect(self) -> bool:
+        """Open the pool's first connection if none is open yet; False if Snowflake cannot be reached"""
+        try:
+            self.pool.prime()
+            return True
+        except Exception as e:
+            print(f"Failed to connect to Snowflake: {e}")
+            return False
 
     def disconnect(self):
-        if self.cursor:
-            self.cursor.close()
-        if self.conn:
-            self.conn.close()
-        if self.session:
-            self.session.close()
-        self.conn = None
-        self.cursor = None
-        self.session = None
-
-    def ensure_connected(self):
+        self.pool.close()
+
+    def close(self) -> None:
+        """Write pending rows, stop the worker pools and disconnect"""
+        self.writer.close()
+        self._search_executor.shutdown(wait=False)
+        self._stage_executor.shutdown(wait=False)
+        try:
+            self.disconnect()
+        except Exception as e:
+            print(f"Error closing Snowflake connection: {e}")
+
+    def ensure_connected(self) -> bool:
         """Ensure connection is active."""
-        if self.conn is None or self.session is None or self.cursor is None:
-            self.connect()
+        return self.connect()
 
-    def _insert(self, table_name: str, contents: List[str]) -> None:
-        self.ensure_connected()
-        if contents:
-            try:
-                insert_queries = [f"INSERT INTO {table_name} (content) VALUES ('{content}')" for content in contents]
-                for query in insert_queries:
-                    self.cursor.execute(query)
-                self.conn.commit()
-            except Exception as e:
-                print(f"Error inserting into {table_name}: {e}")
-
-    def insert_into_github_rag(self, user_id ,contents: List[str]) -> None:
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(self._insert, f"{user_id}_github", contents): user_id}
-            for future in as_completed(futures):
-                try:
-                    future.result()  # This will raise an exception if the insert failed
-                except Exception as e:
-                    print(f"Error inserting into {user_id}_github: {e}")
-
-    def insert_into_personal_rag(self, user_id, contents: List[str]) -> None:
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(self._insert, f"{user_id}_rag", contents): user_id}
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Error inserting into {user_id}_rag: {e}")
-
-    def insert_into_pdf_rag(self, user_id ,contents: List[str]) -> None:
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(self._insert, f"{user_id}_pdf", contents): user_id}
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"Error inserting into {user_id}_pdf: {e}")
-
-    def _search_service(self, service_name: str, query: str) -> str:
-        self.ensure_connected
+    def _insert(self, user_id: str, source: str, chunks: List[Chunk], origin: Optional[str] = None) -> Future:
+        """Index chunks and queue their rows on the ingest writer; the Future resolves once committed
+
+        The rows replace whatever was stored for the same document before,
+        in the warehouse table and in the local indexes.
+        """
+        with metrics.span("insert", source=source):
+            if chunks:
+                service, tenant = self.storage.service(user_id, source), self.storage.tenant(user_id)
+                documents = [chunk.document_id for chunk in chunks]
+                self.retrieval_backend.delete(service, sorted(set(documents)), tenant)
+                self.retrieval_backend.add(service, [chunk.content for chunk in chunks], tenant, documents)
+            if not self.retrieval_backend.uses_warehouse or not chunks:
+                self._on_written(user_id, source, len(chunks))
+                written: Future = Future()
+                written.set_result(len(chunks))
+                return written
+            self._upgrade_table(user_id, source)
+            statement, rows = self.storage.insert(user_id, source, chunks, origin)
+            future = self.writer.write(statement, rows,
+                                       replaces=(self.storage.delete(user_id, source), chunks[0].document_id))
+        future.add_done_callback(partial(self._on_write_done, user_id, source))
+        return future
+
+    def replace_document(self, user_id: str, source: str, chunks: List[Chunk], origin: Optional[str]) -> Future:
+        """Swap in a document's new chunks, or delete it when there are none"""
+        if not chunks:
+            return self.delete_document(user_id, source, origin)
+        return self._insert(user_id, source, chunks, origin)
+
+    def delete_document(self, user_id: str, source: str, origin: Optional[str]) -> Future:
+        """Remove every chunk of one document with a single set-based DELETE; resolves once committed"""
+        if self.chunk_store is not None:
+            self.chunk_store.delete(user_id, source, origin)
+        document = document_id(user_id, source, origin)
+        removed = self.retrieval_backend.delete(
+            self.storage.service(user_id, source), [document], self.storage.tenant(user_id))
+        if not self.retrieval_backend.uses_warehouse:
+            self._invalidate_caches(user_id, source)
+            deleted: Future = Future()
+            deleted.set_result(removed)
+            return deleted
+        self._upgrade_table(user_id, source)
+        future = self.writer.delete(self.storage.delete(user_id, source), document)
+        future.add_done_callback(lambda _: self._invalidate_caches(user_id, source))
+        return future
+
+    def _upgrade_table(self, user_id: str, source: str) -> None:
+        """Add the provenance columns to a table created before them, once per table and process"""
+        table = self.storage.table(user_id, source)
+        if table in self._upgraded_tables:
+            return
+        with self._upgrade_lock:
+            if table not in self._upgraded_tables:
+                self.writer.execute(self.storage.upgrade_statements(user_id, source))
+                self._upgraded_tables.add(table)
+
+    def _on_write_done(self, user_id: str, source: str, future: Future) -> None:
         try:
-            root = Root(self.session)
-            search_service = (
-                root.databases[self.secrets["SNOWFLAKE"]["DATABASE"]]
-                .schemas[self.secrets["SNOWFLAKE"]["SCHEMA"]]
-                .cortex_search_services[service_name]
-            )
-            search_results = search_service.search(query=query, columns=["CONTENT"], limit=5)
-            return json.dumps(search_results.to_dict())
+            rows = future.result()
         except Exception as e:
-            print(f"Error searching in {service_name}: {e}")
-            return json.dump([])
-        
+            print(f"Error inserting into {self.storage.table(user_id, source)}: {e}")
+            return
+        self._on_written(user_id, source, rows)
+
+    def _on_written(self, user_id: str, source: str, rows: int) -> None:
+        metrics.inc("devrag_rows_inserted_total", rows, source=source)
+        self._invalidate_caches(user_id, source)
+
+    def _invalidate_caches(self, user_id: str, service: str) -> None:
+        """Drop cached results and answers that predate new content for a service, in every process"""
+        self.retrieval_cache.invalidate(user_id, service)
+        self.answer_cache.invalidate(user_id)
+        self.source_versions.bump(user_id, service)
+
+    def _sync_caches(self, user_id: str) -> None:
+        """Drop what this process cached for sources another process has since changed"""
+        changed = self.source_versions.changed(user_id)
+        for service in changed:
+            self.retrieval_cache.invalidate(user_id, service)
+        if changed:
+            self.answer_cache.invalidate(user_id)
+
+    def insert_into_github_rag(self, user_id ,chunks: List[Chunk], origin: Optional[str] = None) -> Future:
+        return self._insert(user_id, "github", chunks, origin)
+
+    def insert_into_personal_rag(self, user_id, chunks: List[Chunk], origin: Optional[str] = None) -> Future:
+        return self._insert(user_id, "personal", chunks, origin)
+
+    def insert_into_pdf_rag(self, user_id ,chunks: List[Chunk], origin: Optional[str] = None) -> Future:
+        return self._insert(user_id, "pdf", chunks, origin)
+
+    def set_unavailable_sources(self, user_id: str, sources: Set[str]) -> None:
+        """Sources to leave out of searches until their services exist"""
+        self.unavailable_sources[user_id] = set(sources)
+
+    def _search_service(self, service_name: str, query: str, source: str = "", tenant: Optional[str] = None) -> str:
+        # Errors propagate to search() so that failed lookups are never cached
+        with metrics.span("search.service", source=source):
+            return json.dumps(self.retrieval_backend.search(service_name, query, limit=5, tenant=tenant))
+
+    def _services(self, user_id: str) -> Dict[str, Tuple[str, Optional[str]]]:
+        """(search service, tenant) of every source a query for the user searches"""
+        services = {"common": (self.secrets["SNOWFLAKE"]["WAREHOUSE"], None)}
+        for source in ("personal", "github", "pdf"):
+            if source in self.unavailable_sources.get(user_id, ()):
+                continue
+            services[source] = (self.storage.service(user_id, source), self.storage.tenant(user_id))
+        return services
+
+    def warm(self, user_id: str) -> None:
+        """Connect, resolve the user's search services and probe each once, so the first query pays for none of it"""
+        if not self.ensure_connected():
+            raise Exception("Failed to connect to Snowflake.")
 
-    def search(self, query: str,user_id) -> List[str]:
-        services = {
-            "common": self.secrets["SNOWFLAKE"]["WAREHOUSE"],
-            "personal": f"{user_id}_ragsearch",
-            "github": f"{user_id}_githubsearch",
-            "pdf": f"{user_id}_pdfsearch"
+        def probe(name: str, service_name: str, tenant: Optional[str]) -> None:
+            with metrics.span("warmup.search", source=name):
+                self.retrieval_backend.prepare(service_name, tenant)
+                # Not cached: the probe only opens the service's connections
+                self.retrieval_backend.search(service_name, "warmup", limit=1, tenant=tenant)
+
+        futures = {
+            self._search_executor.submit(probe, name, service_name, tenant): name
+            for name, (service_name, tenant) in self._services(user_id).items()
         }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f"Warmup probe of {futures[future]} for {user_id} failed: {e}")
+
+    def search_by_service(self, query: str, user_id) -> Dict[str, str]:
+        """Raw JSON results keyed by service, served from the retrieval cache where possible"""
+        services = self._services(user_id)
+        self._sync_caches(user_id)
+
+        results = {}
+        pending = {}
+        for name, service in services.items():
+            cached = self.retrieval_cache.get(user_id, name, query)
+            if cached is not None:
+                results[name] = cached
+            else:
+                pending[name] = service
 
-        results = []
+        if not pending:
+            return results
 
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(self._search_service, service_name, query): name for name, service_name in services.items()}
+        futures = {
+            self._search_executor.submit(contextvars.copy_context().run, self._search_service, service_name, query, name, tenant): name
+            for name, (service_name, tenant) in pending.items()
+        }
 
-            for future in as_completed(futures):
-                service_name = futures[future]
-                try:
-                    results.append(future.result())
-                except Exception as e:
-                    print(f"Error searching in {service_name}: {e}")
+        for future in as_completed(futures):
+            service_name = futures[future]
+            try:
+                result = future.result()
+                results[service_name] = result
+                self.retrieval_cache.put(user_id, service_name, query, result)
+            except Exception as e:
+                print(f"Error searching in {service_name}: {e}")
 
         return results
 
+    def search(self, query: str,user_id) -> List[str]:
+        return list(self.search_by_service(query, user_id).values())
+
+    def retrieve(self, query: str, user_id) -> List[Dict[str, Any]]:
+        """Fused, deduplicated top-k chunks across all services within the context token budget"""
+        retrieval = self.secrets.get("RETRIEVAL", {})
+        return merge_results(
+            self.search_by_service(query, user_id),
+            top_k=retrieval.get("TOP_K", 8),
+            token_budget=retrieval.get("CONTEXT_TOKENS", 1500),
+            count_tokens=count_tokens,
+        )
+
+    @staticmethod
+    def _timed(timings: Dict[str, float], stage: str, func, *args):
+        start = time.perf_counter()
+        try:
+            with metrics.span(f"query.{stage}"):
+                return func(*args)
+        finally:
+            timings[stage] = time.perf_counter() - start
+
+    def _build_prompt(self, user_id, query: str, timings: Dict[str, float]) -> str:
+        """Run retrieval and the memory lookup concurrently, then assemble the prompt"""
+        # Each stage gets its own copy of the context so spans nest under the caller's
+        documents_future = self._stage_executor.submit(
+            contextvars.copy_context().run, self._timed, timings, "search", self.retrieve, query, user_id
+        )
+        memory_future = self._stage_executor.submit(
+            contextvars.copy_context().run, self._timed, timings, "memory", Memory.shared().retrieve_memory, user_id,
+            query, self.prompt_builder.budgets["memory"]
+        )
+        documents = documents_future.result()
+        conversation_memory = memory_future.result()
+        prompt, usage = self._timed(timings, "prompt", self.prompt_builder.build, query, documents, conversation_memory)
+        logger.info(f"Prompt tokens for {user_id}: {usage}")
+        # Per query, in metrics only: this manager is shared by every user and session
+        for section, tokens in usage.items():
+            metrics.observe("devrag_prompt_tokens", tokens, buckets=TOKEN_BUCKETS, section=section)
+        return prompt
+
+    def _record_timings(self, user_id, timings: Dict[str, float]) -> None:
+        # The stages' latencies are already in their spans
+        logger.info(f"Query stage timings for {user_id}: " + ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in timings.items()))
+
     def generate(self,user_id, query: str) -> str:
-        self.ensure_connected()
-        if self.session is None:  
+        if not self.ensure_connected():
             raise Exception("Failed to connect to Snowflake.")
         
-        document_details = self.search(query,user_id)
-        conversation_memory = Memory().retrieve_memory(user_id)
-        instruction = f"""
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                'mistral-large2',
-                $$  You are a helpful assistant using a Retrieval-Augmented Generation (RAG) method to answer user queries.
-                    Here are the inputs provided to you:
-
-                    ### Contextual Information
-                    1. **Document Details**:
-                        {document_details}
-                    2. **Memory (Previous Conversation History)**:
-                        {conversation_memory}
-                    3. **User Query**:
-                        {query}
-                    ### Instructions:
-                        - Provide a concise and informative response that addresses the user query effectively.
-                        - Use the provided **Document Details** as the primary source of truth to answer the query.
-                        - Refer to the **Memory** to maintain conversation context. Use this information to make your response coherent and contextual.
-                        - Dont use the **Memory** as the primary source of information unless the query explicitly asks for it.
-                        - If relevant information from the **Memory** or **Document Details** is missing, clarify this in your response and guide the user on how to proceed.
-                        - Don't provide verbatim responses from the **Document Details** or **Memory**. Instead, paraphrase and summarize the information to enhance user understanding.
-                        - Don't greet user frequently. Be friendly in your responses.
-                    ### Response:
-                        - Be concise and accurate. If additional explanations are required, provide them clearly.
-                        - Ensure your response aligns with the user's intent as reflected in the query and conversation context.
-                        - Where applicable, suggest follow-up actions or related queries for deeper understanding.
-
-                    ---
-                    **Example Input**:
-
-                        - **Document Details**:
-                                "This document is a developer's guide for integrating payment APIs. It includes sections on API authentication, error handling, and webhook configurations."
-                        - **Memory**:
-                            1.  User: "What are the common errors during payment API integration?"
-                                Assistant: "The common errors include invalid API keys, incorrect endpoint URLs, and missing webhook signatures."
-                            2.  User: "How do I fix invalid API key errors?"
-                                Assistant: "Ensure you're using the API key issued for your account and verify it matches the required permissions."
-
-                        - **User Query**:
-                                "What are webhook configurations, and how do they work?"
-                    **Example Output**:
-                                "Webhook configurations are settings that allow your application to receive real-time updates from the payment API when specific events occur (e.g., successful payments, refunds). Configure the webhook URL in your API dashboard, ensure it points to an accessible endpoint, and validate incoming requests using the signature provided in the header to ensure authenticity."$$
-            );"""
+        self._sync_caches(user_id)
+        source_version = self.answer_cache.source_version(user_id)
+        cached_answer = self.answer_cache.lookup(user_id, query)
+        if cached_answer is not None:
+            return cached_answer
+
+        timings: Dict[str, float] = {}
+        prompt = self._build_prompt(user_id, query, timings)
+        model = self.secrets.get("CORTEX", {}).get("MODEL", "mistral-large2")
+
+        def complete():
+            with self.pool.connection() as pooled:
+                # Bound, never spliced: the prompt carries the user's query and retrieved text
+                return pooled.session.sql("SELECT SNOWFLAKE.CORTEX.COMPLETE(?, ?)", params=[model, prompt]).collect()
 
         try:
-            generation = self.session.sql(instruction).collect()
-            return generation[0][0]
+            generation = self._timed(timings, "completion", complete)
+            answer = generation[0][0]
+            self.answer_cache.store(user_id, query, answer, source_version)
+            self._record_timings(user_id, timings)
+            return answer
         except Exception as e:
             raise Exception(f"Error during query generation: {e}")
 
+    def generate_stream(self, user_id, query: str) -> Iterator[str]:
+        """Yield the answer as the completer produces it instead of waiting for the full text"""
+        self._sync_caches(user_id)
+        source_version = self.answer_cache.source_version(user_id)
+        cached_answer = self.answer_cache.lookup(user_id, query)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+        timings: Dict[str, float] = {}
+        prompt = self._build_prompt(user_id, query, timings)
+        parts = []
+        start = time.perf_counter()
+        try:
+            for token in self.completer.stream(prompt):
+                if not parts:
+                    timings["first_token"] = time.perf_counter() - start
+                parts.append(token)
+                yield token
+        except Exception as e:
+            raise Exception(f"Error during query generation: {e}")
+        timings["completion"] = time.perf_counter() - start
+        metrics.observe("devrag_span_seconds", timings["completion"], span="query.completion", status="ok")
+        if "first_token" in timings:
+            metrics.observe("devrag_first_token_seconds", timings["first_token"])
+        self.answer_cache.store(user_id, query, "".join(parts), source_version)
+        self._record_timings(user_id, timings)
+
 class Memory:
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> "Memory":
+        """Process-wide instance so secrets and the Firestore client are loaded once"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
     def __init__(self):
-        with open('secrets.toml', 'r') as f:
-            self.secrets = toml.load(f)
+        self.secrets = load_config()
 
         # Initialize Firebase Admin SDK if not already initialized
         if not firebase_admin._apps:
@@ -424,141 +735,409 @@ class Memory:
 
         self.db = firestore.client()
         self.api_key = self.secrets["FIREBASE"]["API_KEY"]
+        settings = self.secrets.get("MEMORY", {})
+        api_key = self.secrets["MISTRAL"]["API_KEY"]
+        self.summarizer = Summarizer(
+            lambda: Mistral(api_key=api_key),
+            model=settings.get("SUMMARY_MODEL", "mistral-large-latest"),
+            batch_size=settings.get("SUMMARY_BATCH_SIZE", 8),
+        )
+        self.history = HistoryStore(self.db, firestore, page_size=settings.get("HISTORY_PAGE", 20))
+        self.cache = ConversationCache(
+            self.history, self.summarizer.submit,
+            summarize_after=settings.get("SUMMARIZE_AFTER", 5),
+            max_summaries=settings.get("MAX_SUMMARIES", 8),
+            flush_interval=settings.get("FLUSH_INTERVAL", 1.0),
+            max_staleness=settings.get("MAX_STALENESS", 30.0),
+        )
 
-    def create_summary(self, conversations: List[Dict[str, str]]) -> str:
+    def manage_conversations(self, user_id: str, query: str, response: str) -> bool:
         """
-        Creates a summary of conversations using Mistral AI
+        Records a conversation turn in the write-behind cache. Turns are
+        written to Firestore in the background and summarized using
+        Mistral AI once 5 have accumulated
         """
         try:
-            # Format conversations for Mistral
-            formatted_conversations = []
-            for conv in conversations:
-                formatted_conversations.append(f"User: {conv['query']}\nAssistant: {conv['response']}")
-
-            conversation_text = "\n\n".join(formatted_conversations)
-
-            client = Mistral(self.secrets["MISTRAL"]["API_KEY"])  # Corrected parameter name
-
-            chat = client.chat.completions.create(  # Corrected method name
-                model="mistral-large-v2",  # Corrected model name
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "Please summarize the following conversations into a concise paragraph that captures the main topics discussed and key points from both the user's queries and the assistant's responses."
-                    },
-                    {
-                        "role": "user",
-                        "content": conversation_text
-                    }
-                ],
-                temperature=0.5
-            )
+            self.cache.append(user_id, query, response)
+            return True
+        except Exception as e:
+            raise Exception(f"Failed to manage conversations: {str(e)}")
 
-            return chat.choices[0].message.content
+    def close(self) -> None:
+        """Write pending turns and stop the summarizer"""
+        self.cache.close()
+        self.summarizer.close()
+
+    def retrieve_memory(self, user_id: str, query: Optional[str] = None,
+                        token_budget: Optional[int] = None) -> List[Dict[str, str]]:
+        """Conversation memory for a prompt; ranked against `query` and bounded when one is given"""
+        if query is None:
+            return self.cache.retrieve(user_id)
+        settings = self.secrets.get("MEMORY", {})
+        return self.cache.relevant(
+            user_id, query,
+            top_k=settings.get("TOP_K", 4),
+            token_budget=token_budget or settings.get("TOKEN_BUDGET", 800),
+            count_tokens=count_tokens,
+            truncate=get_tokenizer().truncate,
+        )
 
-        except Exception as e:
-            # Fallback to basic summary if Mistral API fails
-            return f"Error creating summary with Mistral: {str(e)}"
+class Resources:
+    """Clients shared by every session in the process, created on first use and closed at exit
 
-    def manage_conversations(self, user_id: str, query: str, response: str) -> bool:
-        """
-        Manages conversations by:
-        1. Adding new conversation
-        2. Checking if there are 5 conversations
-        3. If yes, summarizes them using Mistral AI
-        4. Clears the conversations list
-        """
-        try:
-            # Get user document reference
-            user_ref = self.db.collection('user_data').document(user_id)
-            user_doc = user_ref.get()
-            user_data = user_doc.to_dict()
-
-            # Add new conversation
-            conversation = {
-                'query': query,
-                'response': response
-            }
+    Streamlit re-runs the script on every interaction; the app keeps this
+    object with st.cache_resource, so a rerun only looks up the user's
+    Backend, a thin view over these clients.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
 
-            # Get current conversations
-            conversations = user_data.get('past_conversations', [])
-            conversations.append(conversation)
-
-            # Check if we've reached 5 conversations
-            if len(conversations) >= 5:
-                # Create summary of conversations
-                summary = {
-                    'summary_text': self.create_summary(conversations),
-                    'original_conversations': conversations
-                }
-
-                # Update document with summary and clear conversations
-                user_ref.update({
-                    'conversation_summary': firestore.ArrayUnion([summary]),
-                    'past_conversations': []  # Clear the conversations list
-                })
-            else:
-                # Just update with new conversation
-                user_ref.update({
-                    'past_conversations': conversations
-                })
+    @classmethod
+    def shared(cls) -> "Resources":
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
 
-            return True
+    def __init__(self):
+        self.secrets = load_config()
+        self.text_processor = TextProcessor()
+        self._snowflake: Optional[SnowflakeManager] = None
+        self._memory: Optional[Memory] = None
+        self._ingestion: Optional[IngestionScheduler] = None
+        self._browsers: Optional[BrowserPool] = None
+        self._chunk_store: Optional[ChunkStore] = None
+        self._backends: Dict[str, "Backend"] = {}
+        self._warmup_executor: Optional[ThreadPoolExecutor] = None
+        self._warmups: Dict[str, Tuple[float, Future]] = {}
+        self._lock = threading.RLock()
+        self._closed = False
+        atexit.register(self.close)
+
+    @property
+    def snowflake(self) -> SnowflakeManager:
+        if self._snowflake is None:
+            with self._lock:
+                if self._snowflake is None:
+                    snowflake = SnowflakeManager(user_id=None)
+                    snowflake.chunk_store = self.chunk_store
+                    self._snowflake = snowflake
+        return self._snowflake
+
+    @property
+    def memory(self) -> Memory:
+        if self._memory is None:
+            with self._lock:
+                if self._memory is None:
+                    self._memory = Memory.shared()
+        return self._memory
+
+    @property
+    def ingestion(self) -> IngestionScheduler:
+        if self._ingestion is None:
+            settings = self.secrets.get("INGESTION", {})
+            with self._lock:
+                if self._ingestion is None:
+                    self._ingestion = IngestionScheduler.shared(
+                        max_concurrency=settings.get("MAX_CONCURRENCY", 4),
+                        per_user_limit=settings.get("PER_USER_LIMIT", 2),
+                        process_workers=settings.get("PROCESS_WORKERS", 2),
+                    )
+        return self._ingestion
+
+    @property
+    def browsers(self) -> BrowserPool:
+        """Browser and crawler for ingestion jobs; only usable on the ingestion loop"""
+        if self._browsers is None:
+            settings = self.secrets.get("INGESTION", {})
+            with self._lock:
+                if self._browsers is None:
+                    self._browsers = BrowserPool(
+                        lambda: async_playwright(),
+                        lambda: AsyncWebCrawler(),
+                        max_pages=settings.get("BROWSER_PAGES", 4),
+                    )
+        return self._browsers
+
+    @property
+    def chunk_store(self) -> Optional[ChunkStore]:
+        """Local copy of extracted documents and chunks; [INGESTION] CHUNK_STORE = "" turns it off"""
+        path = self.secrets.get("INGESTION", {}).get("CHUNK_STORE", ".devrag/chunks.sqlite3")
+        if self._chunk_store is None and path:
+            with self._lock:
+                if self._chunk_store is None:
+                    self._chunk_store = ChunkStore(path)
+        return self._chunk_store
+
+    @property
+    def provisioning(self) -> ProvisioningQueue:
+        snowflake = self.snowflake
+        return ProvisioningQueue.shared(
+            self.memory.db,
+            lambda: snowflake_connector.connect(**snowflake.connection_params),
+            snowflake.storage,
+            snowflake.connection_params["warehouse"],
+            workers=self.secrets.get("STORAGE", {}).get("PROVISIONING_WORKERS", 4),
+        )
 
-        except Exception as e:
-            raise Exception(f"Failed to manage conversations: {str(e)}")
+    def backend(self, user_id: str) -> "Backend":
+        """The user's Backend; it holds no state of its own, so one per user is kept"""
+        backend = self._backends.get(user_id)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.setdefault(user_id, Backend(user_id, self))
+        return backend
+
+    def warm(self, user_id: str) -> Future:
+        """Warm the query path for a user who just logged in, in the background
+
+        A warmup still running, or finished within [MEMORY] WARMUP_TTL
+        seconds, is returned instead of starting another.
+        """
+        ttl = self.secrets.get("MEMORY", {}).get("WARMUP_TTL", 300)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Resources are closed")
+            started, future = self._warmups.get(user_id, (0.0, None))
+            if future is not None and (not future.done() or (
+                    future.exception() is None and time.monotonic() - started < ttl)):
+                return future
+            if self._warmup_executor is None:
+                self._warmup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="warmup")
+            # The Backend is built on the warmup thread too: its first one creates the shared clients
+            future = self._warmup_executor.submit(lambda: self.backend(user_id).warmup())
+            self._warmups[user_id] = (time.monotonic(), future)
+        return future
+
+    def close(self) -> None:
+        """Flush and release everything that was created"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._warmup_executor is not None:
+            self._warmup_executor.shutdown(wait=False, cancel_futures=True)
+        if self._browsers is not None and self._ingestion is not None:
+            try:
+                self._ingestion.call(self._browsers.close(), timeout=10)
+            except Exception as e:
+                logger.warning(f"Failed to close shared browsers: {e}")
+        if self._ingestion is not None:
+            self._ingestion.shutdown()
+        if self._memory is not None:
+            self._memory.close()
+        if self._snowflake is not None:
+            self._snowflake.close()
+        if self._chunk_store is not None:
+            self._chunk_store.close()
+        # Last, so the final export counts the flushes above
+        metrics.shutdown()
 
-    def retrieve_memory(self, user_id: str) -> List[Dict[str, str]]:
-        user_ref = self.db.collection('user_data').document(user_id)
-        user_doc = user_ref.get()
-        user_data = user_doc.to_dict()
-        conversations = user_data.get('past_conversations', [])
-        summary_conversations = user_data.get('conversation_summary', [])
-        if summary_conversations:
-            conversations.append(summary_conversations[0])
-        return conversations
 
 class Backend:
-    """Centralized backend processing"""
-    def __init__(self, user_id: str):
-        self.text_processor = TextProcessor()
-        self.snowflake_manager = SnowflakeManager(user_id)
-        self.memory = Memory()
+    """Centralized backend processing for one user, over the process-wide Resources"""
+    def __init__(self, user_id: str, resources: Optional[Resources] = None):
+        self.resources = resources or Resources.shared()
+        self.text_processor = self.resources.text_processor
+        self.snowflake_manager = self.resources.snowflake
+        self.memory = self.resources.memory
         self.user_id = user_id
 
-    async def web_crawler(self, url: str) -> None:
+    def _chunk(self, source: str, data: str, origin: Optional[str] = None) -> List[Chunk]:
+        stored = STAGED_SOURCES[source]
+        with metrics.span("ingest.chunk", source=source):
+            chunks = self.text_processor.chunk_records(data, stored, document_id(self.user_id, stored, origin))
+        self._stage(stored, origin, data, chunks)
+        metrics.inc("devrag_chunks_total", len(chunks), source=source)
+        return chunks
+
+    async def _chunk_async(self, source: str, data: str, job: Optional[IngestJob] = None,
+                           origin: Optional[str] = None) -> List[Chunk]:
+        """Chunk in the scheduler's process pool when running as a job"""
+        if job is None:
+            return self._chunk(source, data, origin)
+        job.update("chunking", 0.6)
+        stored = STAGED_SOURCES[source]
+        with metrics.span("ingest.chunk", source=source):
+            chunks = await job.run_cpu(self.text_processor.chunk_records, data, stored,
+                                       document_id(self.user_id, stored, origin))
+        job.chunks = len(chunks)
+        await asyncio.get_running_loop().run_in_executor(None, partial(self._stage, stored, origin, data, chunks))
+        metrics.inc("devrag_chunks_total", len(chunks), source=source)
+        return chunks
+
+    def _stage(self, source: str, origin: Optional[str], data: str, chunks: List[Chunk]) -> None:
+        """Keep the extracted text and its chunks in the local chunk store, if one is configured"""
+        store = self.resources.chunk_store
+        if store is None:
+            return
+        try:
+            with metrics.span("ingest.stage", source=source):
+                store.put(self.user_id, source, origin, data, self.text_processor.key, chunks)
+        except Exception as e:
+            # The store is a copy for rebuilds; the warehouse insert goes ahead without it
+            logger.warning(f"Failed to stage {source} {origin} in the chunk store: {e}")
+
+    async def _insert_async(self, insert: Callable, processed_chunks: List[Chunk], origin: Optional[str],
+                            job: Optional[IngestJob] = None) -> None:
+        # Local indexing and writer backpressure block; keep them off the event loop other jobs share
+        if job is not None:
+            job.update("inserting", 0.8)
+        loop = asyncio.get_running_loop()
+        written = await loop.run_in_executor(None, partial(insert, self.user_id, processed_chunks, origin))
+        # The rows are committed even if the job is cancelled while waiting for the flush
+        await asyncio.shield(asyncio.wrap_future(written))
+
+    async def web_crawler(self, url: str, job: Optional[IngestJob] = None) -> None:
         """Main Web Crawler processing method"""
-        scraper = WebScraper(url)
-        data = await scraper.scrape()
-        processed_chunks = self.text_processor.chunk_text(data)
-        # Call insert docs from Snowflake manager
-        self.snowflake_manager.insert_into_personal_rag(processed_chunks)
-
-    async def github_scraper(self, url: str) -> None:
+        with metrics.span("ingest", source="web"):
+            # Jobs run on the scheduler's loop and share its started crawler
+            crawler = await self.resources.browsers.crawler() if job is not None else None
+            scraper = WebScraper(url, crawler=crawler)
+            with metrics.span("ingest.scrape", source="web"):
+                on_page = (lambda pages: job.update(f"crawled {pages} pages", min(0.5, 0.02 * pages))) if job else None
+                pages = await scraper.scrape(on_page)
+            if not pages:
+                raise Exception("Failed to crawl the website.")
+            processed_chunks = await self._chunk_async("web", "\n\n".join(pages), job, url)
+            # Call insert docs from Snowflake manager
+            await self._insert_async(self.snowflake_manager.insert_into_personal_rag, processed_chunks, url, job)
+
+    async def github_scraper(self, url: str, job: Optional[IngestJob] = None) -> None:
         """Main GitHub scraper processing method"""
-        scraper = GithubScraper(url)
-        data = await scraper.get_data()
-        if not data:
-            raise Exception("Failed to scrape GitHub data.")
-        processed_chunks = self.text_processor.chunk_text(data)
-        if not processed_chunks:
-            raise Exception("Failed to process GitHub data to chunks.")
-        loop = asyncio.get_event_loop()
-        with ThreadPoolExecutor() as pool:
-            await loop.run_in_executor(pool, partial(self.snowflake_manager.insert_into_github_rag, self.user_id, processed_chunks))
-        return True
+        with metrics.span("ingest", source="github"):
+            scraper = GithubScraper(url, self.resources.browsers if job is not None else None)
+            if job is not None:
+                job.update("scraping", 0.1)
+            with metrics.span("ingest.scrape", source="github"):
+                data = await scraper.get_data()
+            if not data:
+                raise Exception("Failed to scrape GitHub data.")
+            processed_chunks = await self._chunk_async("github", data, job, url)
+            if not processed_chunks:
+                raise Exception("Failed to process GitHub data to chunks.")
+            await self._insert_async(self.snowflake_manager.insert_into_github_rag, processed_chunks, url, job)
+            return True
 
     def pdf_scraper(self, pdf) -> None:
-        scraper = PDFScraper()
-        data = scraper.handle_pdf_upload(pdf)
-        if data:
-            processed_chunks = self.text_processor.chunk_text(data)
-        self.snowflake_manager.insert_into_pdf_rag(self.user_id,processed_chunks)
+        with metrics.span("ingest", source="pdf"):
+            scraper = PDFScraper()
+            with metrics.span("ingest.scrape", source="pdf"):
+                data = scraper.handle_pdf_upload(pdf)
+            if not data:
+                raise Exception("Failed to extract text from the PDF.")
+            processed_chunks = self._chunk("pdf", data, getattr(pdf, "name", None))
+            self.snowflake_manager.insert_into_pdf_rag(self.user_id,processed_chunks, getattr(pdf, "name", None))
+
+    async def _ingest_pdf(self, content: bytes, name: str, job: IngestJob) -> None:
+        with metrics.span("ingest", source="pdf"):
+            job.update("extracting", 0.1)
+            with metrics.span("ingest.scrape", source="pdf"):
+                data = await job.run_cpu(PDFScraper().extract_bytes, content)
+            if not data:
+                raise Exception("Failed to extract text from the PDF.")
+            processed_chunks = await self._chunk_async("pdf", data, job, name)
+            await self._insert_async(self.snowflake_manager.insert_into_pdf_rag, processed_chunks, name, job)
+
+    @property
+    def ingestion(self) -> IngestionScheduler:
+        return self.resources.ingestion
+
+    def submit_pdf(self, pdf, priority: Optional[int] = None) -> str:
+        """Queue an uploaded PDF; the bytes are read now since the upload object is per script run"""
+        return self.submit_pdf_bytes(pdf.getvalue(), getattr(pdf, "name", "upload.pdf"), priority)
+
+    def submit_pdf_bytes(self, content: bytes, name: str, priority: Optional[int] = None) -> str:
+        return self.ingestion.submit(self.user_id, "pdf", name, partial(self._ingest_pdf, content, name), priority)
+
+    def submit_github(self, url: str, priority: Optional[int] = None) -> str:
+        return self.ingestion.submit(self.user_id, "github", url, partial(self.github_scraper, url), priority)
+
+    def submit_website(self, url: str, priority: Optional[int] = None) -> str:
+        return self.ingestion.submit(self.user_id, "web", url, partial(self.web_crawler, url), priority)
+
+    def ingestion_jobs(self) -> List[Dict[str, Any]]:
+        return self.ingestion.jobs(self.user_id)
+
+    def cancel_ingestion(self, job_id: str) -> bool:
+        return self.ingestion.cancel(job_id, self.user_id)
+
+    def delete_document(self, source: str, origin: str) -> Future:
+        """Remove one document's chunks; `origin` is the URL or PDF name it was ingested from"""
+        return self.snowflake_manager.delete_document(self.user_id, source, origin)
+
+    def replace_document(self, source: str, origin: str, text: str) -> Future:
+        """Re-chunk a document's new text and swap it in for its stored chunks in one transaction"""
+        kind = {stored: kind for kind, stored in STAGED_SOURCES.items()}[source]
+        chunks = self._chunk(kind, text, origin)
+        return self.snowflake_manager.replace_document(self.user_id, source, chunks, origin)
+
+    def connect(self) -> None:
+        """Open the first pooled Snowflake connection if this process has none yet"""
+        self.snowflake_manager.ensure_connected()
+
+    def readiness(self) -> Dict[str, str]:
+        """Provisioning status per source; sources not ready are left out of searches"""
+        readiness = self.resources.provisioning.readiness(self.user_id)
+        pending = {source for source, status in readiness.items() if status != PROVISIONED}
+        self.snowflake_manager.set_unavailable_sources(self.user_id, pending)
+        return readiness
+
+    def retry_provisioning(self) -> None:
+        self.resources.provisioning.retry(self.user_id)
+
+    def warmup(self) -> Dict[str, float]:
+        """Do the first query's one-off work now: connect, resolve search services and load memory
+
+        Returns the seconds each stage took; failures are logged, a query
+        simply pays for whatever did not warm.
+        """
+        timings: Dict[str, float] = {}
+
+        def timed(stage: str, func: Callable[[], Any]) -> None:
+            start = time.perf_counter()
+            try:
+                func()
+            finally:
+                timings[stage] = time.perf_counter() - start
+
+        with metrics.span("warmup"):
+            try:
+                # Sources still provisioning are skipped by the probes as they are by queries
+                timed("readiness", self.readiness)
+            except Exception as e:
+                logger.warning(f"Warmup readiness check for {self.user_id} failed: {e}")
+            stages = {
+                "search": partial(self.snowflake_manager.warm, self.user_id),
+                "memory": partial(self.memory.retrieve_memory, self.user_id),
+            }
+            with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="warmup-stage") as executor:
+                futures = {executor.submit(timed, stage, func): stage for stage, func in stages.items()}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.warning(f"Warmup {futures[future]} for {self.user_id} failed: {e}")
+        return timings
 
     def query(self, query: str) -> str:
-        response = self.snowflake_manager.generate(self.user_id,query)
-        self.memory.manage_conversations(self.user_id, query, response)
-        return response
+        with metrics.span("backend.query"):
+            response = self.snowflake_manager.generate(self.user_id,query)
+            with metrics.span("memory.write"):
+                self.memory.manage_conversations(self.user_id, query, response)
+            return response
+
+    def query_stream(self, query: str) -> Iterator[str]:
+        """Stream the answer token by token; the turn is stored once the stream completes"""
+        start = time.perf_counter()
+        parts = []
+        for token in self.snowflake_manager.generate_stream(self.user_id, query):
+            parts.append(token)
+            yield token
+        with metrics.span("memory.write"):
+            self.memory.manage_conversations(self.user_id, query, "".join(parts))
+        metrics.observe("devrag_span_seconds", time.perf_counter() - start, span="backend.query_stream", status="ok")
 
 async def run():
     """Async entry point"""
@@ -0,0 +1,108 @@
+"""Load the local chunk store into the configured retrieval backend
+
+Usage (from the repository root, with secrets.toml in place):
+    python backfill.py                                  # every user and source
+    python backfill.py --users uid1,uid2 --sources github,pdf
+    python backfill.py --workers 8 --dry-run            # re-chunk and count only
+
+Documents are read from [INGESTION] CHUNK_STORE and inserted through the
+usual path: the warehouse tables of the [STORAGE] layout and the local
+indexes of [RETRIEVAL]. Point those at the new target first, e.g. a new
+TABLE_PREFIX after an embedding model change or a fresh INDEX_DIR. Each
+document's rows replace those the warehouse table and local indexes
+already hold for it, so a backfill can be re-run. Documents deleted since
+their last extraction are skipped. Documents never chunked
+by the current TextProcessor settings are re-chunked from their stored
+text and the new chunks are kept in the store. No network source is
+contacted.
+"""
+import sys
+import time
+import argparse
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from storage import SOURCES
+
+BATCH_DOCUMENTS = 64
+
+
+def backfill(resources, user_ids: Optional[List[str]] = None, sources: Optional[List[str]] = None,
+             workers: int = 4, dry_run: bool = False) -> Dict[str, int]:
+    store = resources.chunk_store
+    if store is None:
+        raise SystemExit("No chunk store configured ([INGESTION] CHUNK_STORE is empty)")
+    processor = resources.text_processor
+    snowflake = None if dry_run else resources.snowflake
+    inserts = {} if dry_run else {
+        "personal": snowflake.insert_into_personal_rag,
+        "github": snowflake.insert_into_github_rag,
+        "pdf": snowflake.insert_into_pdf_rag,
+    }
+    documents = list(store.documents(user_ids, sources))
+    totals = {"documents": 0, "chunks": 0, "rechunked": 0}
+    pending: List[Future] = []
+    pool = ProcessPoolExecutor(workers) if workers else None
+    started = time.monotonic()
+    try:
+        for begin in range(0, len(documents), BATCH_DOCUMENTS):
+            batch = documents[begin:begin + BATCH_DOCUMENTS]
+            chunks: Dict[int, Any] = {document["id"]: store.chunks(document, processor.key) for document in batch}
+            stale = [document for document in batch if chunks[document["id"]] is None]
+            if stale:
+                arguments = ([store.text(document["hash"]) for document in stale],
+                             [document["source"] for document in stale],
+                             [document["document_id"] for document in stale])
+                if pool:
+                    # Several documents per task, so the processor is pickled once per chunk of work, not per document
+                    records = pool.map(processor.chunk_records, *arguments,
+                                       chunksize=max(1, len(stale) // (workers * 4)))
+                else:
+                    records = map(processor.chunk_records, *arguments)
+                for document, document_chunks in zip(stale, records):
+                    store.put_chunks(document["id"], processor.key, document_chunks)
+                    chunks[document["id"]] = document_chunks
+                totals["rechunked"] += len(stale)
+            for document in batch:
+                document_chunks = chunks[document["id"]]
+                if not dry_run and document_chunks:
+                    pending.append(inserts[document["source"]](document["user_id"], document_chunks, document["origin"]))
+                totals["documents"] += 1
+                totals["chunks"] += len(document_chunks)
+            elapsed = time.monotonic() - started
+            print(f"[{totals['documents']}/{len(documents)}] {totals['chunks']} chunks, "
+                  f"{totals['rechunked']} re-chunked, {totals['chunks'] / elapsed:.0f} chunks/s")
+        for future in pending:
+            future.result()
+    finally:
+        if pool:
+            pool.shutdown()
+    return totals
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Rebuild the retrieval backend from the local chunk store")
+    parser.add_argument("--users", help="comma separated user ids (default: every user in the store)")
+    parser.add_argument("--sources", help=f"comma separated sources out of {', '.join(SOURCES)} (default: all)")
+    parser.add_argument("--workers", type=int, default=4, help="processes that re-chunk documents (0: inline)")
+    parser.add_argument("--dry-run", action="store_true", help="re-chunk and count without loading the retrieval backend")
+    args = parser.parse_args(argv)
+
+    from backend import Resources
+    resources = Resources.shared()
+    try:
+        totals = backfill(
+            resources,
+            user_ids=args.users.split(",") if args.users else None,
+            sources=args.sources.split(",") if args.sources else None,
+            workers=args.workers,
+            dry_run=args.dry_run,
+        )
+        print(f"Loaded {totals['chunks']} chunks from {totals['documents']} documents"
+              + (" (dry run)" if args.dry_run else ""))
+    finally:
+        resources.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,73 @@
+"""Deterministic synthetic corpora for the offline benchmarks"""
+import os
+import random
+from typing import Dict, List
+
+TOPICS = [
+    "authentication", "webhooks", "rate limiting", "pagination", "retries", "caching",
+    "error handling", "configuration", "deployment", "logging", "streaming", "batching",
+]
+IDENTIFIERS = [
+    "get_user_by_id", "RetryPolicy", "MAX_CONNECTIONS", "server.port", "ERR_TIMEOUT_408",
+    "parse_config", "WebhookHandler", "api.rate_limit", "E1001", "flushInterval",
+]
+
+
+def _paragraph(rng: random.Random, words: int = 120) -> str:
+    topic = rng.choice(TOPICS)
+    identifier = rng.choice(IDENTIFIERS)
+    filler = " ".join(rng.choice(TOPICS).split()[0] for _ in range(words // 4))
+    return (
+        f"This section explains {topic} in detail. Call {identifier} to control {topic}. "
+        f"When {identifier} fails the client reports a descriptive error. {filler}. "
+        f"See the reference for more about {topic} and {identifier}."
+    )
+
+
+def write_site(directory: str, pages: int = 20, paragraphs: int = 6, seed: int = 0) -> str:
+    """Write a small linked documentation site; returns the entry URL served by FakeCrawler"""
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    for page in range(pages):
+        links = "".join(
+            f'<a href="https://docs.local/page-{target}.html">page {target}</a>'
+            for target in rng.sample(range(pages), k=min(3, pages))
+        )
+        body = "".join(f"<p>{_paragraph(rng)}</p>" for _ in range(paragraphs))
+        with open(os.path.join(directory, f"page-{page}.html"), "w", encoding="utf-8") as f:
+            f.write(f"<html><body><h1>Page {page}</h1>{body}{links}</body></html>")
+    return "https://docs.local/page-0.html"
+
+
+def make_repos(count: int = 4, files: int = 30, seed: int = 0) -> Dict[str, List[str]]:
+    """Repository name -> file contents, as rendered into gitingest textareas"""
+    rng = random.Random(seed)
+    repos = {}
+    for repo in range(count):
+        repos[f"repo-{repo}"] = [
+            f"# file_{index}.py\n" + "\n".join(
+                f"def {rng.choice(IDENTIFIERS).replace('.', '_')}_{n}(value):\n    return value  # {_paragraph(rng, 40)}"
+                for n in range(10)
+            )
+            for index in range(files)
+        ]
+    return repos
+
+
+def make_pdf_pages(pages: int = 15, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return ["\n".join(_paragraph(rng) for _ in range(8)) for _ in range(pages)]
+
+
+def make_queries(count: int = 200, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    templates = [
+        "How do I configure {topic}?",
+        "What does {identifier} do?",
+        "Why does {identifier} fail during {topic}?",
+        "Explain {topic} with an example using {identifier}",
+    ]
+    return [
+        rng.choice(templates).format(topic=rng.choice(TOPICS), identifier=rng.choice(IDENTIFIERS))
+        for _ in range(count)
+    ]
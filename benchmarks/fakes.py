@@ -0,0 +1,765 @@
+"""In-process stand-ins for Snowflake, Firestore, Mistral, crawl4ai, Playwright and PyPDF2
+
+Every fake sleeps for a configurable latency so the benchmark can model a
+real deployment without any network access.
+"""
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+
+class Latency:
+    """Mean latency in seconds with uniform +/- jitter"""
+    def __init__(self, mean: float = 0.0, jitter: float = 0.0):
+        self.mean = mean
+        self.jitter = jitter
+        self._rng = random.Random(0)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            return max(0.0, self.mean + self._rng.uniform(-self.jitter, self.jitter))
+
+    def sleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+
+    async def asleep(self) -> None:
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class FakeLatencies:
+    """Per-dependency latency profile; the defaults roughly match a warm production setup"""
+    def __init__(self, scale: float = 1.0, **overrides: float):
+        defaults = {
+            "connect": 0.8,
+            "execute": 0.02,
+            "commit": 0.05,
+            "search": 0.15,
+            "complete": 2.5,
+            "first_token": 0.4,
+            "token": 0.01,
+            "firestore_read": 0.06,
+            "firestore_write": 0.08,
+            "mistral": 1.5,
+            "crawl_page": 0.3,
+            "browser_page": 1.0,
+        }
+        defaults.update(overrides)
+        for name, mean in defaults.items():
+            setattr(self, name, Latency(mean * scale, mean * scale * 0.2))
+
+
+# ---------------------------------------------------------------- Snowflake
+
+class FakeWarehouse:
+    """Shared table store behind every fake connection and session"""
+    def __init__(self, latencies: FakeLatencies, answer: str = "This is a benchmark answer."):
+        self.latencies = latencies
+        self.answer = answer
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def rows(self, table: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self.tables.get(table.lower(), []))
+
+    def row_count(self) -> int:
+        with self._lock:
+            return sum(len(rows) for rows in self.tables.values())
+
+    def execute(self, sql: str, params: Optional[Any] = None) -> List[Any]:
+        self.latencies.execute.sleep()
+        with self._lock:
+            self.statements += 1
+        statement = sql.strip()
+        upper = statement.upper()
+        if upper.startswith("INSERT INTO"):
+            return self._insert(statement, params)
+        if upper.startswith("DELETE FROM"):
+            return self._delete(statement, params)
+        if "CORTEX.COMPLETE" in upper:
+            self.latencies.complete.sleep()
+            return [(self.answer,)]
+        if upper.startswith("SELECT") and "FROM" in upper:
+            return self._select(statement, params)
+        return []
+
+    def _insert(self, statement: str, params: Optional[Any]) -> List[Any]:
+        match = re.match(r"INSERT INTO\s+(\w+)\s*\(([^)]*)\)", statement, re.IGNORECASE)
+        table = match.group(1).lower()
+        columns = [column.strip().lower() for column in match.group(2).split(",")]
+        if params is None:
+            values = re.findall(r"'((?:[^']|'')*)'", statement[match.end():])
+            params = [value.replace("''", "'") for value in values]
+        row = dict(zip(columns, params))
+        with self._lock:
+            self.tables.setdefault(table, []).append(row)
+        return []
+
+    def _where(self, statement: str, params: Optional[Any]) -> Dict[str, Any]:
+        """column -> value, or a frozenset of values for `column IN (...)`"""
+        clause = re.search(r"WHERE\s+(.*)$", statement, re.IGNORECASE | re.DOTALL)
+        if not clause:
+            return {}
+        params = list(params or [])
+        conditions = {}
+        for column, placeholders in re.findall(r"(\w+)\s*(?:=\s*(?:%s|\?)|IN\s*\(([^)]*)\))", clause.group(1),
+                                               re.IGNORECASE):
+            if placeholders:
+                count = placeholders.count("%s") + placeholders.count("?")
+                conditions[column.lower()], params = frozenset(params[:count]), params[count:]
+            else:
+                conditions[column.lower()], params = params[0], params[1:]
+        return conditions
+
+    @staticmethod
+    def _matches(row: Dict[str, Any], conditions: Dict[str, Any]) -> bool:
+        return all(row.get(k) in v if isinstance(v, frozenset) else row.get(k) == v for k, v in conditions.items())
+
+    def _delete(self, statement: str, params: Optional[Any]) -> List[Any]:
+        table = re.match(r"DELETE FROM\s+(\w+)", statement, re.IGNORECASE).group(1).lower()
+        conditions = self._where(statement, params)
+        with self._lock:
+            rows = self.tables.get(table, [])
+            kept = [row for row in rows if not self._matches(row, conditions)]
+            self.tables[table] = kept
+            return [(len(rows) - len(kept),)]
+
+    def _select(self, statement: str, params: Optional[Any]) -> List[Any]:
+        table = re.search(r"FROM\s+(\w+)", statement, re.IGNORECASE).group(1).lower()
+        conditions = self._where(statement, params)
+        return [tuple(row.values()) for row in self.rows(table) if self._matches(row, conditions)]
+
+    def search(self, table: str, query: str, limit: int, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Token-overlap ranking standing in for Cortex Search"""
+        self.latencies.search.sleep()
+        terms = set(re.findall(r"\w+", query.lower()))
+        scored = []
+        for row in self.rows(table):
+            if filters and any(str(row.get(k.lower())) != str(v) for k, v in filters.items()):
+                continue
+            words = set(re.findall(r"\w+", str(row.get("content", "")).lower()))
+            overlap = len(terms & words)
+            if overlap:
+                scored.append((overlap, row))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [{k.upper(): v for k, v in row.items()} for _, row in scored[:limit]]
+
+
+class FakeCursor:
+    def __init__(self, warehouse: FakeWarehouse):
+        self.warehouse = warehouse
+        self._results: List[Any] = []
+        self.rowcount = 0
+
+    def execute(self, sql: str, params: Optional[Any] = None):
+        self._results = self.warehouse.execute(sql, params)
+        self.rowcount = self._results[0][0] if sql.strip().upper().startswith("DELETE") else len(self._results)
+        return self
+
+    def executemany(self, sql: str, seq_of_params):
+        count = 0
+        for params in seq_of_params:
+            self.warehouse.execute(sql, params)
+            count += 1
+        self.rowcount = count
+        return self
+
+    def fetchall(self) -> List[Any]:
+        return list(self._results)
+
+    def fetchone(self) -> Optional[Any]:
+        return self._results[0] if self._results else None
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+    def __init__(self, _warehouse: FakeWarehouse, **params):
+        self.warehouse = _warehouse
+        self.params = params
+        self.host = f"{params.get('account', 'fake')}.snowflakecomputing.local"
+        self.rest = SimpleNamespace(token="fake-session-token")
+        self.closed = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.warehouse)
+
+    def commit(self) -> None:
+        self.warehouse.latencies.commit.sleep()
+
+    def rollback(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeDataFrame:
+    def __init__(self, warehouse: FakeWarehouse, sql: str, params: Optional[Any]):
+        self.warehouse = warehouse
+        self.sql = sql
+        self.params = params
+
+    def collect(self) -> List[Any]:
+        return self.warehouse.execute(self.sql, self.params)
+
+
+class FakeSession:
+    def __init__(self, warehouse: FakeWarehouse):
+        self.warehouse = warehouse
+
+    def sql(self, query: str, params: Optional[Any] = None) -> FakeDataFrame:
+        return FakeDataFrame(self.warehouse, query, params)
+
+    def close(self) -> None:
+        pass
+
+
+class _FakeSessionBuilder:
+    def __init__(self, warehouse: FakeWarehouse):
+        self.warehouse = warehouse
+
+    def configs(self, params: Dict[str, Any]) -> "_FakeSessionBuilder":
+        return self
+
+    def create(self) -> FakeSession:
+        self.warehouse.latencies.connect.sleep()
+        return FakeSession(self.warehouse)
+
+
+class _FakeSearchResults:
+    def __init__(self, results: List[Dict[str, Any]]):
+        self.results = results
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"results": self.results, "request_id": "fake"}
+
+
+class _FakeSearchService:
+    def __init__(self, warehouse: FakeWarehouse, name: str):
+        self.warehouse = warehouse
+        self.table = name[:-len("search")] if name.lower().endswith("search") else name
+
+    def search(self, query: str, columns: List[str], limit: int = 5, filter: Optional[Dict[str, Any]] = None, **kwargs):
+        filters = {}
+        if filter and "@eq" in filter:
+            filters = dict(filter["@eq"])
+        return _FakeSearchResults(self.warehouse.search(self.table, query, limit, filters))
+
+
+class _Indexable(dict):
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def __missing__(self, key):
+        return self.factory(key)
+
+
+class FakeRoot:
+    """Replacement for snowflake.core.Root exposing only cortex_search_services lookups"""
+    warehouse: Optional[FakeWarehouse] = None
+
+    def __init__(self, session: FakeSession):
+        warehouse = session.warehouse
+        service = lambda name: _FakeSearchService(warehouse, name)
+        schema = lambda name: SimpleNamespace(cortex_search_services=_Indexable(service))
+        database = lambda name: SimpleNamespace(schemas=_Indexable(schema))
+        self.databases = _Indexable(database)
+
+
+# ---------------------------------------------------------------- Firestore
+
+class ArrayUnion:
+    def __init__(self, values: List[Any]):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values: List[Any]):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value: int):
+        self.value = value
+
+
+class FakeSnapshot:
+    def __init__(self, ref: "FakeDocumentRef", data: Optional[Dict[str, Any]]):
+        self.reference = ref
+        self.id = ref.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return None if self._data is None else dict(self._data)
+
+    def get(self, field: str) -> Any:
+        return (self._data or {}).get(field)
+
+
+class FakeFirestore:
+    """Document store with collection/document paths, ArrayUnion, queries and batches"""
+    def __init__(self, latencies: FakeLatencies):
+        self.latencies = latencies
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.reads = 0
+        self.writes = 0
+        self._lock = threading.RLock()
+        self._ids = 0
+
+    def collection(self, name: str) -> "FakeCollectionRef":
+        return FakeCollectionRef(self, name)
+
+    def batch(self) -> "FakeBatch":
+        return FakeBatch(self)
+
+    def transaction(self) -> "FakeBatch":
+        return FakeBatch(self)
+
+    def _next_id(self) -> str:
+        with self._lock:
+            self._ids += 1
+            return f"doc{self._ids:012d}"
+
+    def _read(self, path: str) -> Optional[Dict[str, Any]]:
+        self.latencies.firestore_read.sleep()
+        with self._lock:
+            self.reads += 1
+            data = self.documents.get(path)
+            return None if data is None else dict(data)
+
+    def _write(self, path: str, data: Dict[str, Any], merge: bool = False, create: bool = True) -> None:
+        with self._lock:
+            self.writes += 1
+            current = self.documents.get(path)
+            if current is None and not create:
+                raise Exception(f"404 No document to update: {path}")
+            updated = dict(current or {}) if (merge or not create) else {}
+            for field, value in data.items():
+                # update() treats dots as nested field paths
+                target = updated
+                if not create and "." in field:
+                    *parents, field = field.split(".")
+                    for parent in parents:
+                        target[parent] = dict(target.get(parent) or {})
+                        target = target[parent]
+                if isinstance(value, ArrayUnion):
+                    existing = list(target.get(field, []))
+                    existing.extend(item for item in value.values if item not in existing)
+                    target[field] = existing
+                elif isinstance(value, ArrayRemove):
+                    target[field] = [item for item in target.get(field, []) if item not in value.values]
+                elif isinstance(value, Increment):
+                    target[field] = target.get(field, 0) + value.value
+                else:
+                    target[field] = value
+            self.documents[path] = updated
+
+    def _delete(self, path: str) -> None:
+        with self._lock:
+            self.writes += 1
+            self.documents.pop(path, None)
+
+
+class FakeDocumentRef:
+    def __init__(self, db: FakeFirestore, path: str):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "FakeCollectionRef":
+        return FakeCollectionRef(self.db, f"{self.path}/{name}")
+
+    def get(self, transaction=None) -> FakeSnapshot:
+        return FakeSnapshot(self, self.db._read(self.path))
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        self.db.latencies.firestore_write.sleep()
+        self.db._write(self.path, data, merge=merge)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        self.db.latencies.firestore_write.sleep()
+        self.db._write(self.path, data, create=False)
+
+    def delete(self) -> None:
+        self.db.latencies.firestore_write.sleep()
+        self.db._delete(self.path)
+
+
+class FakeQuery:
+    def __init__(self, collection: "FakeCollectionRef", order: Optional[tuple] = None,
+                 limit: Optional[int] = None, filters: Optional[list] = None):
+        self.collection = collection
+        self._order = order
+        self._limit = limit
+        self._filters = filters or []
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return FakeQuery(self.collection, (field, direction), self._limit, self._filters)
+
+    def limit(self, count: int) -> "FakeQuery":
+        return FakeQuery(self.collection, self._order, count, self._filters)
+
+    def where(self, field: str, op: str, value: Any) -> "FakeQuery":
+        return FakeQuery(self.collection, self._order, self._limit, self._filters + [(field, op, value)])
+
+    def stream(self):
+        db = self.collection.db
+        db.latencies.firestore_read.sleep()
+        prefix = self.collection.path + "/"
+        with db._lock:
+            items = [
+                (path, dict(data)) for path, data in db.documents.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+            db.reads += len(items) if self._limit is None else min(len(items), self._limit)
+        ops = {"==": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+               ">": lambda a, b: a > b, ">=": lambda a, b: a >= b, "in": lambda a, b: a in b}
+        for field, op, value in self._filters:
+            items = [item for item in items if field in item[1] and ops[op](item[1][field], value)]
+        if self._order:
+            field, direction = self._order
+            items.sort(key=lambda item: item[1].get(field), reverse=direction == "DESCENDING")
+        if self._limit is not None:
+            items = items[:self._limit]
+        for path, data in items:
+            yield FakeSnapshot(FakeDocumentRef(db, path), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionRef(FakeQuery):
+    def __init__(self, db: FakeFirestore, path: str):
+        self.db = db
+        self.path = path
+        super().__init__(self)
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentRef:
+        return FakeDocumentRef(self.db, f"{self.path}/{doc_id or self.db._next_id()}")
+
+    def add(self, data: Dict[str, Any]):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeBatch:
+    """WriteBatch/Transaction stand-in that applies all queued writes with one round trip"""
+    def __init__(self, db: FakeFirestore):
+        self.db = db
+        self._ops: List[tuple] = []
+
+    def set(self, ref: FakeDocumentRef, data: Dict[str, Any], merge: bool = False) -> None:
+        self._ops.append(("set", ref, data, merge))
+
+    def update(self, ref: FakeDocumentRef, data: Dict[str, Any]) -> None:
+        self._ops.append(("update", ref, data, False))
+
+    def delete(self, ref: FakeDocumentRef) -> None:
+        self._ops.append(("delete", ref, None, False))
+
+    def commit(self) -> None:
+        self.db.latencies.firestore_write.sleep()
+        with self.db._lock:
+            for op, ref, data, merge in self._ops:
+                if op == "delete":
+                    self.db._delete(ref.path)
+                else:
+                    self.db._write(ref.path, data, merge=merge, create=op == "set")
+        self._ops = []
+
+
+# ---------------------------------------------------------------- Mistral
+
+class _FakeChat:
+    def __init__(self, latencies: FakeLatencies):
+        self.latencies = latencies
+
+    def _response(self, messages: List[Dict[str, str]]):
+        text = messages[-1]["content"] if messages else ""
+        summary = " ".join(text.split()[:40])
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"Summary: {summary}"))])
+
+    def complete(self, model: str, messages: List[Dict[str, str]], **kwargs):
+        self.latencies.mistral.sleep()
+        return self._response(messages)
+
+    async def complete_async(self, model: str, messages: List[Dict[str, str]], **kwargs):
+        await self.latencies.mistral.asleep()
+        return self._response(messages)
+
+
+class FakeMistral:
+    """Mirrors the mistralai client surface (chat.complete / chat.complete_async)"""
+    latencies: Optional[FakeLatencies] = None
+
+    def __init__(self, api_key: Optional[str] = None, **kwargs):
+        self.chat = _FakeChat(self.latencies or FakeLatencies(scale=0))
+
+
+# ---------------------------------------------------------------- crawl4ai / Playwright / PyPDF2
+
+class FakeCrawler:
+    """AsyncWebCrawler stand-in that serves pages from a local HTML corpus directory"""
+    corpus_dir: str = ""
+    latencies: Optional[FakeLatencies] = None
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def start(self):
+        return self
+
+    async def close(self):
+        pass
+
+    def _path(self, url: str) -> str:
+        name = re.sub(r"^\w+://[^/]+/?", "", url) or "index.html"
+        return os.path.join(self.corpus_dir, name)
+
+    async def run(self, url: str, **kwargs):
+        return await self.arun(url, **kwargs)
+
+    async def arun(self, url: str, **kwargs):
+        if self.latencies:
+            await self.latencies.crawl_page.asleep()
+        path = self._path(url)
+        if not os.path.exists(path):
+            return SimpleNamespace(success=False, markdown="", html="")
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+        text = re.sub(r"<[^>]+>", " ", html)
+        markdown = re.sub(r"[ \t]+", " ", text).strip()
+        return SimpleNamespace(success=True, markdown=markdown, html=html)
+
+
+class _FakePage:
+    def __init__(self, repos: Dict[str, List[str]], latencies: FakeLatencies):
+        self.repos = repos
+        self.latencies = latencies
+        self.url = ""
+
+    async def goto(self, url: str, timeout: int = 0):
+        self.url = url
+        await self.latencies.browser_page.asleep()
+
+    async def wait_for_timeout(self, ms: int):
+        # The real scraper waits a fixed 5s for gitingest to render; the profile decides here
+        await asyncio.sleep(0)
+
+    async def content(self) -> str:
+        name = self.url.rstrip("/").rsplit("/", 1)[-1]
+        files = self.repos.get(name, [])
+        return "<html><body>" + "".join(f"<textarea>{text}</textarea>" for text in files) + "</body></html>"
+
+
+class _FakeBrowser:
+    def __init__(self, repos, latencies):
+        self.repos = repos
+        self.latencies = latencies
+
+    async def new_page(self):
+        return _FakePage(self.repos, self.latencies)
+
+    async def new_context(self):
+        return self
+
+    async def close(self):
+        pass
+
+
+class _FakeChromium:
+    def __init__(self, repos, latencies):
+        self.repos = repos
+        self.latencies = latencies
+
+    async def launch(self, headless: bool = True):
+        return _FakeBrowser(self.repos, self.latencies)
+
+
+class FakePlaywright:
+    """async_playwright() replacement rendering gitingest-style pages from in-memory repos"""
+    def __init__(self, repos: Dict[str, List[str]], latencies: FakeLatencies):
+        self.chromium = _FakeChromium(repos, latencies)
+
+    async def __aenter__(self):
+        return self
+
+    async def start(self):
+        return self
+
+    async def stop(self):
+        pass
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakePdfReader:
+    """PyPDF2.PdfReader replacement; fake PDFs are UTF-8 text with form feeds between pages"""
+    def __init__(self, stream):
+        data = stream.read() if hasattr(stream, "read") else open(stream, "rb").read()
+        self.pages = [
+            SimpleNamespace(extract_text=lambda text=text: text)
+            for text in data.decode("utf-8").split("\f")
+        ]
+
+
+class FakeUpload:
+    """Mimics Streamlit's UploadedFile for pdf_scraper"""
+    def __init__(self, name: str, pages: List[str]):
+        self.name = name
+        self._data = "\f".join(pages).encode("utf-8")
+
+    def getvalue(self) -> bytes:
+        return self._data
+
+
+# ---------------------------------------------------------------- installation
+
+def fake_secrets(index_dir: str, storage: str = "per_user") -> str:
+    return f"""
+[SNOWFLAKE]
+ACCOUNT = "bench"
+USER = "bench"
+PASSWORD = "bench"
+DATABASE = "DEVRAG"
+WAREHOUSE = "COMMON"
+SCHEMA = "PUBLIC"
+
+[FIREBASE]
+TYPE = "service_account"
+PROJECT_ID = "bench"
+PRIVATE_KEY_ID = "bench"
+PRIVATE_KEY = "bench"
+CLIENT_EMAIL = "bench@example.com"
+CLIENT_ID = "bench"
+AUTH_URI = "https://example.com/auth"
+TOKEN_URI = "https://example.com/token"
+AUTH_PROVIDER_X509_CERT_URL = "https://example.com/certs"
+CLIENT_X509_CERT_URL = "https://example.com/cert"
+UNIVERSE_DOMAIN = "example.com"
+API_KEY = "bench"
+
+[MISTRAL]
+API_KEY = "bench"
+
+[RETRIEVAL]
+LEXICAL_DIR = "{index_dir}/lexical"
+INDEX_DIR = "{index_dir}/vectors"
+
+[CORTEX]
+COMPLETER = "fake"
+
+[STORAGE]
+MODE = "{storage}"
+
+[INGESTION]
+PROCESS_WORKERS = 0
+"""
+
+
+class FakeEnvironment:
+    """Holds the fakes for one benchmark run"""
+    def __init__(self, latencies: FakeLatencies, corpus_dir: str, repos: Dict[str, List[str]],
+                 storage: str = "per_user"):
+        self.latencies = latencies
+        self.storage = storage
+        self.warehouse = FakeWarehouse(latencies)
+        self.firestore = FakeFirestore(latencies)
+        self.corpus_dir = corpus_dir
+        self.repos = repos
+
+    def seed_user(self, user_id: str) -> None:
+        """Create the user_data document register_user would have written"""
+        self.firestore._write(f"user_data/{user_id}", {
+            "email": f"{user_id}@example.com",
+        })
+
+
+@contextmanager
+def installed(env: FakeEnvironment, workdir: str):
+    """Patch the backend's external dependencies with fakes and run from `workdir`"""
+    import backend
+    import retrieval
+    import completion
+
+    FakeCrawler.corpus_dir = env.corpus_dir
+    FakeCrawler.latencies = env.latencies
+    FakeMistral.latencies = env.latencies
+    latencies = env.latencies
+
+    class BenchCompleter(completion.FakeCompleter):
+        def __init__(self, answer=None, **kwargs):
+            super().__init__(answer=answer or env.warehouse.answer,
+                             first_token_delay=latencies.first_token.sample(),
+                             token_delay=latencies.token.mean)
+
+    patches = {
+        (backend, "snowflake_connector"): SimpleNamespace(
+            connect=lambda **params: (latencies.connect.sleep(), FakeConnection(env.warehouse, **params))[1]),
+        (backend, "Session"): SimpleNamespace(builder=_FakeSessionBuilder(env.warehouse)),
+        (backend, "firebase_admin"): SimpleNamespace(_apps={"[DEFAULT]": object()}, initialize_app=lambda *a, **k: None),
+        (backend, "credentials"): SimpleNamespace(Certificate=lambda data: data),
+        (backend, "firestore"): SimpleNamespace(client=lambda *a, **k: env.firestore, ArrayUnion=ArrayUnion,
+                                                ArrayRemove=ArrayRemove,
+                                                Increment=Increment, Query=SimpleNamespace(DESCENDING="DESCENDING", ASCENDING="ASCENDING")),
+        (backend, "Mistral"): FakeMistral,
+        (backend, "AsyncWebCrawler"): FakeCrawler,
+        (backend, "async_playwright"): lambda: FakePlaywright(env.repos, latencies),
+        (backend, "PyPDF2"): SimpleNamespace(PdfReader=FakePdfReader),
+        (backend, "FakeCompleter"): BenchCompleter,
+        (retrieval, "Root"): FakeRoot,
+    }
+    originals = {}
+    for (module, name), value in patches.items():
+        originals[(module, name)] = getattr(module, name, None)
+        setattr(module, name, value)
+
+    previous_cwd = os.getcwd()
+    os.makedirs(workdir, exist_ok=True)
+    with open(os.path.join(workdir, "secrets.toml"), "w") as f:
+        f.write(fake_secrets(os.path.join(workdir, ".devrag"), env.storage))
+    os.chdir(workdir)
+    backend.SnowflakeManager._instance = None
+    backend.Memory._shared = None
+    backend.Resources._shared = None
+    try:
+        yield env
+    finally:
+        if backend.SnowflakeManager._instance is not None:
+            backend.SnowflakeManager._instance.writer.close()
+        if backend.Memory._shared is not None:
+            backend.Memory._shared.cache.close()
+            backend.Memory._shared.summarizer.close()
+        os.chdir(previous_cwd)
+        backend.SnowflakeManager._instance = None
+        backend.Memory._shared = None
+        backend.Resources._shared = None
+        for (module, name), value in originals.items():
+            setattr(module, name, value)
@@ -0,0 +1,118 @@
+"""Cold-start import cost of each page, measured with `python -X importtime`
+
+Usage (from the repository root):
+    python -m benchmarks.importtime                      # current tree
+    python -m benchmarks.importtime --baseline HEAD~1    # compare against another revision
+    python -m benchmarks.importtime --runs 5 --top 15
+
+Each scenario runs in a fresh interpreter, so nothing is shared between
+samples. The reported time is the cumulative import time of the modules the
+page needs; --top lists the heaviest top-level imports of the last sample.
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+# What each page imports before it can render
+SCENARIOS = {
+    "landing": "import app",
+    "login": "import app; import requests",
+    "chatbot": "import app; import backend",
+    "query": "import backend; backend.snowflake_connector.load(); backend.Session.load(); "
+             "import retrieval; retrieval.Root.load(); backend.firestore.load()",
+    "ingest": "import backend; backend.PyPDF2.load(); backend.RecursiveCharacterTextSplitter.load(); "
+              "backend.AsyncWebCrawler.load(); backend.async_playwright.load(); backend.BeautifulSoup.load()",
+}
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(snippet: str, cwd: str) -> Tuple[float, List[Tuple[str, int]]]:
+    """Total import seconds and (module, cumulative microseconds) for top-level imports"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", snippet],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{snippet!r} failed in {cwd}:\n{result.stderr[-2000:]}")
+    top_level = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        # Exactly one space of indentation marks a module imported directly by the snippet
+        if match and len(match.group(3)) == 1:
+            top_level.append((match.group(4), int(match.group(2))))
+    return sum(us for _, us in top_level) / 1e6, top_level
+
+
+def run_tree(cwd: str, runs: int, scenarios: List[str]) -> Dict[str, Tuple[float, List[Tuple[str, int]]]]:
+    results = {}
+    for name in scenarios:
+        samples = []
+        top: List[Tuple[str, int]] = []
+        for _ in range(runs):
+            seconds, top = measure(SCENARIOS[name], cwd)
+            samples.append(seconds)
+        results[name] = (statistics.median(samples), top)
+    return results
+
+
+def checkout(revision: str) -> str:
+    """Export `revision` to a temporary directory without touching the working tree"""
+    directory = tempfile.mkdtemp(prefix="devrag-importtime-")
+    archive = subprocess.run(["git", "archive", revision], capture_output=True, check=True)
+    subprocess.run(["tar", "-x", "-C", directory], input=archive.stdout, check=True)
+    return directory
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Per-page cold-start import time")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per scenario (median reported)")
+    parser.add_argument("--baseline", help="git revision to compare against, e.g. HEAD~1")
+    parser.add_argument("--top", type=int, default=0, help="list the N heaviest top-level imports per scenario")
+    args = parser.parse_args(argv)
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    scenarios = [name.strip() for name in args.scenarios.split(",")]
+    current = run_tree(root, args.runs, scenarios)
+    baseline = None
+    if args.baseline:
+        directory = checkout(args.baseline)
+        try:
+            # Scenarios that reference names the old tree lacks are reported as n/a
+            baseline = {}
+            for name in scenarios:
+                try:
+                    baseline.update(run_tree(directory, args.runs, [name]))
+                except RuntimeError:
+                    baseline[name] = None
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    header = f"{'scenario':<10} {'import_s':>9}"
+    if baseline is not None:
+        header += f" {'baseline_s':>11} {'speedup':>8}"
+    print(header)
+    for name in scenarios:
+        seconds = current[name][0]
+        line = f"{name:<10} {seconds:>9.3f}"
+        if baseline is not None:
+            before = baseline.get(name)
+            if before is None:
+                line += f" {'n/a':>11} {'':>8}"
+            else:
+                line += f" {before[0]:>11.3f} {before[0] / seconds:>7.1f}x"
+        print(line)
+        if args.top:
+            for module, us in sorted(current[name][1], key=lambda item: item[1], reverse=True)[:args.top]:
+                print(f"    {module:<40} {us / 1000:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Offline end-to-end benchmarks for the Backend ingest and query paths
+
+Usage (from the repository root):
+    python -m benchmarks.run --scenarios web,github,pdf,query --concurrency 1,4,16
+    python -m benchmarks.run --latency-scale 0 --json results.json   # CPU-only profile
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import corpus
+from benchmarks.fakes import FakeEnvironment, FakeLatencies, FakeUpload, installed
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(pct / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _run_workers(concurrency: int, operations: List[Callable[[], Any]]) -> List[float]:
+    latencies: List[float] = []
+
+    def timed(operation):
+        start = time.perf_counter()
+        operation()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency in pool.map(timed, operations):
+            latencies.append(latency)
+    return latencies
+
+
+class Scenario:
+    def __init__(self, name: str, concurrency: int, args: argparse.Namespace, workdir: str):
+        self.name = name
+        self.concurrency = concurrency
+        self.args = args
+        self.workdir = workdir
+        self.users = [f"bench_user_{i}" for i in range(max(1, min(concurrency, args.users)))]
+        site_dir = os.path.join(workdir, "site")
+        self.site_url = corpus.write_site(site_dir, pages=args.pages, seed=args.seed)
+        self.repos = corpus.make_repos(seed=args.seed)
+        self.env = FakeEnvironment(FakeLatencies(scale=args.latency_scale), site_dir, self.repos,
+                                   storage=args.storage)
+        for user in self.users:
+            self.env.seed_user(user)
+
+    def operations(self, backends: Dict[str, Any]) -> List[Callable[[], Any]]:
+        users = self.users
+        ops = []
+        for i in range(self.args.operations):
+            backend = backends[users[i % len(users)]]
+            if self.name == "web":
+                ops.append(lambda b=backend: asyncio.run(b.web_crawler(self.site_url)))
+            elif self.name == "github":
+                repo = f"https://github.com/bench/repo-{i % len(self.repos)}"
+                ops.append(lambda b=backend, r=repo: asyncio.run(b.github_scraper(r)))
+            elif self.name == "pdf":
+                pages = corpus.make_pdf_pages(seed=self.args.seed + i)
+                ops.append(lambda b=backend, p=pages: b.pdf_scraper(FakeUpload("bench.pdf", p)))
+            elif self.name == "query":
+                queries = corpus.make_queries(self.args.queries_per_op, seed=self.args.seed + i)
+                ops.append(lambda b=backend, qs=queries: [b.query(q) for q in qs])
+        return ops
+
+    def prepare(self, backends: Dict[str, Any]) -> None:
+        if self.name == "query":
+            # Give every user something to retrieve from before measuring queries
+            for user, backend in backends.items():
+                backend.pdf_scraper(FakeUpload("seed.pdf", corpus.make_pdf_pages(seed=self.args.seed)))
+
+    def run(self) -> Dict[str, Any]:
+        with installed(self.env, os.path.join(self.workdir, "run")):
+            import backend as backend_module
+            backends = {user: backend_module.Backend(user) for user in self.users}
+            manager = backend_module.SnowflakeManager(self.users[0])
+            manager.connect()
+            self.prepare(backends)
+            manager.writer.flush()
+            operations = self.operations(backends)
+
+            rows_before = self.env.warehouse.row_count()
+            if self.args.trace_memory:
+                tracemalloc.start()
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            start = time.perf_counter()
+            latencies = _run_workers(self.concurrency, operations)
+            # Ingest is write-behind; count the time until every chunk is committed
+            manager.writer.flush()
+            wall = time.perf_counter() - start
+            rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak = None
+            if self.args.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            chunks = self.env.warehouse.row_count() - rows_before
+
+        if self.name == "query":
+            count = self.args.operations * self.args.queries_per_op
+            latencies = [latency / self.args.queries_per_op for latency in latencies]
+        else:
+            count = len(latencies)
+        return {
+            "scenario": self.name,
+            "concurrency": self.concurrency,
+            "operations": count,
+            "wall_seconds": round(wall, 3),
+            "ops_per_second": round(count / wall, 2) if wall else None,
+            "chunks": chunks,
+            "chunks_per_second": round(chunks / wall, 1) if wall and chunks else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+            "peak_rss_kb": rss_after,
+            "rss_growth_kb": rss_after - rss_before,
+            "traced_peak_kb": round(peak / 1024) if peak is not None else None,
+            "firestore_reads": self.env.firestore.reads,
+            "firestore_writes": self.env.firestore.writes,
+            "warehouse_statements": self.env.warehouse.statements,
+        }
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    columns = ["scenario", "concurrency", "operations", "ops_per_second", "chunks_per_second",
+               "p50_ms", "p95_ms", "p99_ms", "rss_growth_kb"]
+    widths = {column: max(len(column), *(len(str(r[column])) for r in results)) for column in columns}
+    print("  ".join(column.ljust(widths[column]) for column in columns))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(widths[column]) for column in columns))
+
+
+def main(argv=None) -> List[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="Offline DevRAG benchmarks with local fakes")
+    parser.add_argument("--scenarios", default="web,github,pdf,query")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--operations", type=int, default=16, help="operations per scenario run")
+    parser.add_argument("--queries-per-op", type=int, default=5)
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=20, help="pages in the local HTML corpus")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="multiplier for all fake latencies (0 measures pure CPU cost)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", choices=["per_user", "shared"], default="per_user",
+                        help="warehouse layout from the [STORAGE] secrets section")
+    parser.add_argument("--trace-memory", action="store_true", help="report tracemalloc peaks (slower)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in args.scenarios.split(","):
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            with tempfile.TemporaryDirectory(prefix=f"devrag-bench-{name}-") as workdir:
+                results.append(Scenario(name.strip(), concurrency, args, workdir).run())
+                print(f"finished {name} x{concurrency}", file=sys.stderr)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
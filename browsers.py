@@ -0,0 +1,72 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserPool:
+    """One headless Chromium and one crawl4ai crawler shared by every ingestion job
+
+    Both are started on first use on the event loop that uses them (the
+    ingestion scheduler's), instead of launching a browser per scrape. Pages
+    are handed out in isolated contexts, at most `max_pages` at a time.
+    close() must run on the same loop.
+    """
+    def __init__(self, playwright_factory: Callable[[], Any], crawler_factory: Callable[[], Any],
+                 max_pages: int = 4):
+        self.playwright_factory = playwright_factory
+        self.crawler_factory = crawler_factory
+        self.max_pages = max_pages
+        self._playwright = None
+        self._browser = None
+        self._crawler = None
+        self._pages: Optional[asyncio.Semaphore] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _primitives(self) -> asyncio.Lock:
+        # Created lazily so they bind to the loop that uses the pool
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._pages = asyncio.Semaphore(self.max_pages)
+        return self._lock
+
+    async def browser(self):
+        async with self._primitives():
+            if self._browser is None:
+                self._playwright = await self.playwright_factory().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+                logger.info("Launched shared Chromium for ingestion")
+        return self._browser
+
+    @asynccontextmanager
+    async def page(self):
+        """A fresh page in its own browser context, closed on exit"""
+        browser = await self.browser()
+        async with self._pages:
+            context = await browser.new_context()
+            try:
+                yield await context.new_page()
+            finally:
+                await context.close()
+
+    async def crawler(self):
+        async with self._primitives():
+            if self._crawler is None:
+                self._crawler = self.crawler_factory()
+                await self._crawler.start()
+                logger.info("Started shared crawler for ingestion")
+        return self._crawler
+
+    async def close(self) -> None:
+        for name, closer in (("crawler", lambda: self._crawler.close()),
+                             ("browser", lambda: self._browser.close()),
+                             ("playwright", lambda: self._playwright.stop())):
+            if getattr(self, f"_{name}") is None:
+                continue
+            try:
+                await closer()
+            except Exception as e:
+                logger.warning(f"Failed to close shared {name}: {e}")
+            setattr(self, f"_{name}", None)
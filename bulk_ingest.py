@@ -0,0 +1,256 @@
+"""Ingest the websites, GitHub repositories and PDFs listed in a manifest
+
+Usage (from the repository root, with secrets.toml in place):
+    python bulk_ingest.py onboarding.jsonl --concurrency 16
+    python bulk_ingest.py team.yaml --user alice     # default user for entries without one
+    python bulk_ingest.py team.yaml --restart        # ignore earlier progress
+
+A JSONL manifest has one entry per line; a YAML manifest (needs PyYAML) is a
+list of the same entries or groups them by user:
+
+    {"user": "alice", "type": "github", "source": "https://github.com/org/repo"}
+    {"user": "alice", "type": "web", "source": "https://docs.example.com", "priority": 0}
+    {"user": "bob", "type": "pdf", "source": "handbooks/onboarding.pdf"}
+
+    users:
+      alice:
+        github: [https://github.com/org/repo]
+        web: [https://docs.example.com]
+      bob:
+        pdf: [handbooks/onboarding.pdf]
+
+PDF paths are relative to the manifest. Finished entries are appended to
+<manifest>.progress.jsonl as they complete, so an interrupted or partly
+failed run picks up where it stopped: succeeded entries are skipped and
+failed ones are tried again. A PDF that changed on disk is ingested again.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from config import section
+from ingestion import FAILED, FINISHED, SUCCEEDED, IngestionScheduler
+
+KINDS = {"github": "github", "web": "web", "website": "web", "pdf": "pdf"}
+
+
+class ManifestEntry:
+    def __init__(self, user_id: str, kind: str, source: str, priority: Optional[int] = None):
+        self.user_id = user_id
+        self.kind = kind
+        self.source = source
+        self.priority = priority
+
+    @property
+    def key(self) -> str:
+        """Identifies the entry across runs; a PDF's also covers its size and modification time"""
+        parts = [self.user_id, self.kind, self.source]
+        if self.kind == "pdf" and os.path.exists(self.source):
+            stat = os.stat(self.source)
+            parts += [str(stat.st_size), str(int(stat.st_mtime))]
+        return hashlib.sha1("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def __str__(self) -> str:
+        return f"{self.user_id} {self.kind} {self.source}"
+
+
+def _entry(raw: Dict[str, Any], default_user: Optional[str], base_dir: str) -> ManifestEntry:
+    user_id = raw.get("user") or default_user
+    kind = KINDS.get(str(raw.get("type", "")).lower())
+    source = raw.get("source")
+    if not user_id or not kind or not source:
+        raise ValueError(f"Manifest entry needs a user, a type (github, web or pdf) and a source: {raw}")
+    if kind == "pdf":
+        source = os.path.normpath(os.path.join(base_dir, os.path.expanduser(source)))
+    return ManifestEntry(user_id, kind, source, raw.get("priority"))
+
+
+def load_manifest(path: str, default_user: Optional[str] = None) -> List[ManifestEntry]:
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise SystemExit("Reading a YAML manifest needs PyYAML (pip install pyyaml); JSONL works without it")
+        with open(path, "r") as f:
+            document = yaml.safe_load(f) or []
+        if isinstance(document, dict):
+            raw_entries = [
+                {"user": user_id, "type": kind, "source": source}
+                for user_id, sources in (document.get("users") or {}).items()
+                for kind, listed in (sources or {}).items()
+                for source in listed or []
+            ]
+        else:
+            raw_entries = document
+    else:
+        with open(path, "r") as f:
+            raw_entries = [json.loads(line) for line in f if line.strip() and not line.lstrip().startswith("#")]
+    entries = [_entry(raw, default_user, base_dir) for raw in raw_entries]
+    # The same source listed twice for a user is ingested once
+    unique = {}
+    for entry in entries:
+        unique.setdefault(entry.key, entry)
+    return list(unique.values())
+
+
+class ProgressLog:
+    """Append-only record of finished entries; the last record of an entry wins"""
+    def __init__(self, path: str):
+        self.path = path
+        self.statuses: Dict[str, str] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short by a crash
+                    self.statuses[record["key"]] = record["status"]
+
+    def done(self, entry: ManifestEntry) -> bool:
+        return self.statuses.get(entry.key) == SUCCEEDED
+
+    def record(self, entry: ManifestEntry, snapshot: Dict[str, Any]) -> None:
+        self.statuses[entry.key] = snapshot["status"]
+        with open(self.path, "a") as f:
+            f.write(json.dumps({
+                "key": entry.key,
+                "user": entry.user_id,
+                "type": entry.kind,
+                "source": entry.source,
+                "status": snapshot["status"],
+                "chunks": snapshot.get("chunks", 0),
+                "error": snapshot.get("error"),
+                "finished_at": snapshot.get("finished_at"),
+            }) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class BulkIngestion:
+    """Feeds manifest entries to the ingestion scheduler, at most `window` at a time
+
+    Only a window of entries is queued at once, so PDFs are read from disk
+    as they are needed rather than all up front.
+    """
+    def __init__(self, resources, scheduler: IngestionScheduler, progress: ProgressLog, window: int):
+        self.resources = resources
+        self.scheduler = scheduler
+        self.progress = progress
+        self.window = window
+        self.running: Dict[str, ManifestEntry] = {}
+        self.succeeded = 0
+        self.failed = 0
+        self.chunks = 0
+
+    def submit(self, entry: ManifestEntry) -> str:
+        backend = self.resources.backend(entry.user_id)
+        if entry.kind == "github":
+            return backend.submit_github(entry.source, entry.priority)
+        if entry.kind == "web":
+            return backend.submit_website(entry.source, entry.priority)
+        with open(entry.source, "rb") as f:
+            content = f.read()
+        return backend.submit_pdf_bytes(content, os.path.basename(entry.source), entry.priority)
+
+    def _finish(self, entry: ManifestEntry, snapshot: Dict[str, Any]) -> None:
+        self.progress.record(entry, snapshot)
+        if snapshot["status"] == SUCCEEDED:
+            self.succeeded += 1
+            self.chunks += snapshot.get("chunks", 0)
+            print(f"done    {entry} ({snapshot.get('chunks', 0)} chunks)")
+        else:
+            self.failed += 1
+            print(f"{snapshot['status']:<7} {entry}: {snapshot.get('error') or ''}")
+
+    def _poll(self) -> None:
+        for job_id, entry in list(self.running.items()):
+            snapshot = self.scheduler.job(job_id)
+            if snapshot is not None and snapshot["status"] in FINISHED:
+                del self.running[job_id]
+                self._finish(entry, snapshot)
+
+    def _report(self, total: int, started: float) -> None:
+        elapsed = time.monotonic() - started
+        in_flight = [self.scheduler.job(job_id) for job_id in self.running]
+        chunks = self.chunks + sum(snapshot.get("chunks", 0) for snapshot in in_flight if snapshot)
+        finished = self.succeeded + self.failed
+        print(f"[{finished}/{total}] {len(self.running)} in flight, {self.failed} failed, "
+              f"{finished / elapsed * 60:.1f} sources/min, {chunks / elapsed:.1f} chunks/s, {elapsed:.0f}s elapsed")
+
+    def run(self, entries: List[ManifestEntry], interval: float = 10.0) -> None:
+        pending = deque(entries)
+        started = time.monotonic()
+        reported = started
+        try:
+            while pending or self.running:
+                self._poll()
+                while pending and len(self.running) < self.window:
+                    entry = pending.popleft()
+                    try:
+                        self.running[self.submit(entry)] = entry
+                    except Exception as e:
+                        self._finish(entry, {"status": FAILED, "error": str(e)})
+                if self.running and time.monotonic() - reported >= interval:
+                    self._report(len(entries), started)
+                    reported = time.monotonic()
+                time.sleep(0.2)
+        except KeyboardInterrupt:
+            print(f"Interrupted; cancelling {len(self.running)} running entries. "
+                  f"Run the same command again to resume.")
+            for job_id in self.running:
+                self.scheduler.cancel(job_id)
+            raise
+        finally:
+            self._report(len(entries), started)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Ingest the sources listed in a JSONL or YAML manifest")
+    parser.add_argument("manifest", help="JSONL or YAML manifest of sources")
+    parser.add_argument("--user", help="user id for entries that do not name one")
+    parser.add_argument("--concurrency", type=int, default=8, help="entries ingested at the same time")
+    parser.add_argument("--per-user", type=int, help="entries of one user ingested at the same time (default: --concurrency)")
+    parser.add_argument("--state", help="progress file (default: <manifest>.progress.jsonl)")
+    parser.add_argument("--restart", action="store_true", help="ingest every entry again, ignoring earlier progress")
+    parser.add_argument("--interval", type=float, default=10.0, help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    entries = load_manifest(args.manifest, args.user)
+    state = args.state or f"{args.manifest}.progress.jsonl"
+    if args.restart and os.path.exists(state):
+        os.remove(state)
+    progress = ProgressLog(state)
+    todo = [entry for entry in entries if not progress.done(entry)]
+    print(f"{len(entries)} entries in {args.manifest}, {len(entries) - len(todo)} already ingested")
+    if not todo:
+        return
+
+    settings = section("INGESTION")
+    # Created before Resources asks for the shared scheduler, so this run's limits apply
+    scheduler = IngestionScheduler.shared(
+        max_concurrency=args.concurrency,
+        per_user_limit=args.per_user or args.concurrency,
+        process_workers=settings.get("PROCESS_WORKERS", 2),
+        # Finished jobs stay visible until polled, however many finish at once
+        history=2 * args.concurrency + 20,
+    )
+    from backend import Resources
+    resources = Resources.shared()
+    resources.snowflake.ensure_connected()
+    try:
+        BulkIngestion(resources, scheduler, progress, window=2 * args.concurrency).run(todo, args.interval)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    finally:
+        resources.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
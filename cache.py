@@ -0,0 +1,320 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+# (question terms, answer, source version, created at)
+AnswerEntry = Tuple[frozenset, str, int, float]
+
+# Words that do not change what a question asks; negations and question words are not among them
+STOPWORDS = frozenset("""
+    a an the is are was were be been being am do does did to of in on for with at by from about into onto
+    and or as i me my we our you your can could would should will shall may might must please just so
+    there here some any
+""".split())
+# Two questions differing in a negation ask different things
+NEGATIONS = frozenset("not no never without".split())
+# As do two that both have a question word but not the same one
+QUESTION_WORDS = frozenset("how why what when where which who whom whose".split())
+# Words that point back at the conversation; a query using them depends on memory, not just its text
+REFERENCES = frozenset("""
+    it its it's this that these those they them their he she his her more above previous earlier last
+    again else same also another other former latter
+""".split())
+
+
+class RetrievalCache:
+    """Size-bounded LRU cache with TTL for search service results"""
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Any]]" = OrderedDict()
+        self._by_service: Dict[Tuple[str, str], Set[CacheKey]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Case-fold and collapse whitespace so trivial rephrasings share an entry"""
+        return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?!. ')
+
+    def _key(self, user_id: str, service: str, query: str) -> CacheKey:
+        return (user_id, service, self.normalize_query(query))
+
+    def get(self, user_id: str, service: str, query: str) -> Optional[Any]:
+        key = self._key(user_id, service, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+            self.misses += 1
+            return None
+
+    def put(self, user_id: str, service: str, query: str, value: Any) -> None:
+        key = self._key(user_id, service, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._by_service.setdefault((user_id, service), set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+
+    def invalidate(self, user_id: str, service: Optional[str] = None) -> int:
+        """Drop every entry for a user's service (or all of the user's services)"""
+        with self._lock:
+            groups = [
+                group for group in self._by_service
+                if group[0] == user_id and (service is None or group[1] == service)
+            ]
+            dropped = 0
+            for group in groups:
+                for key in list(self._by_service.get(group, ())):
+                    self._discard(key)
+                    dropped += 1
+            return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_service.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
+
+    def _discard(self, key: CacheKey) -> None:
+        """Remove a key from both indexes; caller must hold the lock"""
+        self._entries.pop(key, None)
+        group = self._by_service.get(key[:2])
+        if group is not None:
+            group.discard(key)
+            if not group:
+                del self._by_service[key[:2]]
+
+
+class AnswerCache:
+    """Per-user cache of generated answers for questions that differ only in wording
+
+    Questions are compared on their terms: content words (everything but
+    STOPWORDS) with common suffixes stripped, so case, punctuation, filler
+    words and plural or -ing forms do not matter. A cached answer is reused
+    when its question's terms are at least `threshold` similar (Dice
+    coefficient) to the new one's, with the same negations and, where both
+    have one, the same question word. Each user's entries are indexed by term, so a lookup
+    only scores entries sharing a term with the question. Follow-up
+    questions that refer back to the conversation are never cached: their
+    answer depends on memory, not on their text.
+    """
+    def __init__(self, threshold: float = 0.85, max_entries_per_user: int = 256, ttl: float = 3600.0):
+        self.threshold = threshold
+        self.max_entries_per_user = max_entries_per_user
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, "OrderedDict[str, AnswerEntry]"] = {}
+        # user -> term -> keys of the entries whose question has it
+        self._index: Dict[str, Dict[str, Set[str]]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def content_words(query: str) -> frozenset:
+        """Words that carry what a question asks"""
+        return frozenset(word for word in re.findall(r"[\w']+", query.lower()) if word not in STOPWORDS)
+
+    @staticmethod
+    def stem(word: str) -> str:
+        if word in NEGATIONS or word in QUESTION_WORDS:
+            return word
+        for suffix, replacement in (("ies", "y"), ("ing", ""), ("ed", ""), ("es", ""), ("s", ""), ("e", "")):
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                return word[:-len(suffix)] + replacement
+        return word
+
+    @staticmethod
+    def terms(query: str) -> frozenset:
+        return frozenset(AnswerCache.stem(word) for word in AnswerCache.content_words(query))
+
+    @staticmethod
+    def cacheable(query: str) -> bool:
+        """Whether the question stands on its own, rather than following up on the conversation"""
+        words = AnswerCache.content_words(query)
+        return bool(words) and not words & REFERENCES
+
+    @staticmethod
+    def similarity(a: frozenset, b: frozenset) -> float:
+        """Dice coefficient of two term sets, 0 when their negations or question words differ"""
+        if not a or not b or a & NEGATIONS != b & NEGATIONS:
+            return 0.0
+        asked_a, asked_b = a & QUESTION_WORDS, b & QUESTION_WORDS
+        if asked_a and asked_b and asked_a != asked_b:
+            return 0.0
+        return 2 * len(a & b) / (len(a) + len(b))
+
+    def source_version(self, user_id: str) -> int:
+        with self._lock:
+            return self._versions.get(user_id, 0)
+
+    def lookup(self, user_id: str, query: str) -> Optional[str]:
+        """Return the answer of the most similar fresh question at or above the threshold"""
+        if not self.cacheable(query):
+            return None
+        probe = self.terms(query)
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries.get(user_id) or {}
+            index = self._index.get(user_id, {})
+            version = self._versions.get(user_id, 0)
+            candidates = set().union(*(index.get(term, ()) for term in probe))
+            best_key, best_score = None, self.threshold
+            for key in candidates:
+                terms, _, entry_version, created = entries[key]
+                if entry_version != version or now - created > self.ttl:
+                    self._discard(user_id, key)
+                    continue
+                score = self.similarity(probe, terms)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            entries.move_to_end(best_key)
+            self.hits += 1
+            return entries[best_key][1]
+
+    def store(self, user_id: str, query: str, answer: str, version: Optional[int] = None) -> None:
+        """Record an answer produced while the user's sources were at `version`"""
+        if not self.cacheable(query):
+            return
+        terms = self.terms(query)
+        key = RetrievalCache.normalize_query(query)
+        with self._lock:
+            current = self._versions.get(user_id, 0)
+            if version is not None and version != current:
+                return  # sources changed while the answer was being generated
+            entries = self._entries.setdefault(user_id, OrderedDict())
+            if key in entries:
+                self._discard(user_id, key)
+            entries[key] = (terms, answer, current, time.monotonic())
+            index = self._index.setdefault(user_id, {})
+            for term in terms:
+                index.setdefault(term, set()).add(key)
+            while len(entries) > self.max_entries_per_user:
+                self._discard(user_id, next(iter(entries)))
+
+    def invalidate(self, user_id: str) -> None:
+        """Mark the user's sources as changed and drop their cached answers"""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            self._entries.pop(user_id, None)
+            self._index.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": sum(len(entries) for entries in self._entries.values()),
+            }
+
+    def _discard(self, user_id: str, key: str) -> None:
+        """Remove an entry and its index postings; caller must hold the lock"""
+        entry = self._entries.get(user_id, {}).pop(key, None)
+        if entry is None:
+            return
+        index = self._index.get(user_id, {})
+        for term in entry[0]:
+            postings = index.get(term)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del index[term]
+
+
+class SourceVersions:
+    """Per-user change counters for each source, shared by every process through Firestore
+
+    Caches live in each process. Ingestion in any process bumps the counter
+    of the source it wrote, and changed() tells a process which sources moved
+    since it last looked, so it can drop what it cached for them. A user's
+    counters are re-read at most every `refresh_interval` seconds, and a
+    burst of writes to one source bumps its counter about once per interval,
+    so another process's caches are at most about two intervals stale.
+    """
+    def __init__(self, get_db: Callable[[], Any], firestore_module, refresh_interval: float = 1.0):
+        self.get_db = get_db
+        self.firestore = firestore_module
+        self.refresh_interval = refresh_interval
+        # user -> (read at, counters as last seen)
+        self._seen: Dict[str, Tuple[float, Dict[str, int]]] = {}
+        self._bumped: Dict[Tuple[str, str], float] = {}
+        self._scheduled: Set[Tuple[str, str]] = set()
+        self._lock = threading.Lock()
+
+    def _document(self, user_id: str):
+        return self.get_db().collection('source_versions').document(user_id)
+
+    def changed(self, user_id: str) -> Set[str]:
+        """Sources whose counter moved since the previous call for this user"""
+        now = time.monotonic()
+        with self._lock:
+            seen = self._seen.get(user_id)
+            if seen is not None and now - seen[0] < self.refresh_interval:
+                return set()
+        try:
+            snapshot = self._document(user_id).get()
+            current = (snapshot.to_dict() if snapshot.exists else None) or {}
+        except Exception as e:
+            logger.warning(f"Failed to read source versions for {user_id}: {e}")
+            return set()
+        with self._lock:
+            previous = self._seen.get(user_id, (0.0, None))[1]
+            self._seen[user_id] = (now, current)
+        if previous is None:
+            # Nothing was cached for the user before the first read
+            return set()
+        return {source for source in set(previous) | set(current) if previous.get(source) != current.get(source)}
+
+    def bump(self, user_id: str, source: str) -> None:
+        """Tell every process that `source` changed; calls within an interval share one write"""
+        key = (user_id, source)
+        with self._lock:
+            if key in self._scheduled:
+                return
+            wait = self._bumped.get(key, float('-inf')) + self.refresh_interval - time.monotonic()
+            if wait > 0:
+                self._scheduled.add(key)
+                timer = threading.Timer(wait, self._bump, args=key)
+                timer.daemon = True
+                timer.start()
+                return
+        self._bump(user_id, source)
+
+    def _bump(self, user_id: str, source: str) -> None:
+        with self._lock:
+            self._scheduled.discard((user_id, source))
+            self._bumped[(user_id, source)] = time.monotonic()
+        try:
+            self._document(user_id).set({source: self.firestore.Increment(1)}, merge=True)
+        except Exception as e:
+            logger.warning(f"Failed to publish a change to {user_id}'s {source} source: {e}")
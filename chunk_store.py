@@ -0,0 +1,215 @@
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from chunks import Chunk, content_hash, document_id
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    extracted_at REAL NOT NULL,
+    UNIQUE (user_id, source, origin, hash)
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    document_id INTEGER NOT NULL REFERENCES documents(id),
+    chunker TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL REFERENCES blobs(hash),
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    PRIMARY KEY (document_id, chunker, position)
+);
+CREATE TABLE IF NOT EXISTS deletions (
+    user_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    origin TEXT NOT NULL,
+    deleted_at REAL NOT NULL,
+    PRIMARY KEY (user_id, source, origin)
+);
+CREATE INDEX IF NOT EXISTS documents_by_origin ON documents (user_id, source, origin, extracted_at);
+"""
+
+
+class ChunkStore:
+    """Local, content-addressed record of every extracted document and its chunks
+
+    Texts are stored once per SHA-256 in zlib-compressed blobs, so a page
+    scraped again unchanged or a chunk shared by two documents costs nothing
+    extra. Each (user, source, origin) keeps one document row per distinct
+    extraction; the newest is the current one, unless the document was
+    deleted after it was extracted (see delete()). Chunks are recorded per
+    chunker key with their offsets into the document, so a retrieval backend
+    can be rebuilt, or the text re-chunked, without going back to the
+    network sources (see backfill.py).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # One connection per thread, so ingest threads read concurrently and only
+        # wait on each other for SQLite's write lock, not for a shared connection
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._conn.executescript(_SCHEMA)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._lock:
+                if self._closed:
+                    conn.close()
+                    raise RuntimeError("Chunk store is closed")
+                self._connections.append(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _blob_rows(texts: Iterable[str]) -> Tuple[List[str], List[Tuple[str, bytes, int]]]:
+        """Hashes of `texts` and their compressed blob rows, computed outside any transaction"""
+        hashes, rows = [], {}
+        for text in texts:
+            digest = content_hash(text)
+            hashes.append(digest)
+            if digest not in rows:
+                rows[digest] = (digest, zlib.compress(text.encode("utf-8"), 6), len(text))
+        return hashes, list(rows.values())
+
+    def _put_blobs(self, conn: sqlite3.Connection, rows: List[Tuple[str, bytes, int]]) -> None:
+        conn.executemany("INSERT OR IGNORE INTO blobs (hash, data, size) VALUES (?, ?, ?)", rows)
+
+    def put(self, user_id: str, source: str, origin: Optional[str], text: str, chunker: str,
+            chunks: List[Chunk]) -> int:
+        """Record a document and its chunks in one transaction; returns the document id"""
+        (digest,), blobs = self._blob_rows([text])
+        _, chunk_blobs = self._blob_rows(chunk.content for chunk in chunks)
+        conn = self._conn
+        # IMMEDIATE takes the write lock up front, waiting out other writers instead of failing midway
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._put_blobs(conn, blobs)
+            conn.execute(
+                "INSERT INTO documents (user_id, source, origin, hash, extracted_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, source, origin, hash) DO UPDATE SET extracted_at = excluded.extracted_at",
+                (user_id, source, origin or '', digest, time.time()),
+            )
+            row_id, = conn.execute(
+                "SELECT id FROM documents WHERE user_id = ? AND source = ? AND origin = ? AND hash = ?",
+                (user_id, source, origin or '', digest),
+            ).fetchone()
+            self._put_chunks(conn, row_id, chunker, chunks, chunk_blobs)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row_id
+
+    def put_chunks(self, row_id: int, chunker: str, chunks: List[Chunk]) -> None:
+        """Record a document's chunks under another chunker"""
+        _, blobs = self._blob_rows(chunk.content for chunk in chunks)
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._put_chunks(conn, row_id, chunker, chunks, blobs)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _put_chunks(self, conn: sqlite3.Connection, row_id: int, chunker: str, chunks: List[Chunk],
+                    blobs: List[Tuple[str, bytes, int]]) -> None:
+        conn.execute("DELETE FROM chunks WHERE document_id = ? AND chunker = ?", (row_id, chunker))
+        self._put_blobs(conn, blobs)
+        conn.executemany(
+            "INSERT INTO chunks (document_id, chunker, position, hash, start, end) VALUES (?, ?, ?, ?, ?, ?)",
+            [(row_id, chunker, chunk.ordinal, chunk.hash, chunk.start, chunk.end) for chunk in chunks],
+        )
+
+    def delete(self, user_id: str, source: str, origin: Optional[str]) -> None:
+        """Record that a document was deleted; documents() leaves it out until it is extracted again"""
+        self._conn.execute(
+            "INSERT INTO deletions (user_id, source, origin, deleted_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (user_id, source, origin) DO UPDATE SET deleted_at = excluded.deleted_at",
+            (user_id, source, origin or '', time.time()),
+        )
+
+    def documents(self, user_ids: Optional[List[str]] = None,
+                  sources: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """The current (newest) document of every user, source and origin not deleted since"""
+        query = ("SELECT id, user_id, source, origin, hash, extracted_at FROM documents AS d "
+                 "WHERE extracted_at = (SELECT MAX(extracted_at) FROM documents "
+                 "WHERE user_id = d.user_id AND source = d.source AND origin = d.origin) "
+                 "AND NOT EXISTS (SELECT 1 FROM deletions AS x WHERE x.user_id = d.user_id "
+                 "AND x.source = d.source AND x.origin = d.origin AND x.deleted_at >= d.extracted_at)")
+        params: List[Any] = []
+        for column, values in (("user_id", user_ids), ("source", sources)):
+            if values:
+                query += f" AND {column} IN ({', '.join('?' * len(values))})"
+                params.extend(values)
+        rows = self._conn.execute(query + " ORDER BY user_id, source, id", params).fetchall()
+        for row_id, user_id, source, origin, digest, extracted_at in rows:
+            yield {"id": row_id, "user_id": user_id, "source": source, "origin": origin or None,
+                   "document_id": document_id(user_id, source, origin), "hash": digest, "extracted_at": extracted_at}
+
+    def text(self, digest: str) -> str:
+        row = self._conn.execute("SELECT data FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def chunks(self, document: Dict[str, Any], chunker: str) -> Optional[List[Chunk]]:
+        """A document from documents() as chunked by `chunker`, or None if it was never chunked that way"""
+        rows = self._conn.execute(
+            "SELECT b.data, c.position, c.start, c.end, c.hash FROM chunks AS c JOIN blobs AS b ON b.hash = c.hash "
+            "WHERE c.document_id = ? AND c.chunker = ? ORDER BY c.position",
+            (document["id"], chunker),
+        ).fetchall()
+        if not rows:
+            return None
+        return [
+            Chunk(zlib.decompress(data).decode("utf-8"), document["source"], document["document_id"],
+                  position, start, end, digest)
+            for data, position, start, end, digest in rows
+        ]
+
+    def provenance(self, user_id: str, source: str) -> List[Tuple[str, str, int, Optional[str]]]:
+        """(chunk hash, document id, ordinal, origin) of every chunk recorded for a user's source, under any chunker"""
+        rows = self._conn.execute(
+            "SELECT DISTINCT c.hash, c.position, d.origin FROM chunks AS c JOIN documents AS d ON d.id = c.document_id "
+            "WHERE d.user_id = ? AND d.source = ?",
+            (user_id, source),
+        ).fetchall()
+        return [(digest, document_id(user_id, source, origin), position, origin or None)
+                for digest, position, origin in rows]
+
+    def stats(self) -> Dict[str, int]:
+        conn = self._conn
+        documents, = conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+        chunks, = conn.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        blobs, stored, raw = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0), COALESCE(SUM(size), 0) FROM blobs"
+        ).fetchone()
+        return {"documents": documents, "chunks": chunks, "blobs": blobs, "stored_bytes": stored, "text_chars": raw}
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
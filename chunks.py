@@ -0,0 +1,34 @@
+import hashlib
+from typing import Optional
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def document_id(user_id: str, source: str, origin: Optional[str]) -> str:
+    """Stable id of one document (a crawled site, repository or PDF name) of a user's source
+
+    Ingesting the same origin again yields the same id, which is what lets
+    its chunks be replaced instead of added to.
+    """
+    return hashlib.sha256("\0".join((user_id, source, origin or '')).encode("utf-8")).hexdigest()[:32]
+
+
+class Chunk:
+    """One chunk and where it came from; slots keep large ingests light and cheap to pickle"""
+    __slots__ = ("content", "source", "document_id", "ordinal", "hash", "start", "end")
+
+    def __init__(self, content: str, source: str, document_id: str, ordinal: int,
+                 start: int = -1, end: int = -1, hash: Optional[str] = None):
+        self.content = content
+        self.source = source
+        self.document_id = document_id
+        self.ordinal = ordinal
+        # Offsets into the extracted document; -1 when unknown
+        self.start = start
+        self.end = end
+        self.hash = hash or content_hash(content)
+
+    def __repr__(self) -> str:
+        return f"Chunk({self.source}, {self.document_id}, #{self.ordinal}, {self.hash[:12]})"
@@ -0,0 +1,91 @@
+import re
+import json
+import time
+import logging
+from typing import Any, Callable, ContextManager, Iterator, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingCompleter:
+    """Interface for LLM backends that yield the answer incrementally"""
+    def stream(self, prompt: str) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class CortexRestCompleter(StreamingCompleter):
+    """Streams COMPLETE output from the Cortex REST API as server-sent events
+
+    A pooled connection is held only long enough to read its host and
+    session token; the stream itself goes over HTTP.
+    """
+    def __init__(self, connection: Callable[[], ContextManager[Any]], model: str = 'mistral-large2',
+                 timeout: float = 120.0):
+        self.connection = connection
+        self.model = model
+        self.timeout = timeout
+        self.http = requests.Session()
+
+    def _endpoint(self, conn) -> str:
+        return f"https://{conn.host}/api/v2/cortex/inference:complete"
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        with self.connection() as conn:
+            endpoint, token = self._endpoint(conn), conn.rest.token
+        response = self.http.post(
+            endpoint,
+            json={
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "stream": True,
+            },
+            headers={
+                "Authorization": f'Snowflake Token="{token}"',
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream",
+            },
+            stream=True,
+            timeout=self.timeout,
+        )
+        try:
+            if response.status_code != 200:
+                raise Exception(f"Cortex completion failed ({response.status_code}): {response.text}")
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                try:
+                    event = json.loads(payload)
+                except ValueError:
+                    logger.error(f"Malformed Cortex stream event: {payload}")
+                    continue
+                for choice in event.get("choices", []):
+                    text = (choice.get("delta") or {}).get("content")
+                    if text:
+                        yield text
+        finally:
+            response.close()
+
+
+class FakeCompleter(StreamingCompleter):
+    """Local stand-in that streams a canned (or prompt-derived) answer word by word"""
+    def __init__(self, answer: Optional[str] = None, first_token_delay: float = 0.05,
+                 token_delay: float = 0.01):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        answer = self.answer
+        if answer is None:
+            query = prompt.rsplit("**User Query**:", 1)[-1].split("###", 1)[0].strip()
+            answer = f"This is a locally generated answer to: {query}"
+        time.sleep(self.first_token_delay)
+        for i, token in enumerate(re.findall(r'\S+\s*', answer)):
+            if i:
+                time.sleep(self.token_delay)
+            yield token
@@ -0,0 +1,67 @@
+import os
+import logging
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+import toml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = 'secrets.toml'
+
+# Keys every deployment needs; optional sections ([RETRIEVAL], [STORAGE], ...) fall back to defaults
+REQUIRED = {
+    "SNOWFLAKE": ["ACCOUNT", "USER", "PASSWORD", "DATABASE", "WAREHOUSE", "SCHEMA"],
+    "FIREBASE": [
+        "TYPE", "PROJECT_ID", "PRIVATE_KEY_ID", "PRIVATE_KEY", "CLIENT_EMAIL", "CLIENT_ID", "AUTH_URI",
+        "TOKEN_URI", "AUTH_PROVIDER_X509_CERT_URL", "CLIENT_X509_CERT_URL", "UNIVERSE_DOMAIN", "API_KEY",
+    ],
+    "MISTRAL": ["API_KEY"],
+}
+
+_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    """secrets.toml is missing, unreadable or lacks required settings"""
+
+
+def validate(config: Dict[str, Any], required: Optional[Dict[str, Iterable[str]]] = None) -> None:
+    missing = []
+    for section, keys in (required or REQUIRED).items():
+        values = config.get(section)
+        if not isinstance(values, dict):
+            missing.append(f"[{section}]")
+            continue
+        missing.extend(f"{section}.{key}" for key in keys if values.get(key) in (None, ""))
+    if missing:
+        raise ConfigError(f"secrets.toml is missing required settings: {', '.join(missing)}")
+
+
+@lru_cache(maxsize=8)
+def _load(path: str, mtime: float) -> Dict[str, Any]:
+    try:
+        with open(path, 'r') as f:
+            config = toml.load(f)
+    except (OSError, toml.TomlDecodeError) as e:
+        raise ConfigError(f"Could not read {path}: {e}")
+    validate(config)
+    logger.info(f"Loaded configuration from {path}")
+    return config
+
+
+def load_config(path: str = DEFAULT_PATH) -> Dict[str, Any]:
+    """Parsed and validated secrets, read once per file version; treat the result as read-only"""
+    path = os.path.abspath(path)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        raise ConfigError(f"Could not read {path}: {e}")
+    with _lock:
+        return _load(path, mtime)
+
+
+def section(name: str, path: str = DEFAULT_PATH) -> Dict[str, Any]:
+    """One optional section, empty when absent"""
+    return load_config(path).get(name, {})
@@ -0,0 +1,124 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """A Snowflake connector connection and the Snowpark session on top of it
+
+    The session is opened on first use, so connections that only run SQL
+    through the connector never pay for one. `cache` holds whatever callers
+    derive from the session (search service handles) and goes away with it.
+    """
+    def __init__(self, conn, session_factory: Callable[[Any], Any]):
+        self.conn = conn
+        self.session_factory = session_factory
+        self.cache: Dict[str, Any] = {}
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = self.session_factory(self.conn)
+        return self._session
+
+    @property
+    def broken(self) -> bool:
+        is_closed = getattr(self.conn, "is_closed", None)
+        return bool(is_closed()) if callable(is_closed) else bool(getattr(self.conn, "closed", False))
+
+    def close(self) -> None:
+        for closer in (self._session, self.conn):
+            if closer is None:
+                continue
+            try:
+                closer.close()
+            except Exception as e:
+                logger.warning(f"Failed to close pooled Snowflake connection: {e}")
+        self._session = None
+
+
+class ConnectionPool:
+    """Bounded pool of Snowflake connections, checked out for one operation at a time
+
+    Connections are opened on demand, at most `size` of them; a checkout
+    waits up to `timeout` seconds for one to be returned once all are in
+    use. A connection that comes back closed is dropped and replaced by the
+    next checkout that needs one.
+    """
+    def __init__(self, open_connection: Callable[[], PooledConnection], size: int = 8, timeout: float = 30.0):
+        self.open_connection = open_connection
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: List[PooledConnection] = []
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        pooled = self._acquire()
+        try:
+            yield pooled
+        finally:
+            self._release(pooled)
+
+    def prime(self) -> None:
+        """Open a connection unless one is already open, so the first operation does not pay for it"""
+        with self._cond:
+            if self._open:
+                return
+        with self.connection():
+            pass
+
+    def _acquire(self) -> PooledConnection:
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Snowflake connection pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._open < self.size:
+                    self._open += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No Snowflake connection free after {self.timeout}s ({self.size} in use)")
+                self._cond.wait(remaining)
+        try:
+            return self.open_connection()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, pooled: PooledConnection) -> None:
+        with self._cond:
+            keep = not self._closed and not pooled.broken
+            if keep:
+                self._idle.append(pooled)
+            else:
+                self._open -= 1
+            self._cond.notify()
+        if not keep:
+            pooled.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"open": self._open, "idle": len(self._idle)}
+
+    def close(self) -> None:
+        """Close idle connections now and the others as they are returned"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for pooled in idle:
+            pooled.close()
@@ -0,0 +1,114 @@
+import re
+import json
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Union
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used when no tokenizer is supplied"""
+    return max(1, len(text) // 4)
+
+
+def parse_results(raw: Union[str, Dict[str, Any], None]) -> List[Dict[str, Any]]:
+    """Rows from a Cortex-style search response, given as a dict or its JSON dump"""
+    if not raw:
+        return []
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            return []
+    if isinstance(raw, list):
+        return [row for row in raw if isinstance(row, dict)]
+    return [row for row in raw.get("results", []) if isinstance(row, dict)]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Hashable]], k: int = 60) -> Dict[Hashable, float]:
+    """Score items by summing 1 / (k + rank) over every ranking they appear in"""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return scores
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def _shingles(text: str, size: int = 5) -> frozenset:
+    words = text.split()
+    if len(words) <= size:
+        return frozenset([' '.join(words)])
+    return frozenset(' '.join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _is_duplicate(text: str, shingles: frozenset, kept: List[Dict[str, Any]], threshold: float) -> Optional[Dict[str, Any]]:
+    for item in kept:
+        if text in item["_normalized"] or item["_normalized"] in text:
+            return item
+        union = len(shingles | item["_shingles"])
+        if union and len(shingles & item["_shingles"]) / union >= threshold:
+            return item
+    return None
+
+
+def merge_results(results_by_service: Dict[str, Any], top_k: int = 8, token_budget: int = 1500,
+                  count_tokens: Callable[[str], int] = estimate_tokens, rrf_k: int = 60,
+                  duplicate_threshold: float = 0.8) -> List[Dict[str, Any]]:
+    """Fuse per-service rankings, drop overlapping chunks and keep a global top-k under a token budget
+
+    Returns items of the form {"content", "services", "score", "tokens"} in fused order.
+    """
+    rankings: List[List[str]] = []
+    services_by_content: Dict[str, List[str]] = {}
+    for service, raw in results_by_service.items():
+        ranking = []
+        for row in parse_results(raw):
+            content = (row.get("CONTENT") or row.get("content") or "").strip()
+            if not content:
+                continue
+            ranking.append(content)
+            services = services_by_content.setdefault(content, [])
+            if service not in services:
+                services.append(service)
+        rankings.append(ranking)
+
+    scores = reciprocal_rank_fusion(rankings, k=rrf_k)
+    kept: List[Dict[str, Any]] = []
+    used_tokens = 0
+    for content in sorted(scores, key=scores.get, reverse=True):
+        normalized = _normalize(content)
+        shingles = _shingles(normalized)
+        duplicate = _is_duplicate(normalized, shingles, kept, duplicate_threshold)
+        if duplicate is not None:
+            # Keep the longer chunk so overlapping text is not lost
+            for service in services_by_content[content]:
+                if service not in duplicate["services"]:
+                    duplicate["services"].append(service)
+            if len(content) > len(duplicate["content"]):
+                extra = count_tokens(content) - duplicate["tokens"]
+                if used_tokens + extra <= token_budget:
+                    used_tokens += extra
+                    duplicate.update(content=content, tokens=duplicate["tokens"] + extra,
+                                     _normalized=normalized, _shingles=shingles)
+            continue
+        if len(kept) >= top_k:
+            break
+        tokens = count_tokens(content)
+        if used_tokens + tokens > token_budget:
+            continue
+        used_tokens += tokens
+        kept.append({
+            "content": content,
+            "services": list(services_by_content[content]),
+            "score": scores[content],
+            "tokens": tokens,
+            "_normalized": normalized,
+            "_shingles": shingles,
+        })
+
+    return [
+        {key: value for key, value in item.items() if not key.startswith('_')}
+        for item in kept
+    ]
+
@@ -0,0 +1,137 @@
+import uuid
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Item = Dict[str, Any]
+
+# Leave room under Firestore's 500 writes per batch for the header update
+BATCH_WRITES = 450
+
+ROLLING_ID = "rolling"
+
+
+class HistoryStore:
+    """Conversation history as a time-ordered subcollection plus a small header document
+
+    user_data/{uid}/conversations/{id} holds one document per turn or summary,
+    ordered by created_at, and user_data/{uid}/memory/header holds the rolling
+    summary that older summaries are compacted into. A read costs the header
+    plus the newest `page_size` items however long the history grows.
+    Histories still kept in the past_conversations / conversation_summary
+    arrays of user_data/{uid} are moved over on first load.
+    """
+    def __init__(self, db, firestore_module, page_size: int = 20):
+        self.db = db
+        self.firestore = firestore_module
+        self.page_size = page_size
+
+    def _user(self, user_id: str):
+        return self.db.collection('user_data').document(user_id)
+
+    def _items(self, user_id: str):
+        return self._user(user_id).collection('conversations')
+
+    def _header(self, user_id: str):
+        return self._user(user_id).collection('memory').document('header')
+
+    def batch(self):
+        return self.db.batch()
+
+    def load(self, user_id: str) -> Tuple[List[Item], List[Item]]:
+        """(turns, summaries) in history order; the rolling summary, if any, comes first"""
+        with metrics.span("memory.load"):
+            header = self._header(user_id).get()
+            if not header.exists:
+                migrated = self._migrate(user_id)
+                if migrated is not None:
+                    return migrated
+            query = self._items(user_id).order_by('created_at', direction=self.firestore.Query.DESCENDING)
+            documents = [snapshot.to_dict() for snapshot in query.limit(self.page_size).stream()]
+        documents.reverse()
+        turns = [doc for doc in documents if doc.get('kind') == 'turn']
+        summaries = [doc for doc in documents if doc.get('kind') == 'summary']
+        rolling = (header.to_dict() or {}).get('rolling_summary') if header.exists else None
+        if rolling:
+            summaries.insert(0, {'summary_text': rolling, 'summary_id': ROLLING_ID, 'kind': 'summary'})
+        return turns, summaries
+
+    def add_turns(self, batch, user_id: str, turns: List[Item]) -> None:
+        for turn in turns:
+            batch.set(self._items(user_id).document(turn['turn_id']), dict(turn, kind='turn'))
+        batch.set(self._header(user_id), {
+            'turn_count': self.firestore.Increment(len(turns)),
+            'updated_at': datetime.now(),
+        }, merge=True)
+
+    def new_summary(self, text: str, turns: List[Item]) -> Item:
+        return {
+            'kind': 'summary',
+            'summary_id': uuid.uuid4().hex[:16],
+            'summary_text': text,
+            'turn_ids': [turn.get('turn_id') for turn in turns if turn.get('turn_id')],
+            'created_at': datetime.now(),
+        }
+
+    def replace_turns(self, batch, user_id: str, summary: Item, turns: List[Item]) -> None:
+        """Store a summary and delete the turns it covers"""
+        batch.set(self._items(user_id).document(summary['summary_id']), summary)
+        for turn in turns:
+            if turn.get('turn_id'):
+                batch.delete(self._items(user_id).document(turn['turn_id']))
+
+    def compact(self, batch, user_id: str, rolling_text: str, summaries: List[Item]) -> None:
+        """Fold older summaries into the header's rolling summary"""
+        batch.set(self._header(user_id), {
+            'rolling_summary': rolling_text,
+            'updated_at': datetime.now(),
+        }, merge=True)
+        for summary in summaries:
+            if summary.get('summary_id') not in (None, ROLLING_ID):
+                batch.delete(self._items(user_id).document(summary['summary_id']))
+
+    def _migrate(self, user_id: str):
+        """Move array-based history out of user_data/{uid}; None when there is nothing to move"""
+        snapshot = self._user(user_id).get()
+        data = (snapshot.to_dict() if snapshot.exists else None) or {}
+        legacy_turns = data.get('past_conversations') or []
+        legacy_summaries = data.get('conversation_summary') or []
+        if not legacy_turns and not legacy_summaries:
+            return None
+        # Summaries predate the turns still waiting to be summarized
+        start = datetime.now() - timedelta(seconds=len(legacy_turns) + len(legacy_summaries))
+        items = []
+        for offset, summary in enumerate(legacy_summaries):
+            items.append({
+                'kind': 'summary',
+                'summary_id': uuid.uuid4().hex[:16],
+                'summary_text': summary.get('summary_text', ''),
+                'turn_ids': [],
+                'created_at': start + timedelta(seconds=offset),
+            })
+        for offset, turn in enumerate(legacy_turns, start=len(legacy_summaries)):
+            items.append({
+                'kind': 'turn',
+                'turn_id': turn.get('turn_id') or uuid.uuid4().hex[:16],
+                'query': turn.get('query', ''),
+                'response': turn.get('response', ''),
+                'created_at': start + timedelta(seconds=offset),
+            })
+        for begin in range(0, len(items), BATCH_WRITES):
+            batch = self.batch()
+            for item in items[begin:begin + BATCH_WRITES]:
+                batch.set(self._items(user_id).document(item.get('turn_id') or item['summary_id']), item)
+            batch.commit()
+        # The header marks the migration done, so it is written last
+        batch = self.batch()
+        batch.set(self._header(user_id), {'turn_count': len(legacy_turns), 'updated_at': datetime.now()}, merge=True)
+        batch.set(self._user(user_id), {'past_conversations': [], 'conversation_summary': []}, merge=True)
+        batch.commit()
+        logger.info(f"Moved {len(items)} history items of {user_id} to the conversations subcollection")
+        turns = [item for item in items if item['kind'] == 'turn']
+        summaries = [item for item in items if item['kind'] == 'summary']
+        return turns[-self.page_size:], summaries
@@ -0,0 +1,217 @@
+import time
+import uuid
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Lower runs first: uploads are small and interactive, crawls are long
+DEFAULT_PRIORITIES = {"pdf": 0, "github": 1, "web": 2}
+
+
+class IngestJob:
+    """One ingestion request; the coroutine it runs reports progress through update()"""
+    def __init__(self, scheduler: "IngestionScheduler", user_id: str, kind: str, label: str,
+                 priority: int, factory: Callable[["IngestJob"], Awaitable[Any]]):
+        self.scheduler = scheduler
+        self.job_id = uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.kind = kind
+        self.label = label
+        self.priority = priority
+        self.factory = factory
+        self.status = QUEUED
+        self.stage = "queued"
+        self.progress = 0.0
+        self.chunks = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def update(self, stage: str, progress: Optional[float] = None) -> None:
+        self.stage = stage
+        if progress is not None:
+            self.progress = max(self.progress, min(1.0, progress))
+
+    async def run_cpu(self, func: Callable, *args) -> Any:
+        """Run CPU-heavy work (PDF extraction, chunking) off the event loop"""
+        return await self.scheduler.run_cpu(func, *args)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "label": self.label,
+            "priority": self.priority,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "chunks": self.chunks,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class IngestionScheduler:
+    """Runs ingestion jobs on a background event loop, away from the Streamlit script
+
+    Scraping is I/O bound and shares one asyncio loop; extraction and chunking
+    go to a process pool. Jobs start in priority order, at most `max_concurrency`
+    at a time and `per_user_limit` per user, so one user's large crawl cannot
+    starve everyone else. The UI polls jobs() and may cancel() at any time.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, **kwargs) -> "IngestionScheduler":
+        """Process-wide scheduler; Streamlit re-runs the script on every interaction"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(**kwargs)
+        return cls._shared
+
+    def __init__(self, max_concurrency: int = 4, per_user_limit: int = 2, process_workers: int = 2,
+                 history: int = 20):
+        self.max_concurrency = max_concurrency
+        self.per_user_limit = per_user_limit
+        self.history = history
+        self._jobs: Dict[str, IngestJob] = {}
+        self._heap: List[Tuple[int, int, IngestJob]] = []
+        self._sequence = itertools.count()
+        self._running_by_user: Dict[str, int] = {}
+        self._running = 0
+        self._lock = threading.Lock()
+        self._cpu: Executor
+        if process_workers:
+            # spawn: forking a process that already runs Streamlit's threads is unsafe
+            self._cpu = ProcessPoolExecutor(process_workers, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self._cpu = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ingest-cpu")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="ingestion-loop")
+        self._thread.start()
+
+    def submit(self, user_id: str, kind: str, label: str, factory: Callable[[IngestJob], Awaitable[Any]],
+               priority: Optional[int] = None) -> str:
+        """Queue `factory(job)` and return the job id"""
+        if priority is None:
+            priority = DEFAULT_PRIORITIES.get(kind, 1)
+        job = IngestJob(self, user_id, kind, label, priority, factory)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            heapq.heappush(self._heap, (priority, next(self._sequence), job))
+            self._prune(user_id)
+        self._loop.call_soon_threadsafe(self._dispatch)
+        return job.job_id
+
+    def _prune(self, user_id: str) -> None:
+        finished = [job for job in self._jobs.values() if job.user_id == user_id and job.status in FINISHED]
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.job_id]
+
+    def _dispatch(self) -> None:
+        """Start as many queued jobs as the limits allow (runs on the loop thread)"""
+        with self._lock:
+            deferred = []
+            while self._heap and self._running < self.max_concurrency:
+                entry = heapq.heappop(self._heap)
+                job = entry[2]
+                if job.status != QUEUED:
+                    continue
+                if self._running_by_user.get(job.user_id, 0) >= self.per_user_limit:
+                    deferred.append(entry)
+                    continue
+                self._running += 1
+                self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+                job.status = RUNNING
+                job.started_at = time.time()
+                job._task = self._loop.create_task(self._run(job))
+            for entry in deferred:
+                heapq.heappush(self._heap, entry)
+
+    async def _run(self, job: IngestJob) -> None:
+        try:
+            await job.factory(job)
+            job.status = SUCCEEDED
+            job.update("done", 1.0)
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+            job.stage = "cancelled"
+        except Exception as e:
+            logger.error(f"Ingestion job {job.job_id} ({job.kind} {job.label}) failed: {e}")
+            job.status = FAILED
+            job.error = str(e)
+            job.stage = "failed"
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._running -= 1
+                self._running_by_user[job.user_id] -= 1
+            self._dispatch()
+
+    async def run_cpu(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._cpu, func, *args)
+
+    def cancel(self, job_id: str, user_id: Optional[str] = None) -> bool:
+        """Cancel a queued or running job; returns False if it already finished"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (user_id is not None and job.user_id != user_id) or job.status in FINISHED:
+                return False
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.stage = "cancelled"
+                job.finished_at = time.time()
+                return True
+        # Running: the task sees CancelledError at its next await
+        self._loop.call_soon_threadsafe(job._task.cancel)
+        return True
+
+    def jobs(self, user_id: str) -> List[Dict[str, Any]]:
+        """Snapshots of a user's jobs, newest first"""
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.user_id == user_id]
+        return [job.snapshot() for job in sorted(jobs, key=lambda job: job.created_at, reverse=True)]
+
+    def job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return job.snapshot() if job else None
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Block until a job finishes (scripts and benchmarks; the UI polls instead)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.job(job_id)
+            if snapshot is None or snapshot["status"] in FINISHED:
+                return snapshot
+            if deadline is not None and time.monotonic() > deadline:
+                return snapshot
+            time.sleep(0.05)
+
+    def call(self, coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the scheduler's loop from another thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def shutdown(self) -> None:
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._cpu.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,40 @@
+import importlib
+import threading
+from typing import Any, Optional
+
+
+class LazyImport:
+    """Stand-in for a module (or one of its attributes) that is imported on first use
+
+    `PyPDF2 = LazyImport("PyPDF2")` or `Session = LazyImport("snowflake.snowpark", "Session")`
+    keep call sites unchanged while moving the import cost from startup to the
+    first feature that needs it.
+    """
+    def __init__(self, module: str, attribute: Optional[str] = None):
+        self._lazy_module = module
+        self._lazy_attribute = attribute
+        self._lazy_target = None
+        self._lazy_lock = threading.Lock()
+
+    def load(self) -> Any:
+        if self._lazy_target is None:
+            with self._lazy_lock:
+                if self._lazy_target is None:
+                    target = importlib.import_module(self._lazy_module)
+                    if self._lazy_attribute:
+                        target = getattr(target, self._lazy_attribute)
+                    self._lazy_target = target
+        return self._lazy_target
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_lazy_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        target = f"{self._lazy_module}.{self._lazy_attribute}" if self._lazy_attribute else self._lazy_module
+        state = "loaded" if self._lazy_target is not None else "not loaded"
+        return f"<LazyImport {target} ({state})>"
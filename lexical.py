@@ -0,0 +1,432 @@
+import os
+import re
+import math
+import zlib
+import heapq
+import struct
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from retrieval import RetrievalBackend, file_lock
+from fusion import reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+_WORD = re.compile(r'[A-Za-z0-9_][A-Za-z0-9_.\-]*[A-Za-z0-9_]|[A-Za-z0-9_]')
+_CAMEL = re.compile(r'[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Identifier-aware tokens: whole identifiers plus their camelCase/snake_case/dotted parts"""
+    tokens = []
+    for word in _WORD.findall(text):
+        lowered = word.lower()
+        tokens.append(lowered)
+        parts = [part for piece in re.split(r'[_.\-]+', word) for part in _CAMEL.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(part.lower() for part in parts)
+    return tokens
+
+
+# Leading bytes of an index file remembered to tell it apart from a replacement
+_HEAD_BYTES = 64
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _write_bytes(out: bytearray, value: bytes) -> None:
+    _write_varint(out, len(value))
+    out.extend(value)
+
+
+def _read_bytes(data: bytes, pos: int) -> Tuple[bytes, int]:
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length], pos + length
+
+
+class BM25Index:
+    """Incrementally updated inverted index with Okapi BM25 scoring
+
+    Each add() appends one zlib-compressed segment to the index file: the new
+    documents' text and lengths followed by varint-encoded, delta-coded postings,
+    then the id of the source document each one was chunked from. delete()
+    appends a segment that only lists removed source documents; their rows
+    are skipped by searches and dropped by compact(). Segments are replayed
+    on load and can be merged with compact(). Writers hold `<path>.lock`, and
+    every process replays segments appended by the others before it writes
+    or searches, so the API, bulk ingestion and backfill can share a file.
+    """
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75,
+                 common_term_ratio: float = 0.2):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.common_term_ratio = common_term_ratio
+        self.contents: List[str] = []
+        self.lengths: List[int] = []
+        # Source document of each row; '' for rows indexed before documents were tracked
+        self.documents: List[str] = []
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_length = 0
+        self.deleted: Set[int] = set()
+        self._segments = 0
+        # Identity (inode and first bytes) of the file and bytes of it replayed so far; compact() replaces
+        # the file, and a replacement can get a freed inode back, so the inode alone is not enough
+        self._inode = 0
+        self._head = b''
+        self._offset = 0
+        self._lock = threading.RLock()
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._catch_up()
+
+    def __len__(self) -> int:
+        return len(self.contents) - len(self.deleted)
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Hold the index against this and other processes, with their writes replayed"""
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            with file_lock(self.path + '.lock'):
+                self._catch_up()
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self._offset:
+                    # A writer died mid-segment; nobody else is writing, so cut its bytes off
+                    os.truncate(self.path, self._offset)
+                yield
+
+    def add(self, contents: Iterable[str], documents: Optional[Iterable[str]] = None) -> None:
+        # Tokenized before taking the locks; row ids are assigned once the base is known
+        frequencies: List[Dict[str, int]] = []
+        new_contents, new_lengths = [], []
+        for content in contents:
+            tokens = tokenize(content)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            frequencies.append(counts)
+            new_contents.append(content)
+            new_lengths.append(len(tokens))
+        if not new_contents:
+            return
+        new_documents = list(documents) if documents is not None else [''] * len(new_contents)
+        with self._writing():
+            base = len(self.contents)
+            segment_postings: Dict[str, Dict[int, int]] = {}
+            for offset, counts in enumerate(frequencies):
+                for term, tf in counts.items():
+                    segment_postings.setdefault(term, {})[base + offset] = tf
+            self._apply(new_contents, new_lengths, segment_postings, new_documents)
+            if self.path:
+                self._append_segment(self._encode(base, new_contents, new_lengths, segment_postings, new_documents))
+
+    def delete(self, documents: Iterable[str]) -> int:
+        """Remove every row chunked from the given source documents; returns how many rows were removed"""
+        documents = {document for document in documents if document}
+        with self._writing():
+            removed = self._remove(documents)
+            if removed and self.path:
+                self._append_segment(self._encode(len(self.contents), [], [], {}, [], sorted(documents)))
+            return removed
+
+    def _apply(self, contents: List[str], lengths: List[int], postings: Dict[str, Dict[int, int]],
+               documents: List[str]) -> None:
+        self.contents.extend(contents)
+        self.lengths.extend(lengths)
+        self.documents.extend(documents)
+        self.total_length += sum(lengths)
+        for term, entries in postings.items():
+            self.postings.setdefault(term, {}).update(entries)
+
+    def _remove(self, documents: Set[str]) -> int:
+        rows = [row for row, document in enumerate(self.documents)
+                if document in documents and row not in self.deleted]
+        self.deleted.update(rows)
+        self.total_length -= sum(self.lengths[row] for row in rows)
+        return len(rows)
+
+    def search(self, query: str, limit: int = 5) -> List[Tuple[int, float]]:
+        """Top (document id, BM25 score) pairs for a query"""
+        with self._lock:
+            if self.path:
+                self._catch_up()
+            n_docs = len(self.contents) - len(self.deleted)
+            if not n_docs:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            terms = [term for term in set(tokenize(query)) if term in self.postings]
+            terms.sort(key=lambda term: len(self.postings[term]))
+            scores: Dict[int, float] = {}
+            for term in terms:
+                entries = self.postings[term]
+                idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+                if scores and len(entries) > self.common_term_ratio * n_docs:
+                    # Common terms (often identifier sub-tokens) only re-rank documents
+                    # already matched by rarer terms instead of scanning their postings
+                    matches = [(doc_id, entries[doc_id]) for doc_id in scores if doc_id in entries]
+                else:
+                    matches = entries.items()
+                for doc_id, tf in matches:
+                    if doc_id in self.deleted:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avg_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def search_contents(self, query: str, limit: int = 5) -> List[Tuple[str, float]]:
+        """Top (content, BM25 score) pairs; row ids are only stable until the next compact()"""
+        with self._lock:
+            return [(self.contents[doc_id], score) for doc_id, score in self.search(query, limit)]
+
+    def _encode(self, base: int, contents: List[str], lengths: List[int], postings: Dict[str, Dict[int, int]],
+                documents: List[str], deleted: Iterable[str] = ()) -> bytes:
+        out = bytearray()
+        _write_varint(out, base)
+        _write_varint(out, len(contents))
+        for content, length in zip(contents, lengths):
+            _write_varint(out, length)
+            _write_bytes(out, content.encode('utf-8'))
+        _write_varint(out, len(postings))
+        for term, entries in postings.items():
+            _write_bytes(out, term.encode('utf-8'))
+            _write_varint(out, len(entries))
+            previous = 0
+            for doc_id, tf in sorted(entries.items()):
+                _write_varint(out, doc_id - previous)
+                _write_varint(out, tf)
+                previous = doc_id
+        # Trailing sections, absent from segments written before documents were tracked
+        _write_varint(out, len(documents))
+        for document in documents:
+            _write_bytes(out, document.encode('utf-8'))
+        deleted = list(deleted)
+        _write_varint(out, len(deleted))
+        for document in deleted:
+            _write_bytes(out, document.encode('utf-8'))
+        return zlib.compress(bytes(out), 6)
+
+    def _decode(self, blob: bytes) -> None:
+        data = zlib.decompress(blob)
+        base, pos = _read_varint(data, 0)
+        if base != len(self.contents):
+            raise ValueError(f"Corrupt segment in {self.path}: expected base {len(self.contents)}, got {base}")
+        count, pos = _read_varint(data, pos)
+        contents, lengths = [], []
+        for _ in range(count):
+            length, pos = _read_varint(data, pos)
+            content, pos = _read_bytes(data, pos)
+            contents.append(content.decode('utf-8'))
+            lengths.append(length)
+        n_terms, pos = _read_varint(data, pos)
+        postings: Dict[str, Dict[int, int]] = {}
+        for _ in range(n_terms):
+            term, pos = _read_bytes(data, pos)
+            n_entries, pos = _read_varint(data, pos)
+            entries, doc_id = {}, 0
+            for _ in range(n_entries):
+                delta, pos = _read_varint(data, pos)
+                tf, pos = _read_varint(data, pos)
+                doc_id += delta
+                entries[doc_id] = tf
+            postings[term.decode('utf-8')] = entries
+        documents, deleted = [''] * count, set()
+        if pos < len(data):
+            n_documents, pos = _read_varint(data, pos)
+            for row in range(n_documents):
+                document, pos = _read_bytes(data, pos)
+                documents[row] = document.decode('utf-8')
+            n_deleted, pos = _read_varint(data, pos)
+            for _ in range(n_deleted):
+                document, pos = _read_bytes(data, pos)
+                deleted.add(document.decode('utf-8'))
+        self._apply(contents, lengths, postings, documents)
+        if deleted:
+            self._remove(deleted)
+
+    def _append_segment(self, blob: bytes) -> None:
+        with open(self.path, 'ab') as f:
+            f.write(struct.pack('<I', len(blob)))
+            f.write(blob)
+            self._offset = f.tell()
+            self._inode = os.fstat(f.fileno()).st_ino
+        if len(self._head) < _HEAD_BYTES:
+            with open(self.path, 'rb') as f:
+                self._head = f.read(_HEAD_BYTES)
+        self._segments += 1
+
+    def _reset(self) -> None:
+        self.contents, self.lengths, self.documents = [], [], []
+        self.postings, self.deleted = {}, set()
+        self.total_length = 0
+        self._segments = 0
+        self._offset = 0
+        self._head = b''
+
+    def _catch_up(self) -> None:
+        """Replay segments appended since the file was last read, or all of a replaced file"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            head = f.read(_HEAD_BYTES)
+            if stat.st_ino != self._inode or stat.st_size < self._offset or head[:len(self._head)] != self._head:
+                self._reset()
+            self._inode, self._head = stat.st_ino, head
+            f.seek(self._offset)
+            data = f.read()
+        pos = 0
+        while pos + 4 <= len(data):
+            (size,) = struct.unpack_from('<I', data, pos)
+            if pos + 4 + size > len(data):
+                break  # torn or still being written; read again next time
+            self._decode(data[pos + 4:pos + 4 + size])
+            pos += 4 + size
+            self._segments += 1
+        self._offset += pos
+
+    def compact(self) -> None:
+        """Rewrite all segments as a single segment, dropping deleted rows"""
+        if not self.path:
+            return
+        with self._writing():
+            if self.deleted:
+                self._drop_deleted()
+            blob = self._encode(0, self.contents, self.lengths, self.postings, self.documents)
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('<I', len(blob)))
+                f.write(blob)
+            os.replace(tmp_path, self.path)
+            with open(self.path, 'rb') as f:
+                self._inode, self._offset = os.fstat(f.fileno()).st_ino, os.fstat(f.fileno()).st_size
+                self._head = f.read(_HEAD_BYTES)
+            self._segments = 1
+
+    def _drop_deleted(self) -> None:
+        live = [row for row in range(len(self.contents)) if row not in self.deleted]
+        renumbered = {row: new_row for new_row, row in enumerate(live)}
+        self.contents = [self.contents[row] for row in live]
+        self.lengths = [self.lengths[row] for row in live]
+        self.documents = [self.documents[row] for row in live]
+        postings = {}
+        for term, entries in self.postings.items():
+            kept = {renumbered[row]: tf for row, tf in entries.items() if row in renumbered}
+            if kept:
+                postings[term] = kept
+        self.postings = postings
+        self.deleted = set()
+
+
+class LexicalBackend(RetrievalBackend):
+    """BM25 retrieval with one on-disk index per search service (i.e. per user and source)"""
+    uses_warehouse = False
+
+    def __init__(self, index_dir: str = '.devrag/lexical', compact_after: int = 64):
+        self.index_dir = index_dir
+        self.compact_after = compact_after
+        self._indexes: Dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def index(self, service_name: str) -> BM25Index:
+        with self._lock:
+            if service_name not in self._indexes:
+                self._indexes[service_name] = BM25Index(os.path.join(self.index_dir, f"{service_name}.bm25"))
+            return self._indexes[service_name]
+
+    def add(self, service_name: str, contents: List[str], tenant: Optional[str] = None,
+            documents: Optional[List[str]] = None) -> None:
+        if not contents:
+            return
+        index = self.index(self.scoped_name(service_name, tenant))
+        index.add(contents, documents)
+        if index._segments >= self.compact_after:
+            index.compact()
+
+    def delete(self, service_name: str, documents: List[str], tenant: Optional[str] = None) -> int:
+        index = self.index(self.scoped_name(service_name, tenant))
+        removed = index.delete(documents)
+        if index._segments >= self.compact_after:
+            index.compact()
+        return removed
+
+    def prepare(self, service_name: str, tenant: Optional[str] = None) -> None:
+        self.index(self.scoped_name(service_name, tenant))
+
+    def search(self, service_name: str, query: str, limit: int = 5, tenant: Optional[str] = None) -> Dict[str, Any]:
+        index = self.index(self.scoped_name(service_name, tenant))
+        return {
+            "results": [
+                {"CONTENT": content, "SCORE": score}
+                for content, score in index.search_contents(query, limit)
+            ]
+        }
+
+
+class HybridBackend(RetrievalBackend):
+    """Fuses a primary (dense) backend with BM25 results using reciprocal rank fusion"""
+    def __init__(self, primary: RetrievalBackend, lexical: LexicalBackend, rrf_k: int = 60):
+        self.primary = primary
+        self.lexical = lexical
+        self.rrf_k = rrf_k
+        self.uses_warehouse = primary.uses_warehouse
+
+    def add(self, service_name: str, contents: List[str], tenant: Optional[str] = None,
+            documents: Optional[List[str]] = None) -> None:
+        self.primary.add(service_name, contents, tenant, documents)
+        self.lexical.add(service_name, contents, tenant, documents)
+
+    def delete(self, service_name: str, documents: List[str], tenant: Optional[str] = None) -> int:
+        self.lexical.delete(service_name, documents, tenant)
+        return self.primary.delete(service_name, documents, tenant)
+
+    def prepare(self, service_name: str, tenant: Optional[str] = None) -> None:
+        self.primary.prepare(service_name, tenant)
+        self.lexical.prepare(service_name, tenant)
+
+    def search(self, service_name: str, query: str, limit: int = 5, tenant: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            lexical_results = self.lexical.search(service_name, query, limit, tenant)["results"]
+        except Exception as e:
+            # A broken local index must not take down searches the primary backend can answer
+            logger.warning(f"Lexical search of {service_name} failed, using dense results only: {e}")
+            lexical_results = []
+        try:
+            primary_results = self.primary.search(service_name, query, limit, tenant).get("results", [])
+        except Exception:
+            if not lexical_results:
+                raise
+            primary_results = []
+
+        rows: Dict[str, Dict[str, Any]] = {}
+        for row in primary_results + lexical_results:
+            rows.setdefault(row.get("CONTENT", ""), row)
+        fused = reciprocal_rank_fusion(
+            ([row.get("CONTENT", "") for row in results] for results in (primary_results, lexical_results)),
+            k=self.rrf_k,
+        )
+        ranked = sorted(fused, key=fused.get, reverse=True)[:limit]
+        return {"results": [dict(rows[content], SCORE=fused[content]) for content in ranked]}
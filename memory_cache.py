@@ -0,0 +1,282 @@
+import time
+import uuid
+import atexit
+import logging
+import threading
+from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import metrics
+from memory_index import MemoryIndex, item_key, select_memory
+from history import BATCH_WRITES, ROLLING_ID, HistoryStore
+
+logger = logging.getLogger(__name__)
+
+Turn = Dict[str, Any]
+
+
+def _resolved(value: Any) -> Future:
+    future: Future = Future()
+    future.set_result(value)
+    return future
+
+
+class _UserMemory:
+    """Cached conversation state of one user"""
+    def __init__(self, conversations: List[Turn], summaries: List[Dict[str, Any]]):
+        self.conversations = conversations
+        self.summaries = summaries
+        self.pending: List[Turn] = []
+        self.in_flight: List[Turn] = []
+        self.index: Optional[MemoryIndex] = None
+        self.summarizing = False
+        self.summary_retry_at = 0.0
+        self.loaded_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.pending or self.in_flight or self.summarizing)
+
+
+class ConversationCache:
+    """Write-behind cache of each user's conversation history (see history.HistoryStore)
+
+    Turns are appended in memory and served to retrieve() straight away; a
+    background thread writes them every `flush_interval` seconds as one
+    document per turn, in one batch for all users, so turns from other tabs
+    or processes are never overwritten. Cached reads are refreshed from
+    Firestore once older than `max_staleness` seconds. Once a user has
+    `summarize_after` stored turns they are handed to `summarize`, which
+    returns a Future (see summarizer.Summarizer); the finished summary
+    replaces them on a later tick. Beyond `max_summaries` summaries, the
+    oldest are folded into the header's rolling summary the same way.
+    close() flushes, and runs at interpreter exit.
+    """
+    def __init__(self, store: HistoryStore, summarize: Callable[[List[Turn]], Future], summarize_after: int = 5,
+                 max_summaries: int = 8, flush_interval: float = 1.0, max_staleness: float = 30.0,
+                 max_users: int = 1000, summary_retry_delay: float = 300.0):
+        self.store = store
+        self.summarize = summarize
+        self.summarize_after = summarize_after
+        self.max_summaries = max_summaries
+        self.flush_interval = flush_interval
+        self.max_staleness = max_staleness
+        self.max_users = max_users
+        self.summary_retry_delay = summary_retry_delay
+        # (user_id, entry, kind, items, future) of jobs the summarizer has finished
+        self._summarized: deque = deque()
+        self._users: "OrderedDict[str, _UserMemory]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="memory-flush")
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _entry(self, user_id: str) -> _UserMemory:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+        if entry is None:
+            loaded = _UserMemory(*self.store.load(user_id))
+            with self._lock:
+                # Another thread may have loaded the user meanwhile; keep the first copy and its pending turns
+                entry = self._users.setdefault(user_id, loaded)
+                self._evict()
+        elif time.monotonic() - entry.loaded_at > self.max_staleness:
+            self._refresh(user_id, entry)
+        return entry
+
+    def _refresh(self, user_id: str, entry: _UserMemory) -> None:
+        """Pick up writes from other processes, keeping turns this process has not written yet"""
+        stored, summaries = self.store.load(user_id)
+        with entry.lock:
+            stored_ids = {turn.get('turn_id') for turn in stored}
+            unwritten = [turn for turn in entry.in_flight + entry.pending if turn['turn_id'] not in stored_ids]
+            entry.conversations = stored + unwritten
+            entry.summaries = summaries
+            entry.index = None
+            entry.loaded_at = time.monotonic()
+
+    def _evict(self) -> None:
+        """Drop the least recently used users that have nothing left to write"""
+        excess = len(self._users) - self.max_users
+        for user_id in list(self._users):
+            if excess <= 0:
+                break
+            if not self._users[user_id].dirty:
+                del self._users[user_id]
+                excess -= 1
+
+    def append(self, user_id: str, query: str, response: str) -> Turn:
+        """Record a turn; visible to retrieve() at once and written within `flush_interval`"""
+        if self._closed:
+            raise RuntimeError("Conversation cache is closed")
+        # The id names the turn's document and lets a refresh match turns not written yet
+        turn = {'query': query, 'response': response, 'turn_id': uuid.uuid4().hex[:16], 'created_at': datetime.now()}
+        entry = self._entry(user_id)
+        with entry.lock:
+            entry.conversations.append(turn)
+            entry.pending.append(turn)
+            if entry.index is not None:
+                entry.index.add([turn])
+        return turn
+
+    def retrieve(self, user_id: str) -> List[Dict[str, Any]]:
+        """Cached turns followed by the oldest summary, as the prompt builder expects"""
+        entry = self._entry(user_id)
+        with entry.lock:
+            conversations = list(entry.conversations)
+            if entry.summaries:
+                conversations.append(entry.summaries[0])
+        return conversations
+
+    def relevant(self, user_id: str, query: str, top_k: int, token_budget: int,
+                 count_tokens: Callable[[str], int],
+                 truncate: Optional[Callable[[str, int], str]] = None) -> List[Dict[str, Any]]:
+        """The latest turn plus the stored turns and summaries most relevant to `query`"""
+        entry = self._entry(user_id)
+        with entry.lock:
+            if entry.index is None:
+                # Built on first use, then kept current as turns and summaries are written
+                entry.index = MemoryIndex(entry.summaries + entry.conversations)
+            return select_memory(entry.index, query, entry.conversations, entry.summaries,
+                                 top_k, token_budget, count_tokens, truncate)
+
+    def flush(self) -> None:
+        """Write every pending turn now"""
+        with self._lock:
+            entries = [(user_id, entry) for user_id, entry in self._users.items() if entry.pending]
+        chunk, writes = [], 0
+        for user_id, entry in entries:
+            # One write per turn plus the header update
+            size = len(entry.pending) + 1
+            if chunk and writes + size > BATCH_WRITES:
+                self._write_turns(chunk)
+                chunk, writes = [], 0
+            chunk.append((user_id, entry))
+            writes += size
+        if chunk:
+            self._write_turns(chunk)
+
+    def _write_turns(self, entries: List) -> None:
+        batch = self.store.batch()
+        for user_id, entry in entries:
+            with entry.lock:
+                entry.in_flight, entry.pending = entry.pending, []
+            self.store.add_turns(batch, user_id, entry.in_flight)
+        try:
+            with metrics.span("memory.flush"):
+                batch.commit()
+            metrics.inc("devrag_memory_flushes_total", status="ok")
+        except Exception as e:
+            logger.warning(f"Failed to write conversation turns for {len(entries)} users, will retry: {e}")
+            metrics.inc("devrag_memory_flushes_total", status="error")
+            for _, entry in entries:
+                with entry.lock:
+                    entry.pending = entry.in_flight + entry.pending
+        finally:
+            for _, entry in entries:
+                with entry.lock:
+                    entry.in_flight = []
+
+    def _summarize_due(self) -> None:
+        """Hand stored turns, or the oldest summaries, of every user past a threshold to the summarizer"""
+        now = time.monotonic()
+        with self._lock:
+            idle = [(user_id, entry) for user_id, entry in self._users.items()
+                    if not entry.summarizing and entry.summary_retry_at <= now]
+        for user_id, entry in idle:
+            with entry.lock:
+                pending_ids = {turn['turn_id'] for turn in entry.pending}
+                turns = [turn for turn in entry.conversations if item_key(turn) not in pending_ids]
+                if len(turns) >= self.summarize_after:
+                    kind, items = "turns", turns
+                elif len(entry.summaries) > self.max_summaries:
+                    # The rolling summary, when present, is first and is folded in with the oldest ones
+                    kind, items = "compact", entry.summaries[:len(entry.summaries) - self.max_summaries + 1]
+                else:
+                    continue
+                entry.summarizing = True
+            future = self.summarize(items)
+            future.add_done_callback(lambda f, job=(user_id, entry, kind, items): self._summarized.append(job + (f,)))
+
+    def _store_summaries(self) -> None:
+        """Write finished summaries in batches, replacing the turns or summaries they cover"""
+        done = []
+        while self._summarized:
+            done.append(self._summarized.popleft())
+        stored = []
+        for user_id, entry, kind, items, future in done:
+            try:
+                stored.append((user_id, entry, kind, items, future.result()))
+            except Exception as e:
+                logger.warning(f"Failed to summarize conversations for {user_id}, will retry later: {e}")
+                entry.summary_retry_at = time.monotonic() + self.summary_retry_delay
+                entry.summarizing = False
+        # A summary writes itself plus one delete per turn or summary it folds
+        chunks, chunk, writes = [], [], 0
+        for job in stored:
+            size = len(job[3]) + 1
+            if chunk and writes + size > BATCH_WRITES:
+                chunks.append(chunk)
+                chunk, writes = [], 0
+            chunk.append(job)
+            writes += size
+        if chunk:
+            chunks.append(chunk)
+        for chunk in chunks:
+            batch = self.store.batch()
+            results = []
+            for user_id, entry, kind, items, text in chunk:
+                if kind == "turns":
+                    summary = self.store.new_summary(text, items)
+                    self.store.replace_turns(batch, user_id, summary, items)
+                else:
+                    summary = {'summary_text': text, 'summary_id': ROLLING_ID, 'kind': 'summary'}
+                    self.store.compact(batch, user_id, text, items)
+                results.append((entry, kind, items, summary))
+            try:
+                batch.commit()
+            except Exception as e:
+                logger.warning(f"Failed to store {len(chunk)} conversation summaries, will retry: {e}")
+                # Retried as they are on the next tick; the summaries are not recomputed
+                self._summarized.extend((user_id, entry, kind, items, _resolved(text))
+                                        for user_id, entry, kind, items, text in chunk)
+                continue
+            for entry, kind, items, summary in results:
+                replaced = {item_key(item) for item in items}
+                with entry.lock:
+                    if kind == "turns":
+                        entry.conversations = [turn for turn in entry.conversations if item_key(turn) not in replaced]
+                        entry.summaries.append(summary)
+                    else:
+                        entry.summaries = [summary] + [item for item in entry.summaries if item_key(item) not in replaced]
+                    if entry.index is not None:
+                        entry.index.remove(items)
+                        entry.index.add([summary])
+                    entry.summarizing = False
+
+    def _run(self) -> None:
+        while not self._closed:
+            # Turns from every user that arrive within one interval share a batch
+            self._wake.wait(self.flush_interval)
+            try:
+                self.flush()
+                self._store_summaries()
+                self._summarize_due()
+            except Exception as e:
+                logger.error(f"Conversation cache flush failed: {e}")
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Stop the flush thread and write what is still pending"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout)
+        self.flush()
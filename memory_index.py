@@ -0,0 +1,125 @@
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from lexical import BM25Index
+
+Item = Dict[str, Any]
+
+
+def item_key(item: Item) -> Hashable:
+    """Stable identity of a turn or summary; turns stored before turn ids existed fall back to their text"""
+    if item.get('turn_id'):
+        return item['turn_id']
+    if 'summary_text' in item:
+        return ('summary', item['summary_text'])
+    return (item.get('query', ''), item.get('response', ''))
+
+
+def item_text(item: Item) -> str:
+    if 'summary_text' in item:
+        return item['summary_text']
+    return f"{item.get('query', '')}\n{item.get('response', '')}"
+
+
+class MemoryIndex:
+    """BM25 index over one user's conversation turns and summaries
+
+    Items are added as they are written. Removed items (turns folded into a
+    summary) are masked out and the index is rebuilt once they outnumber
+    the live ones.
+    """
+    def __init__(self, items: Iterable[Item] = ()):
+        self._index = BM25Index()
+        self._items: List[Item] = []
+        self._live: Dict[Hashable, int] = {}
+        self.add(items)
+
+    def __len__(self) -> int:
+        return len(self._live)
+
+    def add(self, items: Iterable[Item]) -> None:
+        items = [item for item in items if item_key(item) not in self._live]
+        if not items:
+            return
+        base = len(self._items)
+        self._index.add(item_text(item) for item in items)
+        for offset, item in enumerate(items):
+            self._items.append(item)
+            self._live[item_key(item)] = base + offset
+
+    def remove(self, items: Iterable[Item]) -> None:
+        for item in items:
+            self._live.pop(item_key(item), None)
+        if len(self._items) > 2 * len(self._live) + 16:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        live = [self._items[doc_id] for doc_id in sorted(self._live.values())]
+        self._index = BM25Index()
+        self._items = []
+        self._live = {}
+        self.add(live)
+
+    def search(self, query: str, limit: int) -> List[Item]:
+        """Live items sharing terms with `query`, best first"""
+        live_ids = set(self._live.values())
+        # Over-fetch so masked items do not crowd out live ones
+        hits = self._index.search(query, limit + len(self._items) - len(live_ids))
+        return [self._items[doc_id] for doc_id, _ in hits if doc_id in live_ids][:limit]
+
+
+def fit_item(item: Item, budget: int, count_tokens: Callable[[str], int],
+             truncate: Callable[[str, int], str]) -> Optional[Item]:
+    """A copy of `item` cut to `budget` tokens, keeping the query over the response; None if nothing fits"""
+    if budget <= 0:
+        return None
+    if 'summary_text' in item:
+        fitted = dict(item, summary_text=truncate(item['summary_text'], budget))
+    else:
+        query = truncate(item.get('query', ''), budget)
+        # One token of slack for the newline joining query and response
+        remaining = budget - count_tokens(query) - 1
+        fitted = dict(item, query=query, response=truncate(item.get('response', ''), remaining))
+    return fitted if count_tokens(item_text(fitted)) <= budget else None
+
+
+def select_memory(index: MemoryIndex, query: str, conversations: List[Item], summaries: List[Item],
+                  top_k: int, token_budget: int, count_tokens: Callable[[str], int],
+                  truncate: Optional[Callable[[str, int], str]] = None) -> List[Item]:
+    """The latest turn plus the `top_k` items most relevant to `query`, within `token_budget`
+
+    When fewer than `top_k` items match the query, the remaining slots go to
+    the newest summary and then the most recent turns. Items that would
+    overrun the budget are skipped, except the latest turn, which is cut to
+    fit when `truncate` is given. The result keeps history order: summaries
+    first, then turns.
+    """
+    latest = conversations[-1] if conversations else None
+    candidates: List[Item] = []
+    if latest is not None:
+        candidates.append(latest)
+    candidates.extend(index.search(query, top_k + 1))
+    candidates.extend(reversed(summaries))
+    candidates.extend(reversed(conversations))
+
+    chosen: Dict[Hashable, Item] = {}
+    used = 0
+    for item in candidates:
+        if len(chosen) >= top_k + 1:
+            break
+        key = item_key(item)
+        if key in chosen:
+            continue
+        tokens = count_tokens(item_text(item))
+        if used + tokens > token_budget:
+            if item is not latest or truncate is None:
+                continue
+            item = fit_item(item, token_budget - used, count_tokens, truncate)
+            if item is None:
+                continue
+            tokens = count_tokens(item_text(item))
+        chosen[key] = item
+        used += tokens
+
+    order = {item_key(item): position for position, item in enumerate(summaries + conversations)}
+    # Keys of the original items, since a truncated turn without a turn id has a different one
+    return [item for key, item in sorted(chosen.items(), key=lambda entry: order.get(entry[0], -1))]
@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import uuid
+import bisect
+import logging
+import threading
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("devrag_span", default=None)
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class _NoopSpan:
+    """Returned by span() while metrics are disabled"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    """Timed region; records a latency histogram and, optionally, a JSONL trace line"""
+    __slots__ = ("metrics", "name", "labels", "attributes", "span_id", "parent_id", "trace_id", "start", "_token")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, Any]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.attributes: Dict[str, Any] = {}
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self._token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self._token)
+        status = "error" if exc_type else "ok"
+        self.metrics.observe("devrag_span_seconds", duration, span=self.name, status=status, **self.labels)
+        self.metrics._trace({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "labels": self.labels,
+            "attributes": self.attributes,
+            "status": status,
+            "start": time.time() - duration,
+            "duration_ms": round(duration * 1000, 3),
+        })
+        return False
+
+
+class Metrics:
+    """Process-wide counters, latency histograms and spans with Prometheus text export
+
+    Everything is a no-op until configure(enabled=True) is called, so the
+    instrumentation left in hot paths costs a single attribute check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+        self._lock = threading.Lock()
+        self._trace_file = None
+        # Spans end on many threads; keeps their trace lines whole
+        self._trace_lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._export_path: Optional[str] = None
+        self._export_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def configure(self, enabled: bool = False, port: Optional[int] = None, export_path: Optional[str] = None,
+                  export_interval: float = 15.0, trace_path: Optional[str] = None) -> None:
+        """Enable collection and start the requested exporters (idempotent)"""
+        self.enabled = enabled
+        if not enabled:
+            return
+        if trace_path:
+            with self._trace_lock:
+                if self._trace_file is None:
+                    self._trace_file = open(trace_path, 'a', buffering=1, encoding='utf-8')
+        if port and self._server is None:
+            self.start_http_server(port)
+        if export_path and self._export_thread is None:
+            self._export_path = export_path
+            self._export_thread = threading.Thread(
+                target=self._export_loop, args=(export_interval,), daemon=True, name="metrics-export"
+            )
+            self._export_thread.start()
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Tuple[float, ...] = DEFAULT_BUCKETS, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def span(self, name: str, **labels):
+        """Context manager timing a stage: `with metrics.span("search", service="pdf"):`"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        return Span(self, name, labels)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]) -> None:
+        """Add a callback returning (name, labels, value) gauges sampled at export time"""
+        self._collectors.append(collector)
+
+    def _trace(self, record: Dict[str, Any]) -> None:
+        if self._trace_file is None:
+            return
+        line = json.dumps(record, default=str) + "\n"
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.write(line)
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        gauges: Dict[str, List[str]] = {}
+        for collector in list(self._collectors):
+            try:
+                for name, labels, value in collector():
+                    gauges.setdefault(name, []).append(f"{name}{_format_labels(_label_key(labels))} {value}")
+            except Exception as e:
+                logger.error(f"Metrics collector failed: {e}")
+        for name, samples in sorted(gauges.items()):
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Atomically write the Prometheus exposition to a file (node_exporter textfile format)"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render_prometheus())
+        os.replace(tmp_path, path)
+
+    def _export_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.write(self._export_path)
+            except Exception as e:
+                logger.error(f"Metrics export failed: {e}")
+
+    def start_http_server(self, port: int, host: str = "0.0.0.0") -> None:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            # Another process (e.g. a second Streamlit worker) already serves this port
+            logger.error(f"Metrics endpoint not started on port {port}: {e}")
+            return
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics-http").start()
+
+    def shutdown(self) -> None:
+        """Stop the exporters after a final export and close the trace file"""
+        self._stop.set()
+        if self._export_path:
+            try:
+                self.write(self._export_path)
+            except Exception as e:
+                logger.error(f"Metrics export failed: {e}")
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        with self._trace_lock:
+            if self._trace_file is not None:
+                self._trace_file.close()
+                self._trace_file = None
+
+
+metrics = Metrics()
+metrics.describe("devrag_span_seconds", "Latency of instrumented stages")
+metrics.describe("devrag_chunks_total", "Chunks produced by the text splitter per source")
+metrics.describe("devrag_rows_inserted_total", "Rows written per source table")
+metrics.describe("devrag_prompt_tokens", "Tokens per prompt section")
+metrics.describe("devrag_first_token_seconds", "Time from prompt submission to the first streamed token")
+metrics.describe("devrag_writer_flushes_total", "Batched ingest writer flushes by outcome")
+metrics.describe("devrag_memory_flushes_total", "Batched conversation memory writes by outcome")
+metrics.describe("devrag_summaries_total", "Conversation summary attempts by outcome")
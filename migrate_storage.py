@@ -0,0 +1,190 @@
+"""Move per-user RAG tables into the shared multi-tenant layout
+
+Usage (from the repository root, with secrets.toml in place):
+    python migrate_storage.py --dry-run            # print the statements only
+    python migrate_storage.py                      # every user in Firestore user_data
+    python migrate_storage.py --users uid1,uid2 --drop
+
+Each user/source is copied with DELETE + INSERT ... SELECT inside one
+transaction, so the tool can be re-run safely after a partial failure.
+Legacy tables and search services are only dropped with --drop.
+
+Provenance columns (document_id, ordinal, content_hash) are copied along.
+Rows ingested before they existed are matched by content hash against the
+local chunk store ([INGESTION] CHUNK_STORE), which also supplies their
+origin. Rows found in neither place are reported: replacing or deleting a
+document cannot reach them, so re-ingest their sources after migrating.
+"""
+import os
+import sys
+import argparse
+from typing import Any, List, Optional, Sequence
+
+import snowflake.connector
+
+from config import load_config
+from chunk_store import ChunkStore
+from storage import SOURCES, PerUserLayout, SharedLayout, create_layout
+
+
+def load_user_ids(secrets) -> List[str]:
+    """Registered users are the document ids of the user_data collection"""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    if not firebase_admin._apps:
+        firebase = secrets["FIREBASE"]
+        cred = credentials.Certificate({
+            "type": firebase["TYPE"],
+            "project_id": firebase["PROJECT_ID"],
+            "private_key_id": firebase["PRIVATE_KEY_ID"],
+            "private_key": firebase["PRIVATE_KEY"].replace('\\n', '\n'),
+            "client_email": firebase["CLIENT_EMAIL"],
+            "client_id": firebase["CLIENT_ID"],
+            "auth_uri": firebase["AUTH_URI"],
+            "token_uri": firebase["TOKEN_URI"],
+            "auth_provider_x509_cert_url": firebase["AUTH_PROVIDER_X509_CERT_URL"],
+            "client_x509_cert_url": firebase["CLIENT_X509_CERT_URL"],
+            "universe_domain": firebase["UNIVERSE_DOMAIN"],
+        })
+        firebase_admin.initialize_app(cred)
+    return [doc.id for doc in firestore.client().collection('user_data').list_documents()]
+
+
+class StorageMigration:
+    def __init__(self, cursor, shared: SharedLayout, warehouse: str, dry_run: bool = False,
+                 store: Optional[ChunkStore] = None):
+        self.cursor = cursor
+        self.shared = shared
+        self.legacy = PerUserLayout()
+        self.warehouse = warehouse
+        self.dry_run = dry_run
+        self.store = store
+
+    def execute(self, statement: str, params: Optional[tuple] = None) -> None:
+        if self.dry_run:
+            print(statement.strip() + (f"  -- {params}" if params else ""))
+            return
+        self.cursor.execute(statement, params)
+
+    def executemany(self, statement: str, rows: Sequence[tuple]) -> None:
+        if self.dry_run:
+            print(statement.strip() + f"  -- {len(rows)} rows")
+            return
+        self.cursor.executemany(statement, rows)
+
+    def scalar(self, statement: str, params: Optional[tuple] = None) -> Any:
+        if self.dry_run:
+            return None
+        self.cursor.execute(statement, params)
+        return self.cursor.fetchone()[0]
+
+    def stage_provenance(self, user_id: str, source: str) -> bool:
+        """Load the chunk store's provenance of a user's source into a temporary table"""
+        rows = self.store.provenance(user_id, source) if self.store else []
+        if not rows:
+            return False
+        self.execute("CREATE TEMPORARY TABLE IF NOT EXISTS devrag_provenance "
+                     "(content_hash STRING, document_id STRING, ordinal INTEGER, origin STRING)")
+        self.execute("DELETE FROM devrag_provenance")
+        self.executemany("INSERT INTO devrag_provenance (content_hash, document_id, ordinal, origin) "
+                         "VALUES (%s, %s, %s, %s)", rows)
+        return True
+
+    def fill_provenance(self, user_id: str, shared_table: str) -> None:
+        """Give rows copied without provenance the document of a staged chunk with the same text"""
+        self.execute(
+            f"UPDATE {shared_table} AS t SET document_id = p.document_id, ordinal = p.ordinal, origin = p.origin "
+            f"FROM devrag_provenance AS p "
+            f"WHERE t.user_id = %s AND t.document_id IS NULL AND t.content_hash = p.content_hash",
+            (user_id,),
+        )
+
+    def create_schema(self) -> None:
+        for statement in self.shared.schema_statements(self.warehouse):
+            self.execute(statement)
+
+    def migrate_user(self, user_id: str, drop: bool = False) -> int:
+        """Copy one user's legacy tables; returns the number of sources migrated"""
+        migrated = 0
+        for source in SOURCES:
+            legacy_table = self.legacy.table(user_id, source)
+            shared_table = self.shared.table(user_id, source)
+            try:
+                # DDL commits implicitly, so it all runs before the transaction
+                for statement in self.legacy.upgrade_statements(user_id, source):
+                    self.execute(statement)
+                staged = self.stage_provenance(user_id, source)
+                self.execute("BEGIN")
+                self.execute(f"DELETE FROM {shared_table} WHERE user_id = %s", (user_id,))
+                self.execute(
+                    f"INSERT INTO {shared_table} (user_id, content, document_id, ordinal, content_hash) "
+                    f"SELECT %s, content, document_id, ordinal, COALESCE(content_hash, SHA2(content, 256)) "
+                    f"FROM {legacy_table}",
+                    (user_id,),
+                )
+                if staged:
+                    self.fill_provenance(user_id, shared_table)
+                self.execute("COMMIT")
+                migrated += 1
+            except Exception as e:
+                self.execute("ROLLBACK")
+                print(f"Skipping {legacy_table}: {e}")
+                continue
+            orphans = self.scalar(
+                f"SELECT COUNT(*) FROM {shared_table} WHERE user_id = %s AND document_id IS NULL", (user_id,))
+            if orphans:
+                print(f"{user_id} {source}: {orphans} rows have no document id; "
+                      f"re-ingest this source so replacing or deleting documents reaches them")
+            if drop:
+                self.execute(f"DROP CORTEX SEARCH SERVICE IF EXISTS {self.legacy.service(user_id, source)}")
+                self.execute(f"DROP TABLE IF EXISTS {legacy_table}")
+        return migrated
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Migrate per-user RAG tables to shared multi-tenant tables")
+    parser.add_argument("--users", help="comma separated user ids (default: all users in Firestore)")
+    parser.add_argument("--drop", action="store_true", help="drop legacy tables and search services after copying")
+    parser.add_argument("--dry-run", action="store_true", help="print statements without executing them")
+    parser.add_argument("--chunk-store", help="chunk store to recover provenance from (default: [INGESTION] CHUNK_STORE)")
+    args = parser.parse_args(argv)
+
+    secrets = load_config()
+    store_path = args.chunk_store or secrets.get("INGESTION", {}).get("CHUNK_STORE", ".devrag/chunks.sqlite3")
+    store = ChunkStore(store_path) if store_path and os.path.exists(store_path) else None
+    layout = create_layout(dict(secrets.get("STORAGE", {}), MODE="shared"))
+    user_ids = args.users.split(",") if args.users else load_user_ids(secrets)
+
+    conn = None
+    cursor = None
+    if not args.dry_run:
+        conn = snowflake.connector.connect(
+            user=secrets["SNOWFLAKE"]["USER"],
+            password=secrets["SNOWFLAKE"]["PASSWORD"],
+            account=secrets["SNOWFLAKE"]["ACCOUNT"],
+            database=secrets["SNOWFLAKE"]["DATABASE"],
+            schema=secrets["SNOWFLAKE"]["SCHEMA"],
+            warehouse=secrets["SNOWFLAKE"]["WAREHOUSE"],
+        )
+        cursor = conn.cursor()
+    try:
+        migration = StorageMigration(cursor, layout, secrets["SNOWFLAKE"]["WAREHOUSE"], dry_run=args.dry_run,
+                                     store=store)
+        migration.create_schema()
+        for user_id in user_ids:
+            migrated = migration.migrate_user(user_id, drop=args.drop)
+            print(f"{user_id}: migrated {migrated}/{len(SOURCES)} sources")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+        if store:
+            store.close()
+    if not args.dry_run:
+        print('Set MODE = "shared" in the [STORAGE] section of secrets.toml to serve from the shared tables.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,171 @@
+import re
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREAMBLE = """You are a helpful assistant using a Retrieval-Augmented Generation (RAG) method to answer user queries.
+Here are the inputs provided to you:"""
+
+INSTRUCTIONS = """### Instructions:
+    - Provide a concise and informative response that addresses the user query effectively.
+    - Use the provided **Document Details** as the primary source of truth to answer the query.
+    - Refer to the **Memory** to maintain conversation context. Use this information to make your response coherent and contextual.
+    - Dont use the **Memory** as the primary source of information unless the query explicitly asks for it.
+    - If relevant information from the **Memory** or **Document Details** is missing, clarify this in your response and guide the user on how to proceed.
+    - Don't provide verbatim responses from the **Document Details** or **Memory**. Instead, paraphrase and summarize the information to enhance user understanding.
+    - Don't greet user frequently. Be friendly in your responses.
+### Response:
+    - Be concise and accurate. If additional explanations are required, provide them clearly.
+    - Ensure your response aligns with the user's intent as reflected in the query and conversation context.
+    - Where applicable, suggest follow-up actions or related queries for deeper understanding."""
+
+EXAMPLE = """---
+**Example Input**:
+    - **Document Details**:
+        "This document is a developer's guide for integrating payment APIs. It includes sections on API authentication, error handling, and webhook configurations."
+    - **Memory**:
+        1.  User: "What are the common errors during payment API integration?"
+            Assistant: "The common errors include invalid API keys, incorrect endpoint URLs, and missing webhook signatures."
+        2.  User: "How do I fix invalid API key errors?"
+            Assistant: "Ensure you're using the API key issued for your account and verify it matches the required permissions."
+    - **User Query**:
+        "What are webhook configurations, and how do they work?"
+**Example Output**:
+    "Webhook configurations are settings that allow your application to receive real-time updates from the payment API when specific events occur (e.g., successful payments, refunds). Configure the webhook URL in your API dashboard, ensure it points to an accessible endpoint, and validate incoming requests using the signature provided in the header to ensure authenticity.\""""
+
+DEFAULT_BUDGETS = {
+    "instructions": 700,
+    "documents": 1500,
+    "memory": 800,
+    "query": 300,
+}
+
+
+class Tokenizer:
+    """Token counter backed by tiktoken when installed, else a regex approximation"""
+    _PATTERN = re.compile(r"\w+|[^\w\s]")
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self.encoding = None
+        try:
+            import tiktoken
+            self.encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            logger.info("tiktoken unavailable, using approximate token counts")
+
+    def encode(self, text: str) -> List[Any]:
+        if self.encoding is not None:
+            return self.encoding.encode(text, disallowed_special=())
+        return self._PATTERN.findall(text)
+
+    def count(self, text: str) -> int:
+        return _count_tokens(self, text)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut text to at most max_tokens, marking the cut with an ellipsis"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoding is not None:
+            return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max_tokens - 1]) + "…"
+        kept = 0
+        for match in self._PATTERN.finditer(text):
+            kept += 1
+            if kept == max_tokens:
+                return text[:match.start()].rstrip() + "…"
+        return text
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens(tokenizer: Tokenizer, text: str) -> int:
+    return len(tokenizer.encode(text))
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding_name: str = "cl100k_base") -> Tokenizer:
+    """Process-wide tokenizer; loading an encoding is expensive so it happens once"""
+    return Tokenizer(encoding_name)
+
+
+def count_tokens(text: str) -> int:
+    return get_tokenizer().count(text)
+
+
+def format_memory_item(item: Dict[str, Any]) -> str:
+    if "summary_text" in item:
+        return f"Summary of earlier conversation: {item['summary_text']}"
+    return f"User: {item.get('query', '')}\nAssistant: {item.get('response', '')}"
+
+
+class PromptBuilder:
+    """Assembles the COMPLETE prompt with a token budget per section"""
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, tokenizer: Optional[Tokenizer] = None):
+        self.budgets = dict(DEFAULT_BUDGETS, **(budgets or {}))
+        self.tokenizer = tokenizer or get_tokenizer()
+
+    def _instructions(self) -> str:
+        """Full instructions with the worked example, dropping the example first if over budget"""
+        budget = self.budgets["instructions"]
+        full = f"{INSTRUCTIONS}\n\n{EXAMPLE}"
+        if self.tokenizer.count(full) <= budget:
+            return full
+        return self.tokenizer.truncate(INSTRUCTIONS, budget)
+
+    def _documents(self, documents: List[Dict[str, Any]]) -> str:
+        """Keep documents in rank order until the budget is spent, truncating the last one"""
+        budget = self.budgets["documents"]
+        lines, used = [], 0
+        for i, item in enumerate(documents, start=1):
+            line = f"[{i}] ({', '.join(item.get('services', []))}) {item['content']}"
+            tokens = self.tokenizer.count(line)
+            if used + tokens > budget:
+                remaining = budget - used
+                if remaining >= 32:
+                    lines.append(self.tokenizer.truncate(line, remaining))
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines) if lines else "No relevant documents were found."
+
+    def _memory(self, memory: List[Dict[str, Any]]) -> str:
+        """Keep the most recent turns that fit, then restore chronological order"""
+        budget = self.budgets["memory"]
+        # Summaries cover older history than the raw turns, wherever they sit in the list
+        ordered = [item for item in memory if "summary_text" in item] + \
+                  [item for item in memory if "summary_text" not in item]
+        kept, used = [], 0
+        for item in reversed(ordered):
+            text = format_memory_item(item)
+            tokens = self.tokenizer.count(text)
+            if used + tokens > budget:
+                remaining = budget - used
+                if remaining >= 32 and not kept:
+                    kept.append(self.tokenizer.truncate(text, remaining))
+                break
+            kept.append(text)
+            used += tokens
+        return "\n".join(reversed(kept)) if kept else "No previous conversation."
+
+    def build(self, query: str, documents: List[Dict[str, Any]],
+              memory: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+        """Return the prompt text and the tokens each section used"""
+        sections = {
+            "instructions": self._instructions(),
+            "documents": self._documents(documents),
+            "memory": self._memory(memory),
+            "query": self.tokenizer.truncate(query, self.budgets["query"]),
+        }
+        prompt = (
+            f"{PREAMBLE}\n\n"
+            "### Contextual Information\n"
+            f"1. **Document Details**:\n{sections['documents']}\n"
+            f"2. **Memory (Previous Conversation History)**:\n{sections['memory']}\n"
+            f"3. **User Query**:\n{sections['query']}\n"
+            f"{sections['instructions']}"
+        )
+        usage = {name: self.tokenizer.count(text) for name, text in sections.items()}
+        usage["total"] = self.tokenizer.count(prompt)
+        return prompt, usage
@@ -0,0 +1,243 @@
+import os
+import time
+import queue
+import random
+import socket
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from storage import SOURCES, StorageLayout
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+READY = "ready"
+FAILED = "failed"
+
+Job = Tuple[str, str, int]  # (user_id, source, attempt)
+
+
+class ProvisioningQueue:
+    """Worker pool that creates each user's tables and search services with retries
+
+    Jobs and per-source readiness are persisted in the Firestore `provisioning`
+    collection (one document per user), so work queued by a process that dies
+    is picked up again by resume(), and any process can answer readiness().
+    Each (user, source) pair is an independent job, so a signup burst runs its
+    DDL in parallel across the pool instead of one thread per user in series.
+
+    A pending or running job carries the owner that holds it and a lease the
+    owner's heartbeat keeps extending; resume() only takes over jobs whose
+    lease ran out, so a live process's DDL is never run a second time.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, *args, **kwargs) -> "ProvisioningQueue":
+        """Process-wide queue; Streamlit re-runs the script on every interaction"""
+        if cls._shared is None:
+            with cls._shared_lock:
+                if cls._shared is None:
+                    cls._shared = cls(*args, **kwargs)
+                    cls._shared.resume()
+        return cls._shared
+
+    def __init__(self, db, get_connection: Callable[[], Any], layout: StorageLayout, warehouse: str,
+                 workers: int = 4, max_attempts: int = 5, base_delay: float = 2.0, max_delay: float = 60.0,
+                 lease_seconds: float = 120.0):
+        self.db = db
+        self.get_connection = get_connection
+        self.layout = layout
+        self.warehouse = warehouse
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        # (user_id, source) of jobs this process holds: queued, running or waiting out a backoff
+        self._held: Set[Tuple[str, str]] = set()
+        self._held_lock = threading.Lock()
+        self._queue: "queue.Queue[Job]" = queue.Queue()
+        # Sources of one user finish concurrently; serialize the read-modify-write of the overall status
+        self._record_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, daemon=True, name=f"provisioning-{i}")
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        threading.Thread(target=self._heartbeat, daemon=True, name="provisioning-heartbeat").start()
+
+    def _document(self, user_id: str):
+        return self.db.collection('provisioning').document(user_id)
+
+    def enqueue(self, user_id: str) -> None:
+        """Record a pending job for every source and hand them to the workers"""
+        self._document(user_id).set({
+            'status': PENDING,
+            'sources': {source: self._state(PENDING, 0) for source in SOURCES},
+            'updated_at': datetime.now(),
+        })
+        for source in SOURCES:
+            self._submit((user_id, source, 1))
+
+    def retry(self, user_id: str) -> List[str]:
+        """Re-queue the user's failed sources; ready ones keep their search services"""
+        failed = [source for source, status in self.readiness(user_id).items() if status == FAILED]
+        for source in failed:
+            self._record(user_id, source, PENDING, 0)
+            self._submit((user_id, source, 1))
+        return failed
+
+    def resume(self) -> int:
+        """Re-queue unfinished jobs whose owner stopped renewing their lease"""
+        resumed = 0
+        try:
+            unfinished = self.db.collection('provisioning').where('status', 'in', [PENDING, RUNNING])
+            for snapshot in unfinished.stream():
+                data = snapshot.to_dict() or {}
+                for source, state in data.get('sources', {}).items():
+                    if state.get('status') in (PENDING, RUNNING) and self._expired(state):
+                        attempt = state.get('attempts', 0)
+                        # Claim it before queueing so other processes starting up leave it alone
+                        self._record(snapshot.id, source, PENDING, attempt, state.get('error'))
+                        self._submit((snapshot.id, source, attempt + 1))
+                        resumed += 1
+        except Exception as e:
+            logger.error(f"Failed to resume provisioning jobs: {e}")
+        return resumed
+
+    def readiness(self, user_id: str) -> Dict[str, str]:
+        """Source -> status; users registered before provisioning was tracked count as ready"""
+        snapshot = self._document(user_id).get()
+        data = snapshot.to_dict() if snapshot.exists else None
+        if not data:
+            return {source: READY for source in SOURCES}
+        return {source: state.get('status', PENDING) for source, state in data.get('sources', {}).items()}
+
+    def errors(self, user_id: str) -> Dict[str, str]:
+        snapshot = self._document(user_id).get()
+        data = (snapshot.to_dict() if snapshot.exists else None) or {}
+        return {source: state['error'] for source, state in data.get('sources', {}).items() if state.get('error')}
+
+    def is_ready(self, user_id: str) -> bool:
+        return all(status == READY for status in self.readiness(user_id).values())
+
+    def _state(self, status: str, attempt: int, error: Optional[str] = None) -> Dict[str, Any]:
+        held = status in (PENDING, RUNNING)
+        return {
+            'status': status, 'attempts': attempt, 'error': error,
+            'owner': self.owner if held else None,
+            'lease_until': time.time() + self.lease_seconds if held else None,
+        }
+
+    def _expired(self, state: Dict[str, Any]) -> bool:
+        """True if no live process holds the job; jobs recorded before leases existed have none"""
+        if state.get('owner') == self.owner:
+            return False
+        return not state.get('owner') or (state.get('lease_until') or 0) < time.time()
+
+    def _owns(self, user_id: str, source: str) -> bool:
+        """True unless another process claimed the job since it was queued here"""
+        snapshot = self._document(user_id).get()
+        data = (snapshot.to_dict() if snapshot.exists else None) or {}
+        state = data.get('sources', {}).get(source, {})
+        return state.get('owner') in (None, self.owner) or self._expired(state)
+
+    def _submit(self, job: Job) -> None:
+        with self._held_lock:
+            self._held.add(job[:2])
+        self._queue.put(job)
+
+    def _release(self, user_id: str, source: str) -> None:
+        with self._held_lock:
+            self._held.discard((user_id, source))
+
+    def _heartbeat(self) -> None:
+        """Extend the lease of every held job, one update per user"""
+        while True:
+            time.sleep(self.lease_seconds / 3)
+            with self._held_lock:
+                held = list(self._held)
+            by_user: Dict[str, List[str]] = {}
+            for user_id, source in held:
+                by_user.setdefault(user_id, []).append(source)
+            lease_until = time.time() + self.lease_seconds
+            for user_id, sources in by_user.items():
+                try:
+                    self._document(user_id).update({f'sources.{source}.lease_until': lease_until for source in sources})
+                except Exception as e:
+                    logger.warning(f"Failed to renew provisioning lease for {user_id}: {e}")
+
+    def _record(self, user_id: str, source: str, status: str, attempt: int, error: Optional[str] = None) -> None:
+        document = self._document(user_id)
+        with self._record_lock:
+            document.update({
+                f'sources.{source}': self._state(status, attempt, error),
+                'updated_at': datetime.now(),
+            })
+            statuses = set(self.readiness(user_id).values())
+            overall = READY if statuses == {READY} else FAILED if FAILED in statuses else PENDING
+            document.update({'status': overall})
+
+    def _run(self, user_id: str, source: str) -> None:
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            for statement in self.layout.source_statements(user_id, source, self.warehouse):
+                cursor.execute(statement)
+            cursor.close()
+        finally:
+            conn.close()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _work(self) -> None:
+        while True:
+            user_id, source, attempt = self._queue.get()
+            try:
+                if not self._owns(user_id, source):
+                    logger.info(f"Provisioning {source} for {user_id} was taken over by another process")
+                    self._release(user_id, source)
+                    continue
+                self._record(user_id, source, RUNNING, attempt)
+                self._run(user_id, source)
+                self._release(user_id, source)
+                self._record(user_id, source, READY, attempt)
+                logger.info(f"Provisioned {source} for {user_id} (attempt {attempt})")
+            except Exception as e:
+                if attempt >= self.max_attempts:
+                    logger.error(f"Provisioning {source} for {user_id} failed after {attempt} attempts: {e}")
+                    self._release(user_id, source)
+                    self._safe_record(user_id, source, FAILED, attempt, str(e))
+                else:
+                    delay = self._backoff(attempt)
+                    logger.warning(f"Provisioning {source} for {user_id} failed, retrying in {delay:.1f}s: {e}")
+                    self._safe_record(user_id, source, PENDING, attempt, str(e))
+                    # Re-queue from a timer so the worker is free while the job waits out its backoff
+                    timer = threading.Timer(delay, self._queue.put, args=((user_id, source, attempt + 1),))
+                    timer.daemon = True
+                    timer.start()
+            finally:
+                self._queue.task_done()
+
+    def _safe_record(self, *args) -> None:
+        try:
+            self._record(*args)
+        except Exception as e:
+            logger.error(f"Failed to record provisioning status: {e}")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until no job is queued or running; retries waiting on a timer are not counted"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
@@ -0,0 +1,481 @@
+import os
+import re
+import json
+import zlib
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from lazy import LazyImport
+
+try:
+    import fcntl
+except ImportError:  # Windows: local indexes are then only safe with a single writing process
+    fcntl = None
+
+# snowflake.core takes seconds to import; only Cortex searches need it
+Root = LazyImport("snowflake.core", "Root")
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Exclusive lock on `path`, held against other processes writing the same index"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class RetrievalBackend:
+    """Interface between SnowflakeManager and whatever answers search requests"""
+    # Whether inserted chunks must also be written to the user's warehouse tables
+    uses_warehouse = True
+
+    def add(self, service_name: str, contents: List[str], tenant: Optional[str] = None,
+            documents: Optional[List[str]] = None) -> None:
+        """Index new chunks for a search service, scoped to `tenant` when the service is shared
+
+        `documents` holds the document id of each chunk, so delete() can remove them later.
+        """
+        raise NotImplementedError
+
+    def delete(self, service_name: str, documents: List[str], tenant: Optional[str] = None) -> int:
+        """Drop every chunk of the given document ids from the index; returns how many were dropped"""
+        return 0
+
+    def search(self, service_name: str, query: str, limit: int = 5, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """Return results shaped like Cortex Search: {"results": [{"CONTENT": ...}]}"""
+        raise NotImplementedError
+
+    def prepare(self, service_name: str, tenant: Optional[str] = None) -> None:
+        """Load or resolve what searching a service needs, ahead of its first query"""
+        return None
+
+    @staticmethod
+    def scoped_name(service_name: str, tenant: Optional[str] = None) -> str:
+        """Key for local indexes, which are kept per tenant even when the warehouse service is shared"""
+        return f"{tenant}_{service_name}" if tenant else service_name
+
+
+class CortexSearchBackend(RetrievalBackend):
+    """Snowflake Cortex Search services; indexing happens from the warehouse tables"""
+    uses_warehouse = True
+
+    def __init__(self, connection: Callable[[], ContextManager[Any]], database: str, schema: str):
+        # Checks out a pooled connection; its service handles are cached with it
+        self.connection = connection
+        self.database = database
+        self.schema = schema
+
+    def add(self, service_name: str, contents: List[str], tenant: Optional[str] = None,
+            documents: Optional[List[str]] = None) -> None:
+        # Cortex Search refreshes from the underlying table on its own TARGET_LAG; so do deletes
+        return None
+
+    def service(self, pooled, service_name: str):
+        """The service's handle on a checked-out connection, which only this thread is using"""
+        handle = pooled.cache.get(service_name)
+        if handle is None:
+            schema = Root(pooled.session).databases[self.database].schemas[self.schema]
+            handle = pooled.cache[service_name] = schema.cortex_search_services[service_name]
+        return handle
+
+    def prepare(self, service_name: str, tenant: Optional[str] = None) -> None:
+        with self.connection() as pooled:
+            self.service(pooled, service_name)
+
+    def search(self, service_name: str, query: str, limit: int = 5, tenant: Optional[str] = None) -> Dict[str, Any]:
+        options: Dict[str, Any] = {}
+        if tenant:
+            # Shared services index every user's rows; USER_ID is declared as a filter attribute
+            options["filter"] = {"@eq": {"USER_ID": tenant}}
+        with self.connection() as pooled:
+            search_service = self.service(pooled, service_name)
+            search_results = search_service.search(query=query, columns=["CONTENT"], limit=limit, **options)
+        return search_results.to_dict()
+
+
+class HashingEmbedder:
+    """Dependency-free text embedder using signed feature hashing of words and bigrams"""
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        words = re.findall(r'\w+', text.lower())
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                matrix[row, digest % self.dim] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class LocalVectorIndex:
+    """Memory-mapped float32 embedding matrix with brute-force or IVF top-k search
+
+    Rows are appended, never rewritten in place: deleting a document masks
+    its rows and appends them to deleted.jsonl. Once more than
+    `compact_ratio` of the rows are masked the live rows are copied into a
+    new generation of files, and meta.json, replaced last, switches readers
+    over to it. Writers hold index.lock, so several processes (API, bulk
+    ingestion, backfill) can share a directory; each picks up the others'
+    rows and deletions before writing or searching.
+    """
+    def __init__(self, path: str, dim: int, ivf_threshold: int = 50000, nprobe: int = 8,
+                 block_rows: int = 65536, compact_ratio: float = 0.25):
+        self.path = path
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.block_rows = block_rows
+        self.compact_ratio = compact_ratio
+        self.generation = 0
+        self.count = 0
+        self.capacity = 0
+        self.contents: List[str] = []
+        # Source document of each row; '' for rows indexed before documents were tracked
+        self.documents: List[str] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.vectors: Optional[np.memmap] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self._trained_at = 0
+        # Document id -> its rows, so a delete touches only those; masked rows leave at compaction
+        self._rows: Dict[str, List[int]] = {}
+        self._masked = 0
+        # Bytes of deleted.jsonl applied so far
+        self._deleted_offset = 0
+        # Versions of meta.json and deleted.jsonl as last read
+        self._seen: Tuple[Tuple[int, int], ...] = ()
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        with file_lock(self._lock_path):
+            self._load()
+
+    def _file(self, name: str, generation: Optional[int] = None) -> str:
+        """Path of one of a generation's files; generation 0 keeps the original names"""
+        generation = self.generation if generation is None else generation
+        stem, extension = name.split('.', 1)
+        return os.path.join(self.path, name if not generation else f"{stem}.{generation}.{extension}")
+
+    @property
+    def _lock_path(self) -> str:
+        return os.path.join(self.path, 'index.lock')
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.path, 'meta.json')
+
+    def _versions(self) -> Tuple[Tuple[int, int], ...]:
+        """Inode and mtime of meta.json, which is replaced on every write, and inode and size of deleted.jsonl"""
+        versions = []
+        for path, field in ((self._meta_path, 'st_mtime_ns'), (self._file('deleted.jsonl'), 'st_size')):
+            try:
+                stat = os.stat(path)
+                versions.append((stat.st_ino, getattr(stat, field)))
+            except OSError:
+                versions.append((0, 0))
+        return tuple(versions)
+
+    def _refresh(self, locked: bool = False) -> None:
+        """Catch up with what other processes have written since the index was last read"""
+        versions = self._versions()
+        if versions == self._seen:
+            return
+        if versions[0] == self._seen[0] and (versions[1][0] == self._seen[1][0] or not self._deleted_offset):
+            # Only deletions were appended
+            self._read_deletions()
+            self._seen = versions
+            return
+        if locked:
+            self._load()
+            return
+        # A compaction removes the old generation's files; reload while none can run
+        with file_lock(self._lock_path):
+            self._load()
+
+    def _load(self) -> None:
+        self._seen = self._versions()
+        # Inverted lists are retrained on the next IVF search
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['dim'] != self.dim:
+            raise ValueError(f"Index at {self.path} has dim {meta['dim']}, expected {self.dim}")
+        self.generation = meta.get('generation', 0)
+        self.count = meta['count']
+        self.capacity = meta['capacity']
+        self._seen = self._versions()
+        with open(self._file('contents.jsonl'), 'r', encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f][:self.count]
+        # A row is [content, document id], or a bare string when written before documents were tracked
+        self.contents = [row[0] if isinstance(row, list) else row for row in rows]
+        self.documents = [row[1] if isinstance(row, list) else '' for row in rows]
+        self._rows = {}
+        for row, document in enumerate(self.documents):
+            if document:
+                self._rows.setdefault(document, []).append(row)
+        self.deleted = np.zeros(self.count, dtype=bool)
+        self._masked = 0
+        self._deleted_offset = 0
+        self._read_deletions()
+        self.vectors = None
+        if self.capacity:
+            self.vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r+',
+                                     shape=(self.capacity, self.dim))
+
+    def _read_deletions(self) -> None:
+        """Apply the lines of deleted.jsonl past the last one applied"""
+        try:
+            with open(self._file('deleted.jsonl'), 'rb') as f:
+                f.seek(self._deleted_offset)
+                data = f.read()
+        except OSError:
+            return
+        # A line still being written is picked up next time
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            rows = [row for row in json.loads(line) if row < self.count and not self.deleted[row]]
+            self.deleted[rows] = True
+            self._masked += len(rows)
+        self._deleted_offset += end
+
+    def _save_meta(self) -> None:
+        tmp_path = self._meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'dim': self.dim, 'count': self.count, 'capacity': self.capacity,
+                       'generation': self.generation}, f)
+        os.replace(tmp_path, self._meta_path)
+
+    @staticmethod
+    def _capacity(rows: int, capacity: int = 0) -> int:
+        capacity = max(1024, capacity)
+        while capacity < rows:
+            capacity *= 2
+        return capacity
+
+    def _reserve(self, rows: int) -> None:
+        """Grow the backing file geometrically so appends stay amortised O(1)"""
+        if self.count + rows <= self.capacity:
+            return
+        capacity = self._capacity(self.count + rows, self.capacity)
+        if self.vectors is not None:
+            self.vectors.flush()
+            self.vectors = None
+        with open(self._file('vectors.f32'), 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self.vectors = np.memmap(self._file('vectors.f32'), dtype=np.float32, mode='r+',
+                                 shape=(self.capacity, self.dim))
+
+    def add(self, contents: List[str], embeddings: np.ndarray, documents: Optional[List[str]] = None) -> None:
+        if not contents:
+            return
+        documents = list(documents) if documents is not None else [''] * len(contents)
+        with self._lock, file_lock(self._lock_path):
+            self._refresh(locked=True)
+            self._reserve(len(contents))
+            start, end = self.count, self.count + len(contents)
+            self.vectors[start:end] = embeddings.astype(np.float32, copy=False)
+            self.vectors.flush()
+            with open(self._file('contents.jsonl'), 'a', encoding='utf-8') as f:
+                for content, document in zip(contents, documents):
+                    f.write(json.dumps([content, document]) + '\n')
+            self.contents.extend(contents)
+            self.documents.extend(documents)
+            for row, document in enumerate(documents, start):
+                if document:
+                    self._rows.setdefault(document, []).append(row)
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(contents), dtype=bool)])
+            self.count = end
+            self._save_meta()
+            self._seen = self._versions()
+            if self.centroids is not None:
+                self.assignments = np.concatenate([
+                    self.assignments, self._assign(embeddings)
+                ])
+
+    def delete(self, documents: List[str]) -> int:
+        """Mask every row of the given document ids; returns how many rows were masked"""
+        with self._lock, file_lock(self._lock_path):
+            self._refresh(locked=True)
+            rows = [row for document in set(documents) if document
+                    for row in self._rows.pop(document, ()) if not self.deleted[row]]
+            if not rows:
+                return 0
+            self.deleted[rows] = True
+            self._masked += len(rows)
+            with open(self._file('deleted.jsonl'), 'a') as f:
+                f.write(json.dumps(rows) + '\n')
+            self._deleted_offset = os.path.getsize(self._file('deleted.jsonl'))
+            self._seen = self._versions()
+            if self._masked > self.compact_ratio * self.count:
+                self._compact()
+            return len(rows)
+
+    def _compact(self) -> None:
+        """Copy the live rows into the next generation's files and switch to it; caller holds both locks"""
+        live = np.flatnonzero(~self.deleted[:self.count])
+        old, generation = self.generation, self.generation + 1
+        capacity = self._capacity(len(live))
+        with open(self._file('vectors.f32', generation), 'wb') as f:
+            f.truncate(capacity * self.dim * 4)
+        vectors = np.memmap(self._file('vectors.f32', generation), dtype=np.float32, mode='r+',
+                            shape=(capacity, self.dim))
+        for start in range(0, len(live), self.block_rows):
+            rows = live[start:start + self.block_rows]
+            vectors[start:start + len(rows)] = self.vectors[rows]
+        vectors.flush()
+        del vectors
+        with open(self._file('contents.jsonl', generation), 'w', encoding='utf-8') as f:
+            for row in live:
+                f.write(json.dumps([self.contents[row], self.documents[row]]) + '\n')
+        self.generation, self.count, self.capacity = generation, len(live), capacity
+        self._save_meta()
+        self.vectors = None
+        for name in ('vectors.f32', 'contents.jsonl', 'deleted.jsonl'):
+            try:
+                os.remove(self._file(name, old))
+            except OSError:
+                pass
+        self._load()
+
+    def _assign(self, embeddings: np.ndarray) -> np.ndarray:
+        return np.argmax(embeddings @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _train(self, iterations: int = 10, sample_size: int = 65536) -> None:
+        """Spherical k-means over a sample to partition the matrix into inverted lists"""
+        n_lists = max(1, int(np.sqrt(self.count)))
+        rng = np.random.default_rng(0)
+        sample_rows = rng.choice(self.count, size=min(sample_size, self.count), replace=False)
+        sample = np.asarray(self.vectors[np.sort(sample_rows)])
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(n_lists):
+                members = sample[labels == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / (np.linalg.norm(centroid) or 1.0)
+        self.centroids = centroids
+        assignments = [
+            self._assign(np.asarray(self.vectors[start:min(start + self.block_rows, self.count)]))
+            for start in range(0, self.count, self.block_rows)
+        ]
+        self.assignments = np.concatenate(assignments)
+        self._trained_at = self.count
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            scores, rows = scores[keep], rows[keep]
+        order = np.argsort(-scores)
+        return rows[order], scores[order]
+
+    def _brute_force(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        best_rows = [np.zeros(0, dtype=np.int64) for _ in range(len(queries))]
+        best_scores = [np.zeros(0, dtype=np.float32) for _ in range(len(queries))]
+        for start in range(0, self.count, self.block_rows):
+            end = min(start + self.block_rows, self.count)
+            block_scores = queries @ np.asarray(self.vectors[start:end]).T
+            block_scores[:, self.deleted[start:end]] = -np.inf
+            block_rows = np.arange(start, end)
+            for i in range(len(queries)):
+                best_rows[i], best_scores[i] = self._top_k(
+                    np.concatenate([best_scores[i], block_scores[i]]),
+                    np.concatenate([best_rows[i], block_rows]),
+                    k,
+                )
+        return list(zip(best_rows, best_scores))
+
+    def _ivf(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        if self.centroids is None or self.count >= 2 * self._trained_at:
+            self._train()
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argsort(-(queries @ self.centroids.T), axis=1)[:, :nprobe]
+        results = []
+        for query, probe in zip(queries, probes):
+            rows = np.flatnonzero(np.isin(self.assignments, probe) & ~self.deleted[:len(self.assignments)])
+            scores = np.asarray(self.vectors[rows]) @ query
+            results.append(self._top_k(scores, rows, k))
+        return results
+
+    def search_batch(self, queries: np.ndarray, k: int) -> List[List[Tuple[str, float]]]:
+        """Top-k (content, score) pairs for each row of a query embedding matrix"""
+        with self._lock:
+            self._refresh()
+            if not self.count:
+                return [[] for _ in range(len(queries))]
+            queries = queries.astype(np.float32, copy=False)
+            if self.count >= self.ivf_threshold:
+                hits = self._ivf(queries, k)
+            else:
+                hits = self._brute_force(queries, k)
+            return [
+                [(self.contents[row], float(score)) for row, score in zip(rows, scores) if not self.deleted[row]]
+                for rows, scores in hits
+            ]
+
+
+class LocalVectorBackend(RetrievalBackend):
+    """Warehouse-free retrieval over one LocalVectorIndex per search service"""
+    uses_warehouse = False
+
+    def __init__(self, index_dir: str = '.devrag/index', embedder: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 dim: int = 1024, ivf_threshold: int = 50000, nprobe: int = 8, compact_ratio: float = 0.25):
+        self.index_dir = index_dir
+        self.embedder = embedder or HashingEmbedder(dim)
+        self.dim = dim
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.compact_ratio = compact_ratio
+        self._indexes: Dict[str, LocalVectorIndex] = {}
+        self._lock = threading.Lock()
+
+    def index(self, service_name: str) -> LocalVectorIndex:
+        with self._lock:
+            if service_name not in self._indexes:
+                self._indexes[service_name] = LocalVectorIndex(
+                    os.path.join(self.index_dir, service_name), self.dim,
+                    ivf_threshold=self.ivf_threshold, nprobe=self.nprobe, compact_ratio=self.compact_ratio,
+                )
+            return self._indexes[service_name]
+
+    def add(self, service_name: str, contents: List[str], tenant: Optional[str] = None,
+            documents: Optional[List[str]] = None) -> None:
+        if contents:
+            self.index(self.scoped_name(service_name, tenant)).add(contents, self.embedder(contents), documents)
+
+    def delete(self, service_name: str, documents: List[str], tenant: Optional[str] = None) -> int:
+        return self.index(self.scoped_name(service_name, tenant)).delete(documents)
+
+    def prepare(self, service_name: str, tenant: Optional[str] = None) -> None:
+        self.index(self.scoped_name(service_name, tenant))
+
+    def search_batch(self, service_name: str, queries: List[str], limit: int = 5,
+                     tenant: Optional[str] = None) -> List[Dict[str, Any]]:
+        hits = self.index(self.scoped_name(service_name, tenant)).search_batch(self.embedder(queries), limit)
+        return [
+            {"results": [{"CONTENT": content, "SCORE": score} for content, score in query_hits]}
+            for query_hits in hits
+        ]
+
+    def search(self, service_name: str, query: str, limit: int = 5, tenant: Optional[str] = None) -> Dict[str, Any]:
+        return self.search_batch(service_name, [query], limit, tenant)[0]
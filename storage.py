@@ -0,0 +1,163 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from chunks import Chunk
+
+# Logical source name -> table suffix used by the original per-user layout
+SOURCES = {"personal": "rag", "github": "github", "pdf": "pdf"}
+
+EMBEDDING_MODEL = 'snowflake-arctic-embed-l-v2.0'
+
+# Provenance columns every chunk row carries, added to tables created before them
+PROVENANCE_COLUMNS = "document_id STRING, ordinal INTEGER, content_hash STRING"
+
+
+class StorageLayout:
+    """Where a user's chunks live in the warehouse and which search service indexes them"""
+    shared = False
+
+    def __init__(self, target_lag: str = '1 minutes', embedding_model: str = EMBEDDING_MODEL):
+        self.target_lag = target_lag
+        self.embedding_model = embedding_model
+
+    def table(self, user_id: str, source: str) -> str:
+        raise NotImplementedError
+
+    def service(self, user_id: str, source: str) -> str:
+        raise NotImplementedError
+
+    def tenant(self, user_id: str) -> Optional[str]:
+        """Value the search service must filter on, or None when the service is private"""
+        return None
+
+    def insert(self, user_id: str, source: str, chunks: List[Chunk],
+               origin: Optional[str] = None) -> Tuple[str, List[Tuple[Any, ...]]]:
+        """Parameterized INSERT statement and its rows for cursor.executemany"""
+        raise NotImplementedError
+
+    def delete(self, user_id: str, source: str) -> str:
+        """DELETE of whole documents, with `{}` standing for the list of document id placeholders
+
+        Document ids embed the user id, so one statement can cover documents of several users.
+        """
+        return f"DELETE FROM {self.table(user_id, source)} WHERE document_id IN ({{}})"
+
+    def upgrade_statements(self, user_id: str, source: str) -> List[str]:
+        """Idempotent DDL that adds the provenance columns to a table created without them"""
+        return [f"ALTER TABLE {self.table(user_id, source)} ADD COLUMN IF NOT EXISTS {PROVENANCE_COLUMNS}"]
+
+    def source_statements(self, user_id: str, source: str, warehouse: str) -> List[str]:
+        """Ordered DDL that makes one source's table and search service available to a user"""
+        raise NotImplementedError
+
+    def setup_statements(self, user_id: str, warehouse: str) -> List[str]:
+        """DDL to run when a user registers"""
+        return [
+            statement for source in SOURCES
+            for statement in self.source_statements(user_id, source, warehouse)
+        ]
+
+    def _search_service_ddl(self, name: str, table: str, warehouse: str, columns: str,
+                            attributes: str = '', replace: bool = True) -> str:
+        create = "CREATE OR REPLACE CORTEX SEARCH SERVICE" if replace else "CREATE CORTEX SEARCH SERVICE IF NOT EXISTS"
+        return f"""
+            {create} {name}
+            ON content
+            {attributes}
+            WAREHOUSE = '{warehouse}'
+            TARGET_LAG = '{self.target_lag}'
+            EMBEDDING_MODEL = '{self.embedding_model}'
+            AS (
+                SELECT {columns}
+                FROM {table}
+            );"""
+
+
+class PerUserLayout(StorageLayout):
+    """Original layout: three tables and three search services for every user"""
+
+    def table(self, user_id: str, source: str) -> str:
+        return f"{user_id}_{SOURCES[source]}"
+
+    def service(self, user_id: str, source: str) -> str:
+        return f"{self.table(user_id, source)}search"
+
+    def insert(self, user_id: str, source: str, chunks: List[Chunk],
+               origin: Optional[str] = None) -> Tuple[str, List[Tuple[Any, ...]]]:
+        statement = (f"INSERT INTO {self.table(user_id, source)} (content, document_id, ordinal, content_hash) "
+                     f"VALUES (%s, %s, %s, %s)")
+        return statement, [(chunk.content, chunk.document_id, chunk.ordinal, chunk.hash) for chunk in chunks]
+
+    def source_statements(self, user_id: str, source: str, warehouse: str) -> List[str]:
+        table = self.table(user_id, source)
+        return [
+            f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                content STRING,
+                {PROVENANCE_COLUMNS}
+                );""",
+            self._search_service_ddl(self.service(user_id, source), table, warehouse, "content"),
+        ]
+
+
+class SharedLayout(StorageLayout):
+    """Multi-tenant layout: one table and one search service per source, filtered on user_id
+
+    Object count and refresh cost stay constant as users sign up; the search
+    service exposes user_id as an attribute so queries only see the caller's rows.
+    """
+    shared = True
+
+    def __init__(self, prefix: str = 'DEVRAG', **kwargs):
+        super().__init__(**kwargs)
+        self.prefix = prefix
+
+    def table(self, user_id: str, source: str) -> str:
+        return f"{self.prefix}_{SOURCES[source]}".upper()
+
+    def service(self, user_id: str, source: str) -> str:
+        return f"{self.table(user_id, source)}SEARCH"
+
+    def tenant(self, user_id: str) -> Optional[str]:
+        return user_id
+
+    def insert(self, user_id: str, source: str, chunks: List[Chunk],
+               origin: Optional[str] = None) -> Tuple[str, List[Tuple[Any, ...]]]:
+        statement = (f"INSERT INTO {self.table(user_id, source)} "
+                     f"(user_id, content, origin, document_id, ordinal, content_hash) VALUES (%s, %s, %s, %s, %s, %s)")
+        return statement, [
+            (user_id, chunk.content, origin, chunk.document_id, chunk.ordinal, chunk.hash) for chunk in chunks
+        ]
+
+    def source_statements(self, user_id: str, source: str, warehouse: str) -> List[str]:
+        # Nothing is created per user; the IF NOT EXISTS DDL is a cheap no-op once the schema exists
+        table = self.table(user_id, source)
+        return [
+            f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                user_id STRING NOT NULL,
+                content STRING,
+                origin STRING,
+                {PROVENANCE_COLUMNS},
+                created_at TIMESTAMP_NTZ DEFAULT CURRENT_TIMESTAMP()
+                ) CLUSTER BY (user_id);""",
+            self._search_service_ddl(
+                self.service(user_id, source), table, warehouse,
+                "content, user_id, origin, created_at", attributes="ATTRIBUTES user_id", replace=False,
+            ),
+        ]
+
+    def schema_statements(self, warehouse: str) -> List[str]:
+        """Idempotent DDL for the shared tables and services"""
+        return self.setup_statements("", warehouse)
+
+
+def create_layout(settings: Optional[Dict[str, Any]] = None) -> StorageLayout:
+    """Layout from the optional [STORAGE] secrets section (MODE = "per_user" | "shared")"""
+    settings = settings or {}
+    options = {
+        "target_lag": settings.get("TARGET_LAG", '1 minutes'),
+        "embedding_model": settings.get("EMBEDDING_MODEL", EMBEDDING_MODEL),
+    }
+    if settings.get("MODE", "per_user") == "shared":
+        return SharedLayout(prefix=settings.get("TABLE_PREFIX", "DEVRAG"), **options)
+    return PerUserLayout(**options)
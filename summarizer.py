@@ -0,0 +1,117 @@
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = (
+    "Please summarize the following conversations into a concise paragraph that captures the main topics "
+    "discussed and key points from both the user's queries and the assistant's responses."
+)
+
+Job = Tuple[List[Dict[str, Any]], int, Future]  # (turns, attempt, future)
+
+
+def summary_messages(conversations: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Chat messages asking Mistral to summarize `conversations` (turns, or earlier summaries being compacted)"""
+    conversation_text = "\n\n".join(
+        f"Summary of earlier conversations: {conv['summary_text']}" if 'summary_text' in conv
+        else f"User: {conv.get('query', '')}\nAssistant: {conv.get('response', '')}"
+        for conv in conversations
+    )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": conversation_text},
+    ]
+
+
+class Summarizer:
+    """Background worker that summarizes conversations with one long-lived async Mistral client
+
+    submit() returns a Future at once. Jobs queued by every user are taken in
+    batches of up to `batch_size` and sent concurrently on the worker's event
+    loop; a failed job is re-queued with jittered exponential backoff and its
+    Future fails only after `max_attempts`.
+    """
+    def __init__(self, client_factory: Callable[[], Any], model: str = "mistral-large-latest",
+                 temperature: float = 0.5, batch_size: int = 8, max_attempts: int = 5,
+                 base_delay: float = 2.0, max_delay: float = 60.0):
+        self.client_factory = client_factory
+        self.model = model
+        self.temperature = temperature
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._client = None
+        self._loop = asyncio.new_event_loop()
+        self._queue: "asyncio.Queue[Job]" = asyncio.Queue()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True, name="summarizer")
+        self._thread.start()
+        self._worker_task = asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+
+    async def _start(self) -> asyncio.Task:
+        return asyncio.get_running_loop().create_task(self._worker())
+
+    def submit(self, conversations: List[Dict[str, Any]]) -> Future:
+        """Queue a summary of `conversations`; the Future resolves to the summary text"""
+        future: Future = Future()
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (list(conversations), 1, future))
+        return future
+
+    async def _worker(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            with metrics.span("memory.summarize"):
+                await asyncio.gather(*(self._attempt(job) for job in batch))
+
+    async def _attempt(self, job: Job) -> None:
+        conversations, attempt, future = job
+        if future.cancelled():
+            return
+        try:
+            summary = await self._complete(conversations)
+            metrics.inc("devrag_summaries_total", status="ok")
+            future.set_result(summary)
+        except Exception as e:
+            if attempt >= self.max_attempts:
+                logger.error(f"Summarizing {len(conversations)} turns failed after {attempt} attempts: {e}")
+                metrics.inc("devrag_summaries_total", status="error")
+                future.set_exception(e)
+                return
+            delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            logger.warning(f"Summarizing {len(conversations)} turns failed, retrying in {delay:.1f}s: {e}")
+            metrics.inc("devrag_summaries_total", status="retry")
+            self._loop.call_later(delay, self._queue.put_nowait, (conversations, attempt + 1, future))
+
+    async def _complete(self, conversations: List[Dict[str, Any]]) -> str:
+        if self._client is None:
+            # Created on the worker loop so its async HTTP pool is bound to it
+            self._client = self.client_factory()
+        response = await self._client.chat.complete_async(
+            model=self.model,
+            messages=summary_messages(conversations),
+            temperature=self.temperature,
+        )
+        content = response.choices[0].message.content
+        if not content:
+            raise Exception("Mistral returned an empty summary")
+        return content
+
+    def close(self) -> None:
+        """Stop the worker; summaries still queued are abandoned and their turns stay stored"""
+        if self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop)
+
+    async def _stop(self) -> None:
+        # Let the worker and its in-flight requests unwind before the loop stops
+        self._worker_task.cancel()
+        await asyncio.gather(self._worker_task, return_exceptions=True)
+        self._loop.stop()
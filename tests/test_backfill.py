@@ -0,0 +1,67 @@
+import time
+from types import SimpleNamespace
+
+from backfill import backfill
+from chunk_store import ChunkStore
+from chunks import Chunk, document_id
+
+
+class WordChunker:
+    key = "words:3"
+
+    def chunk_records(self, text, source="", document=""):
+        words = text.split()
+        return [Chunk(" ".join(words[i:i + 3]), source, document, i // 3) for i in range(0, len(words), 3)]
+
+
+def stage(store, chunker, origin, text, user_id="u1", source="pdf"):
+    store.put(user_id, source, origin, text, chunker.key,
+              chunker.chunk_records(text, source, document_id(user_id, source, origin)))
+
+
+def test_backfill_skips_deleted_documents(tmp_path):
+    store = ChunkStore(str(tmp_path / "chunks.sqlite3"))
+    chunker = WordChunker()
+    stage(store, chunker, "a.pdf", "alpha beta gamma delta")
+    stage(store, chunker, "b.pdf", "epsilon zeta eta")
+    store.delete("u1", "pdf", "a.pdf")
+    resources = SimpleNamespace(chunk_store=store, text_processor=chunker)
+
+    assert [document["origin"] for document in store.documents()] == ["b.pdf"]
+    assert backfill(resources, workers=0, dry_run=True)["documents"] == 1
+
+    # Extracting the document again brings it back
+    time.sleep(0.01)
+    stage(store, chunker, "a.pdf", "alpha beta gamma delta")
+    assert sorted(document["origin"] for document in store.documents()) == ["a.pdf", "b.pdf"]
+    assert backfill(resources, workers=0, dry_run=True)["documents"] == 2
+    store.close()
+
+
+def test_backend_delete_reaches_chunk_store(tmp_path):
+    from benchmarks import corpus
+    from benchmarks.fakes import FakeEnvironment, FakeLatencies, installed
+
+    site = str(tmp_path / "site")
+    corpus.write_site(site, pages=1, seed=1)
+    env = FakeEnvironment(FakeLatencies(scale=0), site, corpus.make_repos(seed=1))
+    env.seed_user("u1")
+    with installed(env, str(tmp_path / "run")):
+        import backend
+        import ingestion
+        ingestion.IngestionScheduler._shared = None
+        backend.Resources._shared = None
+        resources = backend.Resources.shared()
+        try:
+            user = resources.backend("u1")
+            user.replace_document("pdf", "a.pdf", "Parsers turn tokens into trees. " * 20).result()
+            user.replace_document("pdf", "b.pdf", "Lexers turn text into tokens. " * 20).result()
+            user.delete_document("pdf", "a.pdf").result()
+
+            origins = [document["origin"] for document in resources.chunk_store.documents(["u1"])]
+            assert origins == ["b.pdf"]
+            assert backfill(resources, user_ids=["u1"], workers=0, dry_run=True)["documents"] == 1
+        finally:
+            resources.close()
+            backend.Resources._shared = None
+            ingestion.IngestionScheduler._shared = None
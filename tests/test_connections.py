@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from connections import ConnectionPool, PooledConnection
+
+
+class Conn:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(size, timeout=5.0):
+    opened = []
+
+    def open_connection():
+        opened.append(PooledConnection(Conn(), lambda conn: object()))
+        return opened[-1]
+
+    return ConnectionPool(open_connection, size=size, timeout=timeout), opened
+
+
+def test_pool_bounds_concurrent_checkouts():
+    pool, opened = make_pool(size=2)
+    active, peak = [], []
+    lock = threading.Lock()
+
+    def work():
+        with pool.connection() as pooled:
+            with lock:
+                active.append(pooled)
+                peak.append(len(active))
+            time.sleep(0.02)
+            with lock:
+                active.remove(pooled)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    assert len(opened) == 2
+    assert pool.stats() == {"open": 2, "idle": 2}
+
+
+def test_pool_times_out_and_replaces_closed_connections():
+    pool, opened = make_pool(size=1, timeout=0.05)
+    with pool.connection() as pooled:
+        with pytest.raises(TimeoutError):
+            with pool.connection():
+                pass
+        pooled.conn.close()
+    with pool.connection() as pooled:
+        assert pooled is opened[1]
+    pool.close()
+    assert opened[1].conn.closed
+    assert pool.stats() == {"open": 0, "idle": 0}
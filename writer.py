@@ -0,0 +1,272 @@
+import time
+import atexit
+import logging
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Rows = List[Tuple[Any, ...]]
+
+# Keys per DELETE ... IN (...) statement
+DELETE_KEYS = 1000
+
+
+class _Write:
+    """One write() call: rows for one statement and the document key they replace"""
+    __slots__ = ("future", "statement", "rows", "delete", "key", "attempts")
+
+    def __init__(self, future: Future, statement: str, rows: Rows, replaces: Optional[Tuple[str, Any]]):
+        self.future = future
+        self.statement = statement
+        self.rows = rows
+        self.delete, self.key = replaces if replaces is not None else (None, None)
+        self.attempts = 0
+
+    @property
+    def group(self) -> str:
+        """Writes to the same table share a transaction; a table's delete and insert statements are fixed"""
+        return self.delete or self.statement
+
+
+class IngestWriter:
+    """Long-lived write-behind writer that coalesces inserts from every source and user
+
+    write() queues rows and returns a Future resolved once they are committed.
+    A single background thread flushes when `flush_rows` are pending or the
+    oldest pending row is `flush_interval` seconds old. Each table's writes
+    are committed in their own transaction: the deletes of the documents
+    they replace as one set-based DELETE ... IN, then one executemany per
+    statement. If a table's transaction fails its writes are tried one by
+    one, so only the bad ones fail; those are retried after a backoff, on
+    a later flush, without holding up the others. Producers block once
+    `max_pending_rows` are waiting (backpressure), and pending rows are
+    flushed by close(), which also runs at interpreter exit. `connection`
+    checks a connection out of the pool; each flush and DDL call holds one
+    for its duration only.
+    """
+    def __init__(self, connection: Callable[[], ContextManager[Any]], flush_rows: int = 500, flush_interval: float = 0.25,
+                 max_pending_rows: int = 20000, max_attempts: int = 3, retry_delay: float = 1.0):
+        self.connection = connection
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.max_pending_rows = max_pending_rows
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._pending: List[_Write] = []
+        self._in_flight: List[_Write] = []
+        # (due time, write) of writes waiting to be tried again
+        self._retries: List[Tuple[float, _Write]] = []
+        self._pending_rows = 0
+        self._oldest: Optional[float] = None
+        self._flush_requested = False
+        self._blocked = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ingest-writer")
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, statement: str, rows: Rows, timeout: Optional[float] = None,
+              replaces: Optional[Tuple[str, Any]] = None) -> Future:
+        """Queue rows for `statement`; blocks while the writer is backed up
+
+        `replaces` is (delete, key): `key` is deleted with the `delete`
+        statement, whose `{}` stands for the key placeholders, before the
+        rows are inserted.
+        """
+        future: Future = Future()
+        if not rows and replaces is None:
+            future.set_result(0)
+            return future
+        if replaces is not None:
+            with self._cond:
+                queued = any(write.delete == replaces[0] and write.key == replaces[1] for write in self._unfinished())
+            if queued:
+                # The earlier rows for this key must be written before they can be replaced
+                self.flush()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # An oversized write is still accepted once the queue has drained
+            while self._pending_rows and self._pending_rows + len(rows) > self.max_pending_rows:
+                if self._closed:
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"Ingest writer is backed up ({self._pending_rows} rows pending)")
+                # A blocked producer makes the writer flush without waiting for its thresholds
+                self._blocked += 1
+                self._cond.notify_all()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._blocked -= 1
+            if self._closed:
+                raise RuntimeError("Ingest writer is closed")
+            self._pending.append(_Write(future, statement, rows, replaces))
+            self._pending_rows += len(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._cond.notify_all()
+        return future
+
+    def delete(self, statement: str, key: Any) -> Future:
+        """Queue a delete of `key`; resolved once committed"""
+        return self.write("", [], replaces=(statement, key))
+
+    def execute(self, statements: List[str]) -> None:
+        """Run DDL on a connection of its own; DDL would commit a transaction open on it midway"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+            finally:
+                cursor.close()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write everything queued so far now; returns False if it did not finish within `timeout`
+
+        Writes waiting to be retried are included, so this can take their backoff.
+        """
+        with self._cond:
+            futures = [write.future for write in self._unfinished()]
+            self._flush_requested = True
+            self._cond.notify_all()
+        done, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self, timeout: Optional[float] = 30.0) -> None:
+        """Flush pending rows and stop the writer thread"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _unfinished(self) -> List[_Write]:
+        return self._pending + self._in_flight + [write for _, write in self._retries]
+
+    def _ready(self) -> bool:
+        # Retries skip their backoff once the writer is closing
+        if self._retries and (self._closed or self._retries[0][0] <= time.monotonic()):
+            return True
+        if not self._pending:
+            return False
+        if self._closed or self._flush_requested or self._blocked or self._pending_rows >= self.flush_rows:
+            return True
+        return time.monotonic() - self._oldest >= self.flush_interval
+
+    def _wait_time(self) -> Optional[float]:
+        now = time.monotonic()
+        waits = [due - now for due, _ in self._retries[:1]]
+        if self._oldest is not None:
+            waits.append(self.flush_interval - (now - self._oldest))
+        return max(0.0, min(waits)) if waits else None
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._ready():
+                    if self._closed:
+                        return
+                    self._cond.wait(self._wait_time())
+                now = time.monotonic()
+                due = [write for ready_at, write in self._retries if self._closed or ready_at <= now]
+                self._retries = [(ready_at, write) for ready_at, write in self._retries
+                                 if not (self._closed or ready_at <= now)]
+                writes = due + self._pending
+                self._pending = []
+                self._in_flight = writes
+                self._pending_rows = 0
+                self._oldest = None
+                self._flush_requested = False
+                # Producers blocked on backpressure may proceed while this batch is written
+                self._cond.notify_all()
+            failed = self._flush(writes)
+            with self._cond:
+                self._in_flight = []
+                for write, error in failed:
+                    self._fail(write, error)
+
+    def _flush(self, writes: List[_Write]) -> List[Tuple[_Write, Exception]]:
+        """Commit each table's writes in its own transaction; returns the writes that failed"""
+        groups: Dict[str, List[_Write]] = {}
+        for write in writes:
+            groups.setdefault(write.group, []).append(write)
+        failed: List[Tuple[_Write, Exception]] = []
+        with metrics.span("insert.flush"):
+            try:
+                with self.connection() as conn:
+                    for group in groups.values():
+                        failed.extend(self._commit_group(conn, group))
+            except Exception as e:
+                # Nothing can be written; fail everything at once instead of once per table
+                failed = [(write, e) for write in writes if not write.future.done()]
+        metrics.inc("devrag_writer_flushes_total", status="error" if failed else "ok")
+        return failed
+
+    def _fail(self, write: _Write, error: Exception) -> None:
+        write.attempts += 1
+        if write.attempts >= self.max_attempts:
+            logger.warning(f"Ingest write of {len(write.rows)} rows failed after {write.attempts} attempts: {error}")
+            if not write.future.done():
+                write.future.set_exception(error)
+            return
+        logger.warning(f"Ingest write of {len(write.rows)} rows failed "
+                       f"(attempt {write.attempts}/{self.max_attempts}), retrying: {error}")
+        self._retries.append((time.monotonic() + self.retry_delay * write.attempts, write))
+        self._retries.sort(key=lambda retry: retry[0])
+        self._cond.notify_all()
+
+    def _commit_group(self, conn, group: List[_Write]) -> List[Tuple[_Write, Exception]]:
+        try:
+            self._commit(conn, group)
+            return []
+        except Exception as e:
+            if len(group) == 1:
+                return [(group[0], e)]
+            logger.warning(f"Ingest flush of {len(group)} writes to one table failed, "
+                           f"writing them one by one: {e}")
+        failed = []
+        for write in group:
+            try:
+                self._commit(conn, [write])
+            except Exception as e:
+                failed.append((write, e))
+        return failed
+
+    def _commit(self, conn, writes: List[_Write]) -> None:
+        self._execute(conn, writes)
+        for write in writes:
+            if not write.future.done():
+                write.future.set_result(len(write.rows))
+
+    def _execute(self, conn, writes: List[_Write]) -> None:
+        deletes: Dict[str, List[Any]] = {}
+        batches: Dict[str, Rows] = {}
+        for write in writes:
+            if write.delete is not None:
+                deletes.setdefault(write.delete, []).append(write.key)
+            if write.rows:
+                batches.setdefault(write.statement, []).extend(write.rows)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            for statement, keys in deletes.items():
+                keys = list(dict.fromkeys(keys))
+                for start in range(0, len(keys), DELETE_KEYS):
+                    chunk = keys[start:start + DELETE_KEYS]
+                    cursor.execute(statement.format(", ".join(["%s"] * len(chunk))), chunk)
+            for statement, rows in batches.items():
+                cursor.executemany(statement, rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()